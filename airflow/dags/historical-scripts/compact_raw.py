@@ -0,0 +1,44 @@
+import sys
+import pandas as pd
+from pathlib import Path
+
+# historical-scripts is not a package, make the shared scripts/ modules importable
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from scripts import storage  # noqa: E402
+
+# One-time migration of the raw trees written one file per city and day:
+# every date folder becomes a single (gzipped) JSON Lines file.
+ROOTS = ("data", "historical-data")
+COMPACTED_NAME = "meteo_compacted"
+
+def compact_partition(partition_dir: Path, root: str, dry_run: bool = False) -> int:
+    files = storage.partition_files(partition_dir)
+    if not files or (len(files) == 1 and storage.raw_format(files[0]) == storage.RAW_FORMAT):
+        return 0
+    if dry_run:
+        print(f"{partition_dir}: {len(files)} files would be compacted")
+        return len(files)
+
+    # Same file order as read_partition, so the last row of a key stays the last
+    df = pd.concat([storage.read_file(f, nested=True) for f in files], ignore_index=True)
+    out_file = storage.write_partition(
+        df, partition_dir.name, COMPACTED_NAME, root=root,
+        fmt=storage.RAW_FORMAT if storage.RAW_FORMAT.startswith("jsonl") else "jsonl.gz",
+    )
+    # A crash before this point leaves the rows twice, which the upsert skips
+    for f in files:
+        if f != out_file:
+            f.unlink()
+    print(f"{partition_dir}: {len(files)} files -> {out_file.name} ({len(df)} rows)")
+    return len(files)
+
+def compact_raw(roots: tuple[str, ...] = ROOTS, dry_run: bool = False) -> int:
+    compacted = 0
+    for root in roots:
+        for partition_dir in storage.list_partitions("raw", root=root):
+            compacted += compact_partition(partition_dir, root, dry_run)
+    print(f"{compacted} raw files {'to compact' if dry_run else 'compacted'}")
+    return compacted
+
+if __name__ == "__main__":
+    compact_raw(dry_run="--dry-run" in sys.argv)
@@ -1,111 +1,68 @@
+import os
+import sys
 import pandas as pd
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import os
 
-def _clean_df(df : pd.DataFrame ) -> pd.DataFrame:
-    df.columns = (
-        df.columns.str.strip().str.lower().str.replace(" ", "_") 
-    )
-    
-    if "meteo" in df.columns:
-        df["meteo"] = (
-            df["meteo"]
-            .astype(str)
-            .str.lower()
-            .str.strip()
-            .str.replace(" ", "_")
-        )
-    numeric_cols = [
-        'temperature','humidite','pluie_mm','meteo','temp_min','temp_max'
-    ]
-    
-    numeric_cols = [
-        col for col in df.columns 
-        if any(pattern in col.lower() for pattern in numeric_cols)
-        and df[col].dtype == object
-    ]
-    
-    
-    # Clean extraction_date
-    if "extraction_date" in df.columns:
-        # Convert to datetime (timezone-naive)
-        df["extraction_date"] = pd.to_datetime(
-            df["extraction_date"],
-            errors='coerce',
-            dayfirst=True,
-            format='mixed'
-        )
-        
-        # Handle remaining NaT values
-        na_mask = df["extraction_date"].isna()
-        if na_mask.any():
-            df.loc[na_mask, "extraction_date"] = pd.to_datetime(
-                df.loc[na_mask, "extraction_date"],
-                errors='coerce',
-                format='ISO8601'
-            )
-        
-        # Normalize to date and ensure timezone-naive
-        df["extraction_date"] = df["extraction_date"].dt.tz_localize(None).dt.normalize()
-        
-    # Make sheet not turning the float into date
-    for col in numeric_cols:
-        # Remove non-numeric characters (keep digits, decimal points, and negative signs)
-        df[col] = df[col].astype(str).str.replace(r'[^\d.-]', '', regex=True)
-        
-        # Replace commas with dots for European decimal format
-        df[col] = df[col].str.replace('.', ',', regex=False)
-        
-        # Convert to numeric, coercing errors to NaN
-        df[col] = pd.to_numeric(df[col], errors='coerce')
-        
-        # Round to 2 decimal places if it's a float column
-        if pd.api.types.is_float_dtype(df[col]):
-            df[col] = df[col].round(2)
- 
-    return df
+# historical-scripts is not a package, make the shared scripts/ modules importable
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from scripts import storage  # noqa: E402
+from scripts.merge import upsert_chunks  # noqa: E402
+
+SOURCE = "open-meteo"
+# Rows handed to the upsert at once: peak memory follows this, not the history size
+CHUNK_ROWS = int(os.getenv("HISTORICAL_MERGE_CHUNK_ROWS", 500_000))
+READ_WORKERS = int(os.getenv("HISTORICAL_MERGE_READ_WORKERS", 8))
+
+def _read_dir(partition_dir: Path) -> list[pd.DataFrame]:
+    files = storage.partition_files(partition_dir)
+    if not files:
+        print(f"No csv in {partition_dir}")
+    return [storage.read_file(f) for f in files]
+
+def _read_dirs(raw_dirs: list[Path], workers: int):
+    # Directories are read ahead on a thread pool, at most 2 * workers in flight,
+    # and come back in date order
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for partition_dir in raw_dirs:
+            pending.append(executor.submit(_read_dir, partition_dir))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+def iter_chunks(raw_dirs: list[Path], chunk_rows: int = CHUNK_ROWS, workers: int = READ_WORKERS):
+    frames, rows, chunks = [], 0, 0
+    for frame in _read_dirs(raw_dirs, workers):
+        frames.append(frame)
+        rows += len(frame)
+        if rows >= chunk_rows:
+            chunks += 1
+            print(f"Chunk {chunks}: {rows} rows")
+            yield pd.concat(frames, ignore_index=True)
+            frames, rows = [], 0
+    if frames:
+        print(f"Chunk {chunks + 1}: {rows} rows")
+        yield pd.concat(frames, ignore_index=True)
+
+def merge_data(chunk_rows: int = CHUNK_ROWS, workers: int = READ_WORKERS):
+    raw_dir = storage.layer_dir("raw", root="historical-data")
 
-def merge_data():
-    # Relative path from $AIRFLOW_HOME
-    
-    base_dir = Path(os.getenv('AIRFLOW_HOME', Path(__file__).parent.parent))
-    raw_dir = base_dir / "historical-data" / "raw"
-    processed_dir = base_dir / "data" / "processed"
-    output_file = processed_dir / "meteo_global.csv"
-    processed_dir.mkdir(parents=True, exist_ok=True)
-    
     if not raw_dir.exists():
         raise FileNotFoundError(f"Input folder not found: {raw_dir}")
 
-    output_file.parent.mkdir(parents=True, exist_ok=True)
-
-    global_df = pd.DataFrame()
-    if output_file.exists() and output_file.stat().st_size > 0:
-        try:
-            global_df = pd.read_csv(output_file)
-        except:
-            print(f"Warning: Could not read existing output file {output_file}")
-            global_df = pd.DataFrame()
-    try:
-        raw_dirs = [d for d in raw_dir.iterdir() if d.is_dir()]
-    except:
+    raw_dirs = storage.list_partitions("raw", root="historical-data")
+    if not raw_dirs:
         raise FileExistsError(f"There is no dir in {raw_dir}")
-    
-    for dir in raw_dirs:
-        files = dir.glob("meteo_*.csv")
-        print(dir.name)
-        if not files:
-            print(f"No csv in {dir}")
-            continue
-        
-        data = pd.concat([pd.read_csv(f) for f in files], ignore_index=True)
-        
-        global_df = pd.concat([global_df, data])
-    
-    if global_df.empty:
+
+    # Upsert on (city, date, source): rerunning the merge adds no duplicates,
+    # and only rows missing from meteo_global or whose values changed are written
+    report = upsert_chunks(iter_chunks(raw_dirs, chunk_rows, workers), source=SOURCE, max_rows=chunk_rows)
+    if not sum(report.values()):
         raise ValueError("No data in all the csv")
-    
-    global_df.to_csv(output_file, index=False)
+    return report
 
 if __name__ == "__main__":
-    merge_data()
\ No newline at end of file
+    merge_data()
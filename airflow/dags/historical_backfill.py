@@ -0,0 +1,33 @@
+from airflow import DAG
+from airflow.operators.python import PythonOperator # type: ignore
+from datetime import datetime
+from scripts.lazy import task
+
+default_args = {
+    'owner': 'airflow',
+    'depends_on_past': False,
+    'start_date': datetime(2021, 1, 1)
+}
+
+# One run per month of history, catchup replays every month since start_date.
+# Finished (city, month) chunks are checkpointed, a failed run resumes where it stopped.
+with DAG(
+    'weather_historical_backfill',
+    default_args=default_args,
+    schedule='@monthly',
+    catchup=True,
+    max_active_runs=2,
+    render_template_as_native_obj=True,
+    params={"cities": None, "max_workers": None},     # None: backfill.MAX_WORKERS
+) as dag:
+
+    backfill_task = PythonOperator(
+        task_id='backfill_month',
+        python_callable=task("scripts.backfill:backfill"),
+        op_kwargs={
+            "start_date": "{{ data_interval_start | ds }}",
+            "end_date": "{{ macros.ds_add(data_interval_end | ds, -1) }}",
+            "cities": "{{ params.cities }}",
+            "max_workers": "{{ params.max_workers }}",
+        },
+    )
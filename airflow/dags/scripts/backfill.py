@@ -0,0 +1,168 @@
+import json
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import pandas as pd
+import openmeteo_requests
+from scripts import cities as city_registry
+from scripts import http_cache
+from scripts import metrics
+from scripts import payloads
+from scripts import storage
+
+ARCHIVE_URL = "https://archive-api.open-meteo.com/v1/archive"
+ROOT = "historical-data"
+CHECKPOINT_NAME = "_backfill_checkpoint.jsonl"
+MAX_WORKERS = 4
+
+_checkpoint_lock = threading.Lock()
+
+# ================= CHECKPOINT =================
+# Append-only log of finished chunks, one JSON line each: resuming only
+# re-reads it, and marking a chunk as done never rewrites the file.
+# A chunk whose last days were not published yet (http_cache.ARCHIVE_DELAY_DAYS)
+# is logged as incomplete, and fetched again by the next runs until it is not.
+
+def _checkpoint_file():
+    return storage.BASE_DIR / ROOT / CHECKPOINT_NAME
+
+def _chunk_key(city: str, start: str, end: str) -> str:
+    return f"{city}|{start}|{end}"
+
+def _load_checkpoint() -> dict[str, bool]:
+    # chunk -> complete, the last line of a chunk wins
+    if not _checkpoint_file().exists():
+        return {}
+    with open(_checkpoint_file(), encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    return {entry["chunk"]: entry.get("complete", True) for entry in entries}
+
+def _mark_done(city: str, start: str, end: str, rows: int, complete: bool = True) -> None:
+    line = json.dumps(
+        {"chunk": _chunk_key(city, start, end), "rows": rows, "complete": complete}, ensure_ascii=False
+    )
+    with _checkpoint_lock:
+        _checkpoint_file().parent.mkdir(parents=True, exist_ok=True)
+        with open(_checkpoint_file(), "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+# ================= CHUNKS =================
+
+def month_chunks(start_date: str, end_date: str, cities: list[str]) -> list[tuple[str, str, str]]:
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    if start > end:
+        raise ValueError(f"start_date {start_date} is after end_date {end_date}")
+
+    chunks = []
+    for city in cities:
+        for month in pd.period_range(start, end, freq="M"):
+            chunk_start = max(month.start_time, start)
+            chunk_end = min(month.end_time.normalize(), end)
+            chunks.append((city, chunk_start.strftime("%Y-%m-%d"), chunk_end.strftime("%Y-%m-%d")))
+    return chunks
+
+def get_client() -> openmeteo_requests.Client:
+    # Archive responses never expire in the cache, a resumed or replayed month costs no API call
+    cached_session = http_cache.get_cached_session(retries=5, backoff_factor=0.2, pool_size=MAX_WORKERS)
+    return openmeteo_requests.Client(session=cached_session)  # type: ignore
+
+def _complete(df: pd.DataFrame) -> bool:
+    # Days not published yet come back null
+    recent = [http_cache.in_archive_delay(day.strftime("%Y-%m-%d")) for day in df["extraction_date"]]
+    return not df.loc[recent, "temperature"].isna().any()
+
+def fetch_chunk(client, city: str, start: str, end: str, refresh: bool = False) -> pd.DataFrame:
+    entry = city_registry.get_city(city)
+    params = {
+        "latitude": entry["latitude"],
+        "longitude": entry["longitude"],
+        "start_date": start,
+        "end_date": end,
+        "daily": payloads.OPEN_METEO_DAILY,
+        "timezone": entry["timezone"],
+        **payloads.OPEN_METEO_PARAMS,
+    }
+    headers = {"Cache-Control": "no-cache"} if refresh else {}
+    daily = client.weather_api(ARCHIVE_URL, params=params, headers=headers)[0].Daily()
+
+    dates = pd.date_range(
+        start = pd.to_datetime(daily.Time(), unit = "s", utc = True),
+        end = pd.to_datetime(daily.TimeEnd(), unit = "s", utc = True),
+        freq = pd.Timedelta(seconds = daily.Interval()),
+        inclusive = "left"
+    )
+    variables = {
+        variable: daily.Variables(i).ValuesAsNumpy()
+        for i, variable in enumerate(payloads.OPEN_METEO_DAILY)
+    }
+    # Every variable is archived in the payload, the columns are derived from it
+    return payloads.from_daily(city, dates, variables)
+
+# ================= BACKFILL =================
+
+@metrics.instrumented("backfill")
+def backfill(
+    start_date: str,
+    end_date: str,
+    cities: list[str] | None = None,
+    max_workers: int | None = MAX_WORKERS,
+) -> int:
+    max_workers = max_workers or MAX_WORKERS
+    cities = cities or city_registry.city_names()
+    unknown = [city for city in cities if city_registry.get_city(city) is None]
+    if unknown:
+        raise ValueError(f"Cities not in the registry: {unknown}")
+
+    checkpoint = _load_checkpoint()
+    chunks = month_chunks(start_date, end_date, cities)
+    todo = [c for c in chunks if not checkpoint.get(_chunk_key(*c))]
+    # Incomplete chunks of earlier runs too, e.g. the end of the previous month for a @monthly run
+    retries = [
+        chunk for chunk in (tuple(key.split("|")) for key, complete in checkpoint.items() if not complete)
+        if chunk[0] in cities and chunk not in todo
+    ]
+    pending = iter(todo + retries)
+    print(
+        f"Backfill {start_date} -> {end_date}: {len(chunks)} chunks, {len(chunks) - len(todo)} already done, "
+        f"{len(retries)} incomplete chunks of earlier runs"
+    )
+
+    client = get_client()
+    fetched, incomplete, failed = 0, 0, {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = {}
+
+        def submit_next() -> None:
+            chunk = next(pending, None)
+            if chunk is not None:
+                # Fetched before: incomplete, the cached response has the null days
+                refresh = _chunk_key(*chunk) in checkpoint
+                in_flight[executor.submit(fetch_chunk, client, *chunk, refresh)] = chunk
+
+        # A bounded window of chunks in memory, whatever the size of the range
+        for _ in range(max_workers * 2):
+            submit_next()
+
+        while in_flight:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                city, start, end = in_flight.pop(future)
+                try:
+                    df = future.result()
+                except Exception as e:
+                    failed[_chunk_key(city, start, end)] = e
+                else:
+                    # Streamed to disk as soon as the chunk arrives
+                    storage.write_partition(df, start[:7], f"meteo_{city}_{start}_{end}", root=ROOT)
+                    complete = _complete(df)
+                    _mark_done(city, start, end, len(df), complete)
+                    fetched += 1
+                    incomplete += not complete
+                submit_next()
+
+    if failed:
+        raise RuntimeError(f"{len(failed)} chunks failed, rerun to resume: {failed}")
+    if incomplete:
+        print(f"{incomplete} chunks end within the archive delay, the next runs fetch them again")
+    print(f"{fetched} chunks fetched, cache: {http_cache.get_cache().stats()}")
+    return fetched
@@ -0,0 +1,53 @@
+import csv
+import math
+import os
+from functools import lru_cache
+from pathlib import Path
+
+# City registry shared by the daily and the historical extractors.
+# One row per location: id,name,latitude,longitude,timezone
+CITY_REGISTRY = Path(os.getenv("WEATHER_CITY_REGISTRY", Path(__file__).parent.parent / "config" / "cities.csv"))
+CHUNK_SIZE = 200
+
+
+@lru_cache(maxsize=None)
+def load_cities(path: Path = CITY_REGISTRY) -> tuple[dict, ...]:
+    # Read once per process, every caller shares the same rows
+    with open(path, newline="", encoding="utf-8") as f:
+        cities = tuple(
+            {
+                "id":        int(row["id"]),
+                "name":      row["name"].strip(),
+                "latitude":  float(row["latitude"]),
+                "longitude": float(row["longitude"]),
+                "timezone":  row["timezone"].strip(),
+            }
+            for row in csv.DictReader(f)
+        )
+
+    names = [city["name"] for city in cities]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate city names in {path}")
+    return cities
+
+
+@lru_cache(maxsize=None)
+def _by_name(path: Path = CITY_REGISTRY) -> dict[str, dict]:
+    return {city["name"]: city for city in load_cities(path)}
+
+
+def city_names(path: Path = CITY_REGISTRY) -> list[str]:
+    return [city["name"] for city in load_cities(path)]
+
+
+def get_city(name: str, path: Path = CITY_REGISTRY) -> dict | None:
+    return _by_name(path).get(name)
+
+
+def chunk_count(chunk_size: int = CHUNK_SIZE, path: Path = CITY_REGISTRY) -> int:
+    return math.ceil(len(load_cities(path)) / chunk_size)
+
+
+def get_chunk(index: int, chunk_size: int = CHUNK_SIZE, path: Path = CITY_REGISTRY) -> list[dict]:
+    cities = load_cities(path)
+    return list(cities[index * chunk_size:(index + 1) * chunk_size])
@@ -0,0 +1,146 @@
+from typing import NamedTuple
+import pandas as pd
+
+# Cleaning shared by the daily and the historical merges, driven by the
+# schema below. Values are parsed with typed, vectorized paths: text is only
+# scanned for the rows the fast path could not parse. Number formatting for
+# the Sheets users (decimal comma) is left to the CSV export, see storage.py.
+
+
+class Column(NamedTuple):
+    kind: str                                   # "string", "label", "float" or "datetime"
+    unit: str | None = None
+    valid_range: tuple[float, float] | None = None
+    required: bool = False                      # rows without it are rejected
+
+
+SCHEMA = {
+    "city":            Column("string", required=True),
+    "extraction_date": Column("datetime", required=True),
+    "temperature":     Column("float", "°C", (-90, 60)),
+    "humidite":        Column("float", "%", (0, 100)),
+    "pluie_mm":        Column("float", "mm", (0, 2000)),
+    "meteo":           Column("label"),
+    "temp_min":        Column("float", "°C", (-90, 60)),
+    "temp_max":        Column("float", "°C", (-90, 60)),
+    "pression":        Column("float", "hPa", (850, 1100)),
+    "vent":            Column("float", "m/s", (0, 120)),
+    "nuages":          Column("float", "%", (0, 100)),
+    "code_meteo":      Column("float"),
+}
+
+# Anything but the number itself: units, spaces, thousands separators...
+_NOT_NUMERIC = r"[^\d.eE+-]"
+
+
+def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
+    df.columns = df.columns.str.strip().str.lower().str.replace(" ", "_")
+    return df
+
+
+def parse_float(values: pd.Series) -> pd.Series:
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        # float32 from a compact read stays float32
+        return values if values.dtype == "float32" else values.astype("float64")
+
+    parsed = pd.to_numeric(values, errors="coerce")
+    failed = parsed.isna() & values.notna()
+    if failed.any():
+        # Slow path on the leftovers only: "21,3", "21.3 °C", " 64 %"
+        text = (
+            values[failed].astype(str)
+            .str.replace(",", ".", regex=False)
+            .str.replace(_NOT_NUMERIC, "", regex=True)
+        )
+        parsed[failed] = pd.to_numeric(text, errors="coerce")
+    return parsed.astype("float64")
+
+
+def parse_datetime(values: pd.Series) -> pd.Series:
+    if not pd.api.types.is_datetime64_any_dtype(values):
+        # utc=True: historical rows carry an offset while daily rows are naive
+        parsed = pd.to_datetime(values, errors="coerce", format="ISO8601", utc=True)
+        failed = parsed.isna() & values.notna()
+        if failed.any():
+            # Non ISO leftovers, e.g. "01/07/2025 14:00" from a Sheets export
+            parsed[failed] = pd.to_datetime(
+                values[failed], errors="coerce", format="mixed", dayfirst=True, utc=True
+            )
+        values = parsed
+
+    if isinstance(values.dtype, pd.DatetimeTZDtype):
+        values = values.dt.tz_convert("UTC").dt.tz_localize(None)
+    return values.astype("datetime64[ns]").dt.normalize()
+
+
+def _per_distinct_value(values: pd.Series, clean) -> pd.Series:
+    # Cities and weather labels have a handful of distinct values:
+    # the string work is done once per value, then broadcast with the codes
+    codes, uniques = pd.factorize(values)
+    cleaned = pd.array([*clean(pd.Series(uniques)), pd.NA], dtype="string")
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Compact reads stay categorical: two values may clean to the same label
+        label_codes, labels = pd.factorize(cleaned)
+        categories = pd.Categorical.from_codes(label_codes[codes], categories=labels.astype(str))
+        return pd.Series(categories, index=values.index)
+    return pd.Series(cleaned.take(codes), index=values.index)     # code -1 (missing) takes the NA
+
+
+def _clean_label(values: pd.Series) -> pd.Series:
+    if pd.api.types.is_numeric_dtype(values):
+        # Weather codes come back as floats from Open-Meteo: 3.0 -> "3"
+        return values.round().astype("Int64").astype("string")
+    labels = values.astype("string").str.strip().str.lower().str.replace(" ", "_", regex=False)
+    return labels.str.replace(r"^(\d+)\.0+$", r"\1", regex=True)
+
+
+def _clean_string(values: pd.Series) -> pd.Series:
+    strings = values.astype("string").str.strip()
+    return strings.mask(strings == "")
+
+
+def parse_label(values: pd.Series) -> pd.Series:
+    return _per_distinct_value(values, _clean_label)
+
+
+def parse_string(values: pd.Series) -> pd.Series:
+    return _per_distinct_value(values, _clean_string)
+
+
+def clean_df(df: pd.DataFrame, schema: dict[str, Column] = SCHEMA) -> tuple[pd.DataFrame, dict]:
+    df = normalize_columns(df)
+    report = {"rows": len(df), "rejected": 0, "invalid": {}}
+
+    for col, column in schema.items():
+        if col not in df.columns:
+            continue
+        values = df[col]
+        if column.kind == "float":
+            parsed = parse_float(values)
+            if column.valid_range is not None:
+                low, high = column.valid_range
+                parsed = parsed.mask((parsed < low) | (parsed > high))
+            parsed = parsed.round(2)
+        elif column.kind == "datetime":
+            parsed = parse_datetime(values)
+        elif column.kind == "label":
+            parsed = parse_label(values)
+        else:
+            parsed = parse_string(values)
+
+        invalid = int((parsed.isna() & values.notna()).sum())
+        if invalid:
+            report["invalid"][col] = invalid
+        df[col] = parsed
+
+    required = [col for col, column in schema.items() if column.required and col in df.columns]
+    if required:
+        keep = df[required].notna().all(axis=1).to_numpy()
+        report["rejected"] = int((~keep).sum())
+        if not keep.all():
+            df = df[keep].reset_index(drop=True)
+
+    if report["rejected"] or report["invalid"]:
+        print(f"Cleaning: {report['rejected']}/{report['rows']} rows rejected, invalid values set to null: {report['invalid']}")
+    return df, report
+
@@ -0,0 +1,126 @@
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+import pandas as pd
+from scripts import metrics
+from scripts import storage
+
+# Per-run exports of the star schema. A transform run writes the facts it
+# inserted or updated and the new dimension rows to deltas/<table>/delta_<ds>,
+# and the tables themselves are snapshots, rewritten only when the deltas are
+# folded in: every COMPACT_EVERY runs, and on a full rebuild. The Drive sync then
+# sends a day of rows a day instead of the whole fact table.
+#
+# A table is its snapshot plus its deltas applied in the manifest order, the
+# last row of a key wins. deltas/_manifest.json lists the runs not folded yet.
+LAYER = "star_schema"
+KEYS = {
+    "fact_weather": ["city_id", "date_id"],
+    "dim_city":     ["city_id"],
+    "dim_date":     ["date_id"],
+}
+PARTITION_COLS = {"fact_weather": ["city_id"]}
+COMPACT_EVERY = int(os.getenv("WEATHER_STAR_COMPACT_EVERY", 7))
+MANIFEST_NAME = "_manifest.json"
+
+def _deltas_dir():
+    return storage.layer_dir(LAYER) / "deltas"
+
+def _delta_layer(table: str) -> str:
+    return f"{LAYER}/deltas/{table}"
+
+def load_manifest() -> dict:
+    # "written": deltas written since the first run, never reset by a compaction
+    manifest_file = _deltas_dir() / MANIFEST_NAME
+    if not manifest_file.exists():
+        return {"runs": [], "snapshots": 0, "compacted_at": None, "written": 0}
+    with open(manifest_file) as f:
+        return json.load(f)
+
+def _save_manifest(manifest: dict) -> None:
+    manifest_file = _deltas_dir() / MANIFEST_NAME
+    with storage.atomic_path(manifest_file) as tmp_file:
+        with open(tmp_file, "w") as f:
+            json.dump(manifest, f, indent=2)
+
+def exists(table: str) -> bool:
+    return storage.table_exists(table, LAYER) or any(
+        storage.table_exists(f"delta_{run}", _delta_layer(table)) for run in load_manifest()["runs"]
+    )
+
+def read(table: str, filters: list[tuple] | None = None) -> pd.DataFrame:
+    frames = []
+    if storage.table_exists(table, LAYER):
+        frames.append(storage.read_table(table, LAYER, filters=filters))
+    for run in load_manifest()["runs"]:
+        if storage.table_exists(f"delta_{run}", _delta_layer(table)):
+            frames.append(storage.read_table(f"delta_{run}", _delta_layer(table), filters=filters))
+    if not frames:
+        # Neither snapshot nor delta: same error as a missing table
+        return storage.read_table(table, LAYER, filters=filters)
+    if len(frames) == 1:
+        return frames[0]
+    df = pd.concat(frames, ignore_index=True)
+    return df.drop_duplicates(subset=KEYS[table], keep="last").reset_index(drop=True)
+
+def write(frames: dict[str, pd.DataFrame], ds: str) -> dict[str, str]:
+    # One delta per table for this run. The caller holds the star_schema lock.
+    # Files first, then the manifest: a crash in between leaves files no reader lists.
+    frames = {table: df for table, df in frames.items() if not df.empty}
+    if not frames:
+        return {}
+    manifest = load_manifest()
+    # A second run for the same ds (a rerun) gets its own delta, after the first one
+    run, n = ds, 1
+    while run in manifest["runs"]:
+        n += 1
+        run = f"{ds}_{n}"
+    paths = {
+        table: str(storage.write_table(df, f"delta_{run}", _delta_layer(table)))
+        for table, df in frames.items()
+    }
+    manifest["runs"].append(run)
+    manifest["written"] = manifest.get("written", 0) + 1
+    _save_manifest(manifest)
+    return paths
+
+def written() -> int:
+    return load_manifest().get("written", 0)
+
+@metrics.instrumented("compact")
+def compact(rebuilt: tuple[str, ...] = (), locked: bool = False) -> dict[str, int]:
+    # Folds the deltas into the snapshots.
+    # rebuilt: tables whose snapshot was just rewritten in full, their deltas are dropped.
+    # locked: the caller already holds the star_schema lock (the transform).
+    if locked:
+        return _compact(rebuilt)
+    with storage.lock(LAYER):
+        return _compact(rebuilt)
+
+def _compact(rebuilt: tuple[str, ...]) -> dict[str, int]:
+    manifest = load_manifest()
+    sizes = {}
+    if manifest["runs"]:
+        for table in KEYS:
+            if table in rebuilt or not any(
+                storage.table_exists(f"delta_{run}", _delta_layer(table)) for run in manifest["runs"]
+            ):
+                continue
+            df = read(table)
+            storage.write_table(df, table, LAYER, partition_cols=PARTITION_COLS.get(table))
+            sizes[table] = len(df)
+
+    # Snapshots first: until the manifest is saved, readers apply deltas already
+    # in the snapshot again, which gives the same rows
+    folded = len(manifest["runs"])
+    manifest.update(
+        runs=[], snapshots=manifest["snapshots"] + 1,
+        compacted_at=datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    )
+    _save_manifest(manifest)
+    for table in KEYS:
+        shutil.rmtree(_deltas_dir() / table, ignore_errors=True)
+    metrics.record(files_in=folded)
+    print(f"{folded} star schema deltas folded into the snapshots {sizes}")
+    return sizes
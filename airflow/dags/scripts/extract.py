@@ -1,36 +1,136 @@
 from datetime import datetime                    # ← you need datetime.datetime, not datetime module
-from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+import time
 import os
-import requests
-import pandas as pd
+from scripts import cities as city_registry
+from scripts import http_cache
+from scripts import metrics
+from scripts import payloads
+from scripts import storage
 
-BASE_DIR = Path(os.getenv("AIRFLOW_HOME", Path(__file__).parent.parent))
+OPENWEATHER_URL = "https://api.openweathermap.org/data/2.5/weather"
+MAX_WORKERS = 8
+# OpenWeatherMap quota, free plan is 60 calls/minute
+CALLS_PER_MINUTE = int(os.getenv("OPENWEATHER_CALLS_PER_MINUTE", 60))
 
-def extract_forecast_data(city: str, api_key: str, date: str) -> bool:
-    url = "https://api.openweathermap.org/data/2.5/weather"
-    params = {"q": city, "appid": api_key, "units": "metric", "lang": "fr"}
+class RateLimiter:
+    # Sliding one-minute window: at most `calls_per_minute` calls started per 60s
+    def __init__(self, calls_per_minute: int, period: float = 60.0):
+        self.calls_per_minute = calls_per_minute
+        self.period = period
+        self._calls: deque[float] = deque()
+        self._lock = threading.Lock()
 
-    resp = requests.get(url, params=params, timeout=100)
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            slot = now
+            if len(self._calls) >= self.calls_per_minute:
+                slot = max(now, self._calls.popleft() + self.period)
+            self._calls.append(slot)
+        time.sleep(max(0.0, slot - now))
+
+def _city_params(city: str, api_key: str) -> dict:
+    params = {"appid": api_key, "units": "metric", "lang": "fr"}
+    entry = city_registry.get_city(city)
+    if entry is None:
+        params["q"] = city
+    else:
+        # Coordinates are unambiguous, names are not once we track thousands of places
+        params.update(lat=entry["latitude"], lon=entry["longitude"])
+    return params
+
+@metrics.instrumented("extract")
+def extract_forecast_data(city: str, api_key: str, date: str, url: str = OPENWEATHER_URL) -> bool:
+    params = _city_params(city, api_key)
+
+    with http_cache.get_cached_session(pool_size=1) as session:
+        resp = session.get(url, params=params, timeout=100)
     resp.raise_for_status()                                # raises if HTTP error
 
-    data = resp.json()
-    record = {
-        "city":          city,
-        "extraction_date": datetime.now(),
-        "temperature":    data["main"]["temp"],
-        "humidite":       data["main"]["humidity"],
-        "pluie_mm": data.get("rain", {}).get("1h", 0),
-        "meteo": data["weather"][0]["main"],
-        "temp_min":     data["main"]["temp_min"],
-        "temp_max":     data["main"]["temp_max"],
-    }
-
-    # data path
-    target_dir = BASE_DIR / "data" / "raw" / date
-    target_dir.mkdir(parents=True, exist_ok=True)
-
-    out_file = target_dir / f"meteo_{city}.csv"
     # ------ cleaning --------
-    df = pd.DataFrame([record])
-    df.to_csv(out_file, index=False, float_format="%.2f")
-    return True
\ No newline at end of file
+    df = payloads.from_responses([city], [datetime.now()], [resp.json()], "meteo_forecast")
+    if storage.RAW_FORMAT == "parquet":
+        storage.write_partition(df, date, f"meteo_{city}")
+    else:
+        # One line per city in the day's file instead of one file per city
+        storage.write_partition(df, date, "meteo_forecast", mode="append")
+    metrics.record(rows_in=1, rows_out=len(df))
+    return True
+
+@metrics.instrumented("extract")
+def extract_all_cities(
+    cities: list[str],
+    api_key: str,
+    date: str,
+    url: str = OPENWEATHER_URL,
+    max_workers: int = MAX_WORKERS,
+    calls_per_minute: int = CALLS_PER_MINUTE,
+    batch_name: str = "meteo_all_cities",
+) -> str:
+    if not cities:
+        raise ValueError("No city to extract")
+
+    limiter = RateLimiter(calls_per_minute)
+    # Keep-alive connections shared by all the workers, TLS handshake done once per connection.
+    # Retries of the task are served from the response cache and do not use the quota.
+    session = http_cache.get_cached_session(pool_size=max_workers)
+    cache = http_cache.get_cache()
+    hits_before = cache.hits
+
+    def fetch(city: str) -> tuple[str, datetime, dict]:
+        params = _city_params(city, api_key)
+        if not http_cache.is_cached(url, params):
+            limiter.wait()
+        resp = session.get(url, params=params, timeout=100)
+        resp.raise_for_status()
+        return city, datetime.now(), resp.json()
+
+    records, failed = [], {}
+    with session, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(fetch, city): city for city in cities}
+        for future in as_completed(futures):
+            city = futures[future]
+            try:
+                records.append(future.result())
+            except Exception as e:
+                failed[city] = e
+
+    if records:
+        # One combined partition for the whole batch instead of one file per city,
+        # the columns are derived from the responses in one vectorized pass
+        names, fetched_at, responses = map(list, zip(*sorted(records, key=lambda r: r[0])))
+        df = payloads.from_responses(names, fetched_at, responses, batch_name)
+        out_file = storage.write_partition(df, date, batch_name)
+        metrics.record(rows_in=len(cities), rows_out=len(df))
+        print(f"{len(records)} cities written to {out_file} ({cache.hits - hits_before} served from cache)")
+
+    if failed:
+        raise RuntimeError(f"Extraction failed for {len(failed)} cities: {failed}")
+    return str(out_file)
+
+def plan_city_chunks(chunk_size: int = city_registry.CHUNK_SIZE) -> list[list[int]]:
+    # Only chunk indexes go through XCom, each mapped task reads its cities from the registry
+    return [[index] for index in range(city_registry.chunk_count(chunk_size))]
+
+def extract_city_chunk(
+    chunk_index: int,
+    api_key: str,
+    date: str,
+    chunk_size: int = city_registry.CHUNK_SIZE,
+    calls_per_minute: int = CALLS_PER_MINUTE,
+    slots: int = 1,
+) -> str:
+    # slots: chunks extracted at the same time, they share the quota. A registry
+    # with fewer chunks than slots never runs them all at once.
+    chunk = city_registry.get_chunk(chunk_index, chunk_size)
+    sharing = max(1, min(slots, city_registry.chunk_count(chunk_size)))
+    return extract_all_cities(
+        [city["name"] for city in chunk],
+        api_key,
+        date,
+        calls_per_minute=max(1, calls_per_minute // sharing),
+        batch_name=f"meteo_chunk_{chunk_index:05d}",
+    )
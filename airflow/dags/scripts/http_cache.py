@@ -0,0 +1,269 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from urllib3.util.retry import Retry
+from scripts import metrics
+from scripts import storage
+
+# API response cache shared by the daily and the historical extractors.
+# Responses are kept in one sqlite file under AIRFLOW_HOME, with a TTL per
+# endpoint and least-recently-used eviction once the file exceeds its budget.
+CACHE_DIR = Path(os.getenv("WEATHER_CACHE_DIR", storage.BASE_DIR / "cache"))
+CACHE_MAX_BYTES = int(float(os.getenv("WEATHER_CACHE_MAX_MB", 512)) * 1024 * 1024)
+
+# Seconds a response stays valid, per host. None: never expires, 0: not cached.
+ARCHIVE_HOST = "archive-api.open-meteo.com"
+ENDPOINT_TTLS = {
+    ARCHIVE_HOST: None,                     # archive data is immutable
+    "api.openweathermap.org": int(os.getenv("OPENWEATHER_CACHE_TTL", 600)),
+}
+DEFAULT_TTL = 0
+# ...once published: the archive lags a few days behind, a range ending in the
+# last ARCHIVE_DELAY_DAYS comes back with null days and is only kept an hour
+ARCHIVE_DELAY_DAYS = int(os.getenv("OPEN_METEO_ARCHIVE_DELAY_DAYS", 7))
+RECENT_ARCHIVE_TTL = 3600
+# Query parameters holding credentials: never stored, nor part of the cache key
+SECRET_PARAMS = {"appid", "apikey", "api_key", "key", "token", "access_token"}
+# PRAGMA user_version of an up-to-date cache file, see ResponseCache._migrate
+SCHEMA_VERSION = 1
+
+
+def in_archive_delay(day: str) -> bool:
+    # UTC dates: the archive is published per UTC day
+    cutoff = datetime.now(timezone.utc).date() - timedelta(days=ARCHIVE_DELAY_DAYS)
+    return date.fromisoformat(day[:10]) > cutoff
+
+
+class ResponseCache:
+    def __init__(self, path: Path, max_bytes: int = CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = self.misses = self.evictions = 0
+        self._lock = threading.Lock()
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key         TEXT PRIMARY KEY,
+                url         TEXT NOT NULL,
+                status      INTEGER NOT NULL,
+                headers     TEXT NOT NULL,
+                body        BLOB NOT NULL,
+                size        INTEGER NOT NULL,
+                expires_at  REAL,
+                last_access REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_access)")
+        self._conn.commit()
+        self._migrate()
+
+    def _migrate(self) -> None:
+        # Once per cache file, not on every open: the file is shared by every
+        # task, the first one to open it migrates it under a write lock
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            if self._conn.execute("PRAGMA user_version").fetchone()[0] < 1:
+                # Rows stored before the credentials were stripped from the URLs
+                for key, url in self._conn.execute("SELECT key, url FROM responses").fetchall():
+                    if self.redact(url) != url:
+                        self._conn.execute("UPDATE responses SET url = ? WHERE key = ?", (self.redact(url), key))
+                # Total size of the bodies, kept by triggers for every process
+                # writing the file: set() never sums the table
+                self._conn.execute("CREATE TABLE cache_size (total INTEGER NOT NULL)")
+                self._conn.execute("INSERT INTO cache_size SELECT COALESCE(SUM(size), 0) FROM responses")
+                for statement in (
+                    """CREATE TRIGGER responses_size_insert AFTER INSERT ON responses
+                       BEGIN UPDATE cache_size SET total = total + NEW.size; END""",
+                    """CREATE TRIGGER responses_size_update AFTER UPDATE OF size ON responses
+                       BEGIN UPDATE cache_size SET total = total + NEW.size - OLD.size; END""",
+                    """CREATE TRIGGER responses_size_delete AFTER DELETE ON responses
+                       BEGIN UPDATE cache_size SET total = total - OLD.size; END""",
+                ):
+                    self._conn.execute(statement)
+            self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self._conn.commit()
+        except BaseException:
+            self._conn.rollback()
+            raise
+
+    @staticmethod
+    def ttl_for(url: str) -> int | None:
+        parts = urlsplit(url)
+        host = parts.hostname or ""
+        if host == ARCHIVE_HOST:
+            end_date = dict(parse_qsl(parts.query)).get("end_date")
+            if end_date and in_archive_delay(end_date):
+                return RECENT_ARCHIVE_TTL
+        return ENDPOINT_TTLS.get(host, DEFAULT_TTL)
+
+    @staticmethod
+    def redact(url: str) -> str:
+        parts = urlsplit(url)
+        query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k.lower() not in SECRET_PARAMS]
+        return urlunsplit(parts._replace(query=urlencode(query)))
+
+    @classmethod
+    def key_for(cls, method: str, url: str) -> str:
+        # Same key whatever the API key: a rotated key keeps its cached responses
+        return hashlib.sha256(f"{method} {cls.redact(url)}".encode()).hexdigest()
+
+    def get(self, key: str) -> tuple[int, dict, bytes] | None:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, headers, body, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (row[3] is not None and row[3] < now):
+                if row is not None:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return row[0], json.loads(row[1]), row[2]
+
+    def contains(self, key: str) -> bool:
+        # Lookup without touching the counters nor the LRU order
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        return row is not None and (row[0] is None or row[0] >= time.time())
+
+    def set(self, key: str, url: str, status: int, headers: dict, body: bytes, ttl: int | None) -> None:
+        now = time.time()
+        expires_at = None if ttl is None else now + ttl
+        with self._lock:
+            # An upsert rather than INSERT OR REPLACE: the implicit delete of a
+            # replace does not fire the size triggers
+            self._conn.execute(
+                """INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (key) DO UPDATE SET
+                       url = excluded.url, status = excluded.status, headers = excluded.headers,
+                       body = excluded.body, size = excluded.size, expires_at = excluded.expires_at,
+                       last_access = excluded.last_access""",
+                (key, self.redact(url), status, json.dumps(headers), body, len(body), expires_at, now),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        total = self._conn.execute("SELECT total FROM cache_size").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Oldest accesses first until the cache fits in its budget again
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM responses ORDER BY last_access"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT (SELECT COUNT(*) FROM responses), total FROM cache_size"
+            ).fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": size,
+        }
+
+
+class CachingAdapter(HTTPAdapter):
+    # Serves GET requests from the cache, only misses reach the network (with retries)
+    def __init__(self, cache: ResponseCache, **kwargs):
+        self.cache = cache
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        ttl = self.cache.ttl_for(request.url)
+        if request.method != "GET" or ttl == 0:
+            return self._send_timed(request, **kwargs)
+
+        key = self.cache.key_for(request.method, request.url)
+        # "Cache-Control: no-cache" goes to the network, the fresh response replaces the cached one
+        refresh = "no-cache" in request.headers.get("Cache-Control", "")
+        cached = None if refresh else self.cache.get(key)
+        if cached is not None:
+            metrics.record_http(0.0, cached=True)
+            return self._build_cached_response(request, *cached)
+
+        response = self._send_timed(request, **kwargs)
+        if response.status_code == 200:
+            # The body is stored decoded, drop the headers describing the wire encoding
+            headers = {
+                k: v for k, v in response.headers.items()
+                if k.lower() not in ("content-encoding", "transfer-encoding", "content-length")
+            }
+            self.cache.set(key, request.url, response.status_code, headers, response.content, ttl)
+        return response
+
+    def _send_timed(self, request, **kwargs) -> requests.Response:
+        start = time.perf_counter()
+        try:
+            return super().send(request, **kwargs)
+        finally:
+            metrics.record_http(time.perf_counter() - start, cached=False)
+
+    def _build_cached_response(self, request, status: int, headers: dict, body: bytes) -> requests.Response:
+        response = requests.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = body
+        response.url = request.url
+        response.request = request
+        response.reason = "OK"
+        response.connection = self
+        return response
+
+
+_caches: dict[Path, ResponseCache] = {}
+_caches_lock = threading.Lock()
+
+def get_cache(name: str = "http_cache.sqlite") -> ResponseCache:
+    # One connection per file and process, shared by every session
+    path = CACHE_DIR / name
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = ResponseCache(path)
+        return _caches[path]
+
+def get_cached_session(retries: int = 3, backoff_factor: float = 0.5, pool_size: int = 10) -> requests.Session:
+    max_retries = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = CachingAdapter(
+        get_cache(), pool_connections=1, pool_maxsize=pool_size, max_retries=max_retries
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def is_cached(url: str, params: dict | None = None) -> bool:
+    prepared = requests.Request("GET", url, params=params).prepare()
+    cache = get_cache()
+    if cache.ttl_for(prepared.url) == 0:
+        return False
+    return cache.contains(cache.key_for("GET", prepared.url))
@@ -0,0 +1,22 @@
+import importlib
+import inspect
+
+# Task callables for the DAG files, imported on first call. Parsing a DAG then
+# loads neither pandas nor the Google client, and a task only imports its own
+# module. Nothing heavy may be imported here.
+
+def task(target: str):
+    # target: "scripts.extract:extract_city_chunk"
+    module_name, name = target.split(":")
+
+    def call(*args, **kwargs):
+        func = getattr(importlib.import_module(module_name), name)
+        params = inspect.signature(func).parameters
+        if not any(p.kind == p.VAR_KEYWORD for p in params.values()):
+            # Airflow passes the whole context to a **kwargs callable: keep what the task takes
+            kwargs = {key: value for key, value in kwargs.items() if key in params}
+        return func(*args, **kwargs)
+
+    call.__name__ = call.__qualname__ = name
+    call.__module__ = module_name
+    return call
@@ -1,13 +1,36 @@
 import os
+import hashlib
 import mimetypes
 import json
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaFileUpload
+from scripts import metrics
+from scripts import storage
 
 SCOPES = ["https://www.googleapis.com/auth/drive.file"]
 MIMETYPE_FOLDER = "application/vnd.google-apps.folder"
+MAX_WORKERS = 8
+BATCH_SIZE = 100        # Drive API limit per batch request
+LIST_FIELDS = "nextPageToken, files(id, name, mimeType, md5Checksum, size)"
+# Upload path per file size. A resumable upload costs a session request, then one
+# request per chunk: files up to SIMPLE_UPLOAD_MAX_BYTES go in a single multipart
+# request instead (the raw JSON Lines files, the daily star schema deltas).
+SIMPLE_UPLOAD_MAX_BYTES = int(os.getenv("WEATHER_DRIVE_SIMPLE_UPLOAD_MAX_BYTES", 5 * 2**20))
+# Larger files (meteo_global, fact_weather) are sent in chunks of this size, a
+# multiple of 256 KiB as Drive requires. A failed chunk is retried from the last
+# byte Drive acknowledged, so smaller chunks re-send less, at one request each.
+CHUNK_ALIGN = 256 * 1024
+UPLOAD_CHUNK_BYTES = max(CHUNK_ALIGN, int(os.getenv("WEATHER_DRIVE_CHUNK_BYTES", 32 * 2**20)) // CHUNK_ALIGN * CHUNK_ALIGN)
+# Retries of one request (or one chunk) on 5xx, 429 and connection errors, with exponential backoff
+UPLOAD_RETRIES = 5
+# Outside of data/ so that it is never uploaded itself
+SYNC_STATE_PATH = Path(os.getenv("WEATHER_SYNC_STATE", storage.BASE_DIR / "sync" / "drive_sync_state.sqlite"))
 
 # creating the googleApiService
 def get_service(account_service_info : str):
@@ -19,79 +42,368 @@ def get_service(account_service_info : str):
     return build("drive", version="v3", credentials=credentials)
 
 
-def get_or_create_folder(service, name, parent_id, cache):
-    key = (parent_id, name)
-    if key in cache:
-        return cache[key]
-    
-    query = (
-        f"'{parent_id}' in parents and name = '{name}'"
-        f"and mimeType = '{MIMETYPE_FOLDER}' and trashed = false"
-    )
-    
-    results = service.files().list(q=query, fields="files(id)", pageSize=1).execute()
-    files = results.get("files", [])
-    if files:
-        folder_id = files[0]["id"]
-    else:
-        metadata = {
-            "name": name,
-            "mimeType": MIMETYPE_FOLDER,
-            "parents": [parent_id]
-        }   
-        folder = service.files().create(
-            body=metadata,
-            fields="id"
-        ).execute()
-        folder_id = folder["id"]
-        
-    cache[key] = folder_id
-    return folder_id
-    
-def find_file_id(service, name, parent_id):
-    query = (
-        f"'{parent_id}' in parents and name = '{name}' "
-        f"and mimeType != '{MIMETYPE_FOLDER}' and trashed = false"
-    )
-    response = service.files().list(q=query, fields="files(id)", pageSize=1).execute()
-    return response["files"][0]["id"] if response.get("files") else None
+class SyncState:
+    # What was last sent to Drive for one (local directory, Drive folder) pair:
+    # path -> (mtime, size, md5, Drive id, parent id), plus the folder ids.
+    # Every upload is committed on its own, an interrupted run loses nothing.
+    def __init__(self, local_base: Path, drive_base_id: str, path: Path = SYNC_STATE_PATH):
+        self.root = f"{drive_base_id}:{Path(local_base).resolve()}"
+        self._lock = threading.Lock()
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS files (
+                root      TEXT NOT NULL,
+                path      TEXT NOT NULL,
+                mtime_ns  INTEGER NOT NULL,
+                size      INTEGER NOT NULL,
+                md5       TEXT NOT NULL,
+                file_id   TEXT NOT NULL,
+                parent_id TEXT NOT NULL,
+                PRIMARY KEY (root, path)
+            )"""
+        )
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS folders (
+                root      TEXT NOT NULL,
+                path      TEXT NOT NULL,
+                folder_id TEXT NOT NULL,
+                PRIMARY KEY (root, path)
+            )"""
+        )
+        self._conn.commit()
+
+    def files(self) -> dict[str, dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, mtime_ns, size, md5, file_id, parent_id FROM files WHERE root = ?", (self.root,)
+            ).fetchall()
+        return {
+            row[0]: {"mtime_ns": row[1], "size": row[2], "md5": row[3], "file_id": row[4], "parent_id": row[5]}
+            for row in rows
+        }
+
+    def folders(self) -> dict[Path, str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, folder_id FROM folders WHERE root = ?", (self.root,)
+            ).fetchall()
+        return {Path(path): folder_id for path, folder_id in rows}
+
+    def record_file(self, path: str, mtime_ns: int, size: int, md5: str, file_id: str, parent_id: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self.root, path, mtime_ns, size, md5, file_id, parent_id),
+            )
+            self._conn.commit()
+
+    def record_folders(self, folder_ids: dict[Path, str]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO folders VALUES (?, ?, ?)",
+                [(self.root, str(path), folder_id) for path, folder_id in folder_ids.items()],
+            )
+            self._conn.commit()
+
+    def forget(self, paths: list[str]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM files WHERE root = ? AND path = ?", [(self.root, path) for path in paths]
+            )
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM files WHERE root = ?", (self.root,))
+            self._conn.execute("DELETE FROM folders WHERE root = ?", (self.root,))
+            self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def _batched(items: list, size: int = BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def list_folders(service, folder_ids: list[str]) -> dict[str, dict[str, dict]]:
+    # name -> {id, mimeType, md5Checksum, size} for every folder, first pages fetched in batches
+    indexes = {folder_id: {} for folder_id in folder_ids}
+    next_pages = {}
+
+    def add_page(folder_id, response):
+        for file in response.get("files", []):
+            indexes[folder_id].setdefault(file["name"], file)
+        if response.get("nextPageToken"):
+            next_pages[folder_id] = response["nextPageToken"]
+
+    def list_request(folder_id, page_token=None):
+        return service.files().list(
+            q=f"'{folder_id}' in parents and trashed = false",
+            fields=LIST_FIELDS,
+            pageSize=1000,
+            pageToken=page_token,
+        )
+
+    for chunk in _batched(list(folder_ids)):
+        errors = {}
+
+        def callback(request_id, response, exception):
+            if exception is not None:
+                errors[request_id] = exception
+            else:
+                add_page(request_id, response)
+
+        batch = service.new_batch_http_request(callback=callback)
+        for folder_id in chunk:
+            batch.add(list_request(folder_id), request_id=folder_id)
+        batch.execute()
+        metrics.record(drive_requests=1)
+        if errors:
+            raise RuntimeError(f"Listing failed for {len(errors)} folders: {errors}")
+
+    while next_pages:
+        folder_id, token = next_pages.popitem()
+        add_page(folder_id, list_request(folder_id, token).execute())
+        metrics.record(drive_requests=1)
+    return indexes
+
+def create_folders(service, names: list[str], parent_id: str) -> dict[str, str]:
+    folder_ids = {}
+    for chunk in _batched(names):
+        errors = {}
+
+        def callback(request_id, response, exception):
+            if exception is not None:
+                errors[request_id] = exception
+            else:
+                folder_ids[request_id] = response["id"]
+
+        batch = service.new_batch_http_request(callback=callback)
+        for name in chunk:
+            metadata = {
+                "name": name,
+                "mimeType": MIMETYPE_FOLDER,
+                "parents": [parent_id]
+            }
+            batch.add(service.files().create(body=metadata, fields="id"), request_id=name)
+        batch.execute()
+        metrics.record(drive_requests=1)
+        if errors:
+            raise RuntimeError(f"Folder creation failed for {errors}")
+    return folder_ids
 
+def md5_checksum(filepath: Path) -> str:
+    digest = hashlib.md5()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
-def upload_or_update_file(service, filepath : Path, parent_id : str, mode : str):
-    file_id = find_file_id(service, filepath.name, parent_id)
+def _media(filepath: Path, size: int) -> MediaFileUpload:
     mimetype, _ = mimetypes.guess_type(filepath)
-    media = MediaFileUpload(filepath, mimetype=mimetype, resumable=True)
-    
-    if file_id and mode == "update":
-        service.files().update(fileId=file_id, media_body=media).execute()
+    if size <= SIMPLE_UPLOAD_MAX_BYTES:
+        return MediaFileUpload(filepath, mimetype=mimetype, resumable=False)
+    return MediaFileUpload(filepath, mimetype=mimetype, resumable=True, chunksize=UPLOAD_CHUNK_BYTES)
+
+def _execute_upload(request, filepath: Path, size: int) -> dict:
+    if not request.resumable:
+        response = request.execute(num_retries=UPLOAD_RETRIES)
+        metrics.record(drive_requests=1)
+        return response
+
+    # Chunk by chunk: progress in the task log, and next_chunk retries a failed
+    # chunk on its own instead of the whole file
+    metrics.record(drive_requests=1)       # the session request
+    response = None
+    while response is None:
+        status, response = request.next_chunk(num_retries=UPLOAD_RETRIES)
+        metrics.record(drive_requests=1)
+        if status:
+            print(f"{filepath.name}: {status.progress():.0%} of {size / 2**20:.1f} MB")
+    return response
+
+def upload_file(service, filepath: Path, parent_id: str, file_id: str | None = None) -> str:
+    size = filepath.stat().st_size
+    media = _media(filepath, size)
+
+    if file_id:
+        _execute_upload(service.files().update(fileId=file_id, media_body=media), filepath, size)
         print(f"file {file_id} has been updated")
-    elif file_id and mode == "create":
-        print(f"file {file_id} already exit, skipped")
     else:
         metadata = {
                 "name": filepath.name,
                 "parents": [parent_id]
             }
 
-        file_id = service.files().create(
-            body=metadata,
-            media_body=media,
-            fields="id"
-        ).execute()["id"]
+        file_id = _execute_upload(
+            service.files().create(body=metadata, media_body=media, fields="id"), filepath, size
+        )["id"]
         print(f"file {file_id} has been uploaded")
+    metrics.record(bytes_uploaded=size)
+    return file_id
+
+def sync_file(service, filepath: Path, parent_id: str, remote: dict | None, mode: str) -> tuple[str, str | None, str]:
+    md5 = md5_checksum(filepath)
+    if remote and mode == "create":
+        return "skipped", remote["id"], md5
+    # Drive keeps an md5 of every binary file, unchanged files are never re-sent
+    if remote and remote.get("md5Checksum") == md5 and int(remote.get("size", -1)) == filepath.stat().st_size:
+        return "skipped", remote["id"], md5
+
+    file_id = upload_file(service, filepath, parent_id, remote["id"] if remote else None)
+    return ("updated" if remote else "uploaded"), file_id, md5
+
+def sync_changed_file(service, filepath: Path, parent_id: str, known: dict | None, mode: str) -> tuple[str, str, str]:
+    # The state already knows the Drive id: no listing, and no upload if only the mtime moved
+    md5 = md5_checksum(filepath)
+    if known and (mode == "create" or known["md5"] == md5):
+        return "skipped", known["file_id"], md5
+    if known:
+        try:
+            return "updated", upload_file(service, filepath, parent_id, known["file_id"]), md5
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            print(f"file {known['file_id']} is gone from Drive, uploading {filepath.name} again")
+    return "uploaded", upload_file(service, filepath, parent_id), md5
+
+def resolve_folders(service, folder_ids: dict[Path, str], needed: set[Path]) -> dict[Path, str]:
+    # Ids of the missing local directories, reused from Drive or created, one batch per depth
+    missing = {p for path in needed for p in (path, *path.parents) if p not in folder_ids}
+    resolved = {}
+    for depth in sorted({len(p.parts) for p in missing}):
+        level = [p for p in missing if len(p.parts) == depth]
+        parents = {p.parent: folder_ids.get(p.parent) or resolved[p.parent] for p in level}
+        indexes = list_folders(service, list(set(parents.values())))
+        for parent, parent_id in parents.items():
+            names = [p.name for p in level if p.parent == parent]
+            existing = {
+                name: indexes[parent_id][name]["id"] for name in names
+                if name in indexes[parent_id] and indexes[parent_id][name]["mimeType"] == MIMETYPE_FOLDER
+            }
+            existing.update(create_folders(service, [n for n in names if n not in existing], parent_id))
+            resolved.update({parent / name: folder_id for name, folder_id in existing.items()})
+    return resolved
+
+@metrics.instrumented("sync")
+def sync_directory(
+    service,
+    local_base : Path,
+    drive_base_id : str,
+    mode : str,
+    max_workers: int = MAX_WORKERS,
+    service_factory=None,
+    state: SyncState | None = None,
+    full: bool = False,
+) -> dict[str, int]:
+    # httplib2 is not thread-safe, each worker builds its own service when a factory is given
+    local = threading.local()
+
+    def worker_service():
+        if service_factory is None:
+            return service
+        if not hasattr(local, "service"):
+            local.service = service_factory()
+        return local.service
+
+    def worker_sync(sync, filepath, parent_id, remote):
+        stat = filepath.stat()
+        status, file_id, md5 = sync(worker_service(), filepath, parent_id, remote, mode)
+        if state is not None and file_id:
+            key = str(filepath.relative_to(local_base))
+            state.record_file(key, stat.st_mtime_ns, stat.st_size, md5, file_id, parent_id)
+        return status
+
+    stats = {"uploaded": 0, "updated": 0, "skipped": 0}
+    if state is not None and not full and state.folders():
+        jobs = _changed_files(service, local_base, state, stats)
+        sync = sync_changed_file
+    else:
+        if state is not None:
+            state.clear()
+        jobs, folder_ids = _remote_diff(service, local_base, drive_base_id)
+        sync = sync_file
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(worker_sync, sync, *job) for job in jobs]
+        for future in as_completed(futures):
+            stats[future.result()] += 1
+
+    if sync is sync_file and state is not None:
+        # Folders are recorded last: a run interrupted before this point compares with Drive again
+        state.record_folders(folder_ids)
+
+    metrics.record(files_in=sum(stats.values()), files_out=stats["uploaded"] + stats["updated"])
+    print(f"Sync of {local_base}: {stats}")
+    return stats
+
+def _visible(names: list[str]) -> list[str]:
+    # Dot files and directories are the temporaries of writes still in progress
+    # (atomic_path): Parquet datasets and compacted partitions are directories
+    return [name for name in names if not name.startswith(".")]
+
+def _changed_files(service, local_base: Path, state: SyncState, stats: dict) -> list[tuple]:
+    # Only a stat() per file: new or modified files are the only ones hashed and sent
+    known = state.files()
+    folder_ids = state.folders()
+    changed, seen = [], set()
+    for dirpath, dirnames, filenames in os.walk(local_base):
+        # Pruned in place: os.walk does not enter them
+        dirnames[:] = _visible(dirnames)
+        for file_name in _visible(filenames):
+            filepath = Path(dirpath) / file_name
+            key = str(filepath.relative_to(local_base))
+            seen.add(key)
+            entry = known.get(key)
+            stat = filepath.stat()
+            if entry and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+                stats["skipped"] += 1
+            else:
+                changed.append((filepath, entry))
+
+    state.forget([key for key in known if key not in seen])
+    needed = {filepath.parent.relative_to(local_base) for filepath, _ in changed}
+    created = resolve_folders(service, folder_ids, needed)
+    state.record_folders(created)
+    folder_ids.update(created)
+    return [
+        (filepath, folder_ids[filepath.parent.relative_to(local_base)], entry)
+        for filepath, entry in changed
+    ]
+
+def _remote_diff(service, local_base: Path, drive_base_id: str) -> tuple[list[tuple], dict[Path, str]]:
+    # No usable state: the whole tree is compared with the Drive listings
+    folder_ids = {Path("."): drive_base_id}
+    indexes = list_folders(service, [drive_base_id])
+    jobs = []
+    for dirpath, dirnames, filenames in os.walk(local_base):
+        dirnames[:] = _visible(dirnames)
+        relative_part = Path(dirpath).relative_to(local_base)
+        parent_id = folder_ids[relative_part]
+        index = indexes.pop(parent_id)
+
+        existing = {
+            name: index[name]["id"] for name in dirnames
+            if name in index and index[name]["mimeType"] == MIMETYPE_FOLDER
+        }
+        created = create_folders(service, [d for d in dirnames if d not in existing], parent_id)
+        # Sub-folders listed together: one batch per level instead of one call per file
+        indexes.update(list_folders(service, list(existing.values())))
+        indexes.update({folder_id: {} for folder_id in created.values()})
+        for name in dirnames:
+            folder_ids[relative_part / name] = existing.get(name) or created[name]
+
+        for file_name in _visible(filenames):
+            remote = index.get(file_name)
+            if remote and remote["mimeType"] == MIMETYPE_FOLDER:
+                remote = None
+            jobs.append((Path(dirpath) / file_name, parent_id, remote))
+    return jobs, folder_ids
 
-def sync_directory(service, local_base : Path, drive_base_id : str, mode : str):
-    folder_cache = {}
-    for dirpath, _, filenames in os.walk(local_base):
-        relative_part = Path(dirpath).relative_to(local_base).parts
-        parent_id = drive_base_id
-        
-        for part in relative_part:
-            parent_id = get_or_create_folder(service, part, parent_id, folder_cache)
-            
-        for file_name in filenames:
-            upload_or_update_file(service, Path(dirpath) / file_name, parent_id, mode)
-            
 def main(account_service_info : str, drive_folder_id : str):
     base_dir = Path(os.getenv('AIRFLOW_HOME', Path(__file__).parent.parent))
 
@@ -99,5 +411,12 @@ def main(account_service_info : str, drive_folder_id : str):
         raise SystemExit(f"Source directory '{base_dir}' not found.")
     
     service = get_service(account_service_info)
-    sync_directory(service, base_dir / "data", drive_folder_id, "update")
-
+    state = SyncState(base_dir / "data", drive_folder_id)
+    try:
+        sync_directory(
+            service, base_dir / "data", drive_folder_id, "update",
+            service_factory=lambda: get_service(account_service_info),
+            state=state,
+        )
+    finally:
+        state.close()
@@ -1,104 +1,345 @@
-import pandas as pd
-from pathlib import Path
 import os
+import pandas as pd
+import numpy as np
+import json
+from collections.abc import Iterable
+from scripts import metrics
+from scripts import storage
+from scripts.cleaning import SCHEMA, clean_df
+
+MANIFEST_NAME = "_merge_manifest.json"
+# Month of extraction_date, then city: a daily append touches a single month and
+# its partitions are compacted as they grow (storage.PARQUET_COMPACT_FILES)
+PARTITION_COLS = [storage.MONTH_COL, "city"]
+# Natural key of meteo_global: one row per city, day and API
+KEY_COLS = ["city", "extraction_date", "source"]
+# Every cleaned column but the key: a rerun that only changes one of them is an update
+VALUE_COLS = [col for col in SCHEMA if col not in KEY_COLS]
+INDEX_DIR = "_merge_index"
+# Columns the value hashes of the index were computed on
+INDEX_COLUMNS_NAME = "_columns.json"
+SOURCE = "openweathermap"
+# Rows of meteo_global held at once when months are rewritten: the updated rows
+# upsert_chunks holds, and the current rows of the months replaced together
+REWRITE_ROWS = int(os.getenv("WEATHER_MERGE_REWRITE_ROWS", 500_000))
+
+# Manifest: merged ds, "rewrites" (full rewrites of meteo_global, the transform
+# rebuilds after one), "changed_dates" (day -> number of the merge that
+# updated rows of it or added backdated ones, the transform re-derives these days)
+# and "pending_months" (months being written, "*" for a full rewrite: saved
+# before the table is written, cleared once the index holds the new rows)
+def load_manifest() -> dict:
+    manifest_file = storage.layer_dir("processed") / MANIFEST_NAME
+    if manifest_file.exists():
+        with open(manifest_file) as f:
+            return json.load(f)
+    return {"merged_dates": [], "rewrites": 0}
+
+def save_manifest(manifest: dict) -> None:
+    manifest_file = storage.layer_dir("processed") / MANIFEST_NAME
+    with storage.atomic_path(manifest_file) as tmp_file:
+        with open(tmp_file, "w") as f:
+            json.dump(manifest, f, indent=2)
+
+def _can_append(new_df: pd.DataFrame) -> bool:
+    # Only the schema of the existing table is read, the history stays untouched
+    if not storage.table_exists("meteo_global", "processed"):
+        return False
+    if not storage.month_partitioned("meteo_global", "processed"):
+        # Written before the month partitions (Parquet) or the month index (CSV)
+        return False
+    return not set(new_df.columns) - set(storage.table_columns("meteo_global", "processed"))
+
+# ================= KEY INDEX =================
+# key hash -> value hash of every row of meteo_global, one sorted shard per
+# month of extraction_date: an upsert only loads the months it touches.
+
+def _index_dir():
+    return storage.layer_dir("processed") / INDEX_DIR
+
+def _months(df: pd.DataFrame) -> pd.Series:
+    return storage.months_of(df["extraction_date"])
+
+def _hash_keys(df: pd.DataFrame) -> np.ndarray:
+    return pd.util.hash_pandas_object(df[KEY_COLS], index=False).to_numpy()
+
+def _hash_values(df: pd.DataFrame) -> np.ndarray:
+    # float32 (compact reads) widened: a row hashes the same whatever the read
+    # Categoricals already hash as their values
+    return pd.util.hash_pandas_object(storage.widen(df.reindex(columns=VALUE_COLS)), index=False).to_numpy()
+
+def _load_shard(month: str) -> pd.Series:
+    shard_file = _index_dir() / f"{month}.npz"
+    if not shard_file.exists():
+        return pd.Series([], dtype="uint64", index=pd.Index([], dtype="uint64"))
+    with np.load(shard_file) as shard:
+        return pd.Series(shard["values"], index=shard["keys"])
+
+def _save_shard(month: str, shard: pd.Series) -> None:
+    shard_file = _index_dir() / f"{month}.npz"
+    with storage.atomic_path(shard_file) as tmp_file:
+        with open(tmp_file, "wb") as f:
+            np.savez(f, keys=shard.index.to_numpy(), values=shard.to_numpy())
+
+def _index_current() -> bool:
+    # An index hashed on other value columns would report every row as updated
+    columns_file = _index_dir() / INDEX_COLUMNS_NAME
+    if not columns_file.exists():
+        return False
+    with open(columns_file) as f:
+        return json.load(f) == VALUE_COLS
+
+def _index_rows(df: pd.DataFrame, rebuild: bool = False) -> None:
+    months = _months(df)
+    if rebuild:
+        if _index_dir().exists():
+            for shard_file in _index_dir().glob("*.npz"):
+                shard_file.unlink()
+        with storage.atomic_path(_index_dir() / INDEX_COLUMNS_NAME) as tmp_file:
+            with open(tmp_file, "w") as f:
+                json.dump(VALUE_COLS, f)
+    for month, rows in df.groupby(months, sort=False).groups.items():
+        rows = df.loc[rows]
+        new = pd.Series(_hash_values(rows), index=_hash_keys(rows))
+        shard = pd.concat([_load_shard(month), new])
+        _save_shard(month, shard[~shard.index.duplicated(keep="last")].sort_index())
+
+def _classify(df: pd.DataFrame) -> np.ndarray:
+    # 0: new key, 1: same key and values, 2: same key with other values
+    status = np.zeros(len(df), dtype="int8")
+    keys, values = _hash_keys(df), _hash_values(df)
+    for month, positions in pd.Series(range(len(df))).groupby(_months(df).to_numpy(), sort=False):
+        shard = _load_shard(month)
+        if shard.empty:
+            continue
+        shard_keys, shard_values = shard.index.to_numpy(), shard.to_numpy()
+        positions = positions.to_numpy()
+        found = np.searchsorted(shard_keys, keys[positions]).clip(max=len(shard_keys) - 1)
+        exists = shard_keys[found] == keys[positions]
+        same = exists & (shard_values[found] == values[positions])
+        status[positions] = np.where(same, 1, np.where(exists, 2, 0))
+    return status
+
+def _infer_source(df: pd.DataFrame) -> pd.Series:
+    # Rows merged before the source column: Open-Meteo gives numeric weather codes,
+    # OpenWeatherMap gives words ("clouds")
+    numeric = df["meteo"].astype("string").str.fullmatch(r"\d+").fillna(False)
+    return pd.Series(np.where(numeric, "open-meteo", SOURCE), index=df.index, dtype="string")
+
+def _prepare(df: pd.DataFrame, source: str) -> pd.DataFrame:
+    df, _ = clean_df(df)
+    if "source" not in df.columns:
+        df["source"] = source
+    df["source"] = df["source"].astype("string").fillna(source)
+    # Within the batch itself the last extraction of a day wins
+    return df.drop_duplicates(KEY_COLS, keep="last").reset_index(drop=True)
+
+def _read_history() -> pd.DataFrame:
+    if not storage.table_exists("meteo_global", "processed"):
+        return pd.DataFrame()
+    # The whole history: categorical labels and float32 measurements
+    history, _ = clean_df(storage.read_table("meteo_global", "processed", compact=True))
+    if "source" not in history.columns:
+        history["source"] = _infer_source(history)
+    return history
+
+def _replaced(history: pd.DataFrame, rows: pd.DataFrame) -> np.ndarray:
+    if history.empty or rows.empty:
+        return np.zeros(len(history), dtype=bool)
+    return pd.MultiIndex.from_frame(history[KEY_COLS]).isin(pd.MultiIndex.from_frame(rows[KEY_COLS]))
+
+def _begin_write(manifest: dict, months: list[str]) -> None:
+    # A run failing between the table write and the index update leaves rows
+    # the index does not know: its retry would insert them again (_recover)
+    manifest["pending_months"] = sorted(set(manifest.get("pending_months", [])) | set(months))
+    save_manifest(manifest)
+
+def _rewrite(df: pd.DataFrame, manifest: dict) -> None:
+    # Lets the incremental transform know the history has been rewritten
+    manifest["rewrites"] = manifest.get("rewrites", 0) + 1
+    manifest["changed_dates"] = {}
+    _begin_write(manifest, ["*"])
+    storage.write_table(df, "meteo_global", "processed", partition_cols=PARTITION_COLS)
+    _index_rows(df, rebuild=True)
+    manifest["pending_months"] = []
 
-def _clean_df(df : pd.DataFrame ) -> pd.DataFrame:
-    df.columns = (
-        df.columns.str.strip().str.lower().str.replace(" ", "_") 
+def _recover(manifest: dict) -> None:
+    # Months a failed run may have written without indexing: their shards are
+    # rebuilt from the table, so its rows are found again instead of re-inserted
+    pending = manifest.get("pending_months")
+    if not pending:
+        return
+    print(f"Re-indexing meteo_global after an interrupted merge: {pending}")
+    if "*" in pending:
+        if storage.table_exists("meteo_global", "processed"):
+            _index_rows(_read_history(), rebuild=True)
+        # Rewritten in part or in full: the transform rebuilds
+        manifest["rewrites"] = manifest.get("rewrites", 0) + 1
+        manifest["changed_dates"] = {}
+    else:
+        for month in pending:
+            rows = _read_month(month)
+            shard = pd.Series(_hash_values(rows), index=_hash_keys(rows))
+            _save_shard(month, shard[~shard.index.duplicated(keep="last")].sort_index())
+    manifest["pending_months"] = []
+    save_manifest(manifest)
+
+def _read_month(month: str) -> pd.DataFrame:
+    start = pd.Period(month, "M").to_timestamp()
+    current, _ = clean_df(storage.read_table(
+        "meteo_global", "processed", compact=True,
+        filters=[("extraction_date", ">=", start), ("extraction_date", "<", start + pd.offsets.MonthBegin())],
+    ))
+    if "source" not in current.columns:
+        current["source"] = _infer_source(current)
+    return current
+
+def _write_months(frames: list[pd.DataFrame]) -> None:
+    storage.write_table(
+        storage.concat_compact(frames), "meteo_global", "processed",
+        mode="replace", partition_cols=PARTITION_COLS
     )
-    
-    if "meteo" in df.columns:
-        df["meteo"] = (
-            df["meteo"]
-            .astype(str)
-            .str.lower()
-            .str.strip()
-            .str.replace(" ", "_")
-        )
-    numeric_cols = [
-        'temperature','humidite','pluie_mm','meteo','temp_min','temp_max'
-    ]
-    
-    numeric_cols = [
-        col for col in df.columns 
-        if any(pattern in col.lower() for pattern in numeric_cols)
-        and df[col].dtype == object
-    ]
-    
-    
-    # Clean extraction_date
-    if "extraction_date" in df.columns:
-        # Convert to datetime (timezone-naive)
-        df["extraction_date"] = pd.to_datetime(
-            df["extraction_date"],
-            errors='coerce',
-            dayfirst=True,
-            format='mixed'
-        )
-        
-        # Handle remaining NaT values
-        na_mask = df["extraction_date"].isna()
-        if na_mask.any():
-            df.loc[na_mask, "extraction_date"] = pd.to_datetime(
-                df.loc[na_mask, "extraction_date"],
-                errors='coerce',
-                format='ISO8601'
-            )
-        
-        # Normalize to date and ensure timezone-naive
-        df["extraction_date"] = df["extraction_date"].dt.tz_localize(None).dt.normalize()
-        
-    # Make sheet not turning the float into date
-    for col in numeric_cols:
-        df[col] = df[col].astype(str).str.replace(r'[^\d.-]', '', regex=True)
-        
-        df[col] = df[col].str.replace('.', ',', regex=False)
-        
-        df[col] = pd.to_numeric(df[col], errors='coerce')
-        
-        if pd.api.types.is_float_dtype(df[col]):
-            df[col] = df[col].round(2)
- 
-    return df
-
-def merge_data(date: str) -> str:
-    base_dir = Path(os.getenv('AIRFLOW_HOME', Path(__file__).parent.parent))
-    input_dir = base_dir / "data" / "raw" / date
-    output_file = base_dir / "data" / "processed" / "meteo_global.csv"
 
-    if not input_dir.exists():
-        raise FileNotFoundError(f"Input folder not found: {input_dir}")
+def _replace_months(updated: pd.DataFrame, inserted: pd.DataFrame, max_rows: int = REWRITE_ROWS) -> pd.DataFrame:
+    # Only the months holding updated rows are read and written again, with the
+    # new rows of these months. They are read one at a time and written as soon
+    # as max_rows rows are held. Returns the new rows of the other months.
+    updated_months, inserted_months = _months(updated), _months(inserted)
+    batch, held = [], 0
+    for month in sorted(set(updated_months)):
+        current, month_updates = _read_month(month), updated[updated_months == month]
+        batch += [current[~_replaced(current, month_updates)], month_updates, inserted[inserted_months == month]]
+        held += len(current) + len(month_updates)
+        if held >= max_rows:
+            _write_months(batch)
+            batch, held = [], 0
+    if batch:
+        _write_months(batch)
+    return inserted[~inserted_months.isin(set(updated_months))]
+
+def _record_changes(manifest: dict, dates: pd.Series) -> None:
+    if dates.empty:
+        return
+    manifest["updates"] = manifest.get("updates", 0) + 1
+    changed = manifest.setdefault("changed_dates", {})
+    for day in dates.dt.strftime("%Y-%m-%d").unique():
+        changed[day] = manifest["updates"]
+
+@metrics.instrumented("merge")
+def upsert_rows(new_df: pd.DataFrame, source: str = SOURCE, incremental: bool = True) -> dict:
+    # Daily runs and the historical merge may overlap: one writer of meteo_global at a time
+    with storage.lock("meteo_global"):
+        return _upsert_rows(new_df, source, incremental)
 
-    output_file.parent.mkdir(parents=True, exist_ok=True)
+def _write_rows(inserted: pd.DataFrame, updated: pd.DataFrame, manifest: dict, max_rows: int = REWRITE_ROWS) -> None:
+    changed = pd.concat([inserted, updated], ignore_index=True)
+    if changed.empty:
+        return
+    if not _can_append(changed):
+        history = _read_history()
+        history = history[~_replaced(history, updated)]
+        _rewrite(storage.concat_compact([history, updated, inserted]), manifest)
+        return
 
-    if output_file.exists():
-        global_df = pd.read_csv(
-            output_file,
-            parse_dates=["extraction_date"],
-            date_format="ISO8601"
+    # Updated days and backdated rows are behind the transform watermark,
+    # it re-derives these days only
+    latest = manifest.get("latest_date")
+    backdated = inserted[inserted["extraction_date"] < pd.Timestamp(latest)] if latest else inserted.iloc[:0]
+    _record_changes(manifest, pd.concat([updated["extraction_date"], backdated["extraction_date"]]))
+    _begin_write(manifest, _months(changed).unique().tolist())
+    appended = _replace_months(updated, inserted, max_rows) if not updated.empty else inserted
+    if not appended.empty:
+        storage.write_table(
+            appended, "meteo_global", "processed",
+            mode="append", partition_cols=PARTITION_COLS
         )
+    _index_rows(changed)
+    manifest["pending_months"] = []
+
+def _upsert_rows(new_df: pd.DataFrame, source: str, incremental: bool, held: list | None = None) -> dict:
+    # held: the updated rows are added to it instead of being written
+    df = _prepare(new_df, source)
+    manifest = load_manifest()
+    _recover(manifest)
+
+    if incremental and not _index_current() and storage.table_exists("meteo_global", "processed"):
+        # Tables merged before the index, or before a change of VALUE_COLS: built once from the history
+        print("Building the meteo_global key index")
+        _index_rows(_read_history(), rebuild=True)
+
+    if not incremental:
+        history = _read_history()
+        replaced = _replaced(history, df)
+        report = {"inserted": len(df) - int(replaced.sum()), "updated": int(replaced.sum()), "skipped": 0}
+        _rewrite(storage.concat_compact([history[~replaced], df]), manifest)
     else:
-        global_df = pd.DataFrame()
-
-    new_data = []
-    for file in input_dir.iterdir():
-        if file.name.startswith("meteo_") and file.name.endswith(".csv"):
-            df = pd.read_csv(
-                file,
-                parse_dates=["extraction_date"],
-                date_format="ISO8601"
-            )
-            new_data.append(df)
+        # Only the new rows are hashed and looked up, the history is not scanned
+        status = _classify(df)
+        inserted, updated = df[status == 0], df[status == 2]
+        report = {"inserted": len(inserted), "updated": len(updated), "skipped": int((status == 1).sum())}
+        if held is not None:
+            held.append(updated)
+            updated = updated.iloc[:0]
+        _write_rows(inserted, updated, manifest)
+
+    if not df.empty:
+        latest = df["extraction_date"].max().strftime("%Y-%m-%d")
+        manifest["latest_date"] = max(latest, manifest.get("latest_date") or latest)
+
+    save_manifest(manifest)
+    metrics.record(rows_in=len(new_df), rows_out=report["inserted"] + report["updated"])
+    print(f"meteo_global upsert ({source}): {report}")
+    return report
+
+def _flush_updates(held: list[pd.DataFrame], max_rows: int) -> None:
+    updated = pd.concat(held, ignore_index=True) if held else pd.DataFrame()
+    held.clear()
+    if updated.empty:
+        return
+    manifest = load_manifest()
+    updated = updated.drop_duplicates(KEY_COLS, keep="last")
+    _write_rows(updated.iloc[:0], updated, manifest, max_rows)
+    save_manifest(manifest)
+
+@metrics.instrumented("merge")
+def upsert_chunks(
+    chunks: Iterable[pd.DataFrame], source: str = SOURCE, incremental: bool = True, max_rows: int = REWRITE_ROWS
+) -> dict:
+    # One chunk at a time under a single lock: the first one creates (or rewrites)
+    # the table, the new keys of the next ones are appended, the history is never
+    # held in memory. Updated rows are held across chunks and written once
+    # max_rows of them are held: one rewrite of their months per max_rows updates.
+    totals = {"inserted": 0, "updated": 0, "skipped": 0}
+    held = []
+    with storage.lock("meteo_global"):
+        for i, chunk in enumerate(chunks):
+            report = _upsert_rows(chunk, source, incremental or i > 0, held)
+            for key, value in report.items():
+                totals[key] += value
+            if sum(len(rows) for rows in held) >= max_rows:
+                _flush_updates(held, max_rows)
+        _flush_updates(held, max_rows)
+    print(f"meteo_global upsert ({source}), all chunks: {totals}")
+    return totals
+
+@metrics.instrumented("merge")
+def merge_data(date: str, incremental: bool = True) -> str:
+    input_dir = storage.layer_dir("raw") / date
+    output_file = storage.table_path("meteo_global", "processed")
 
+    if not input_dir.exists():
+        raise FileNotFoundError(f"Input folder not found: {input_dir}")
+
+    new_data = storage.read_partition(date)
     if not new_data:
         raise ValueError(f"No new data to merge for {date}")
 
-    merged_df = pd.concat([global_df] + new_data, ignore_index=True)
-    cleaned_df = _clean_df(merged_df)
-    
-    cleaned_df.to_csv(
-        output_file, 
-        index=False,
-        date_format="%Y-%m-%d %H:%M:%S.%f"  # Preserve microsecond precision
-    )
-    return str(output_file)   
\ No newline at end of file
+    with storage.lock("meteo_global"):
+        # A rerun of the same ds only updates the rows whose values changed
+        _upsert_rows(pd.concat(new_data, ignore_index=True), SOURCE, incremental)
+
+        manifest = load_manifest()
+        if date not in manifest["merged_dates"]:
+            manifest["merged_dates"] = sorted(manifest["merged_dates"] + [date])
+            save_manifest(manifest)
+    return str(output_file)
@@ -0,0 +1,152 @@
+import functools
+import json
+import os
+import resource
+import socket
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+# Per-stage run metrics: wall/CPU time, peak RSS, rows, bytes, HTTP calls.
+# Each instrumented stage emits one JSON record (task log + metrics/stages.jsonl),
+# optionally StatsD over UDP, and an XCom "metrics" summary when run by Airflow.
+# No import of the other scripts: storage and http_cache report into it.
+METRICS_DIR = Path(os.getenv("WEATHER_METRICS_DIR", Path(os.getenv("AIRFLOW_HOME", Path(__file__).parent.parent)) / "metrics"))
+STATSD_HOST = os.getenv("STATSD_HOST")
+STATSD_PORT = int(os.getenv("STATSD_PORT", 8125))
+STATSD_PREFIX = os.getenv("STATSD_PREFIX", "weather_etl")
+
+
+class StageMetrics:
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.counters: dict[str, int] = {}
+        self.http_latencies: list[float] = []
+        self._lock = threading.Lock()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+
+    def add(self, **counts: int) -> None:
+        with self._lock:
+            for name, value in counts.items():
+                self.counters[name] = self.counters.get(name, 0) + int(value)
+
+    def http(self, latency: float, cached: bool) -> None:
+        with self._lock:
+            self.counters["http_calls"] = self.counters.get("http_calls", 0) + 1
+            if cached:
+                self.counters["cache_hits"] = self.counters.get("cache_hits", 0) + 1
+            else:
+                self.http_latencies.append(latency)
+
+    def summary(self, status: str) -> dict:
+        latencies = sorted(self.http_latencies)
+
+        def percentile(p: float) -> float | None:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 1)
+
+        return {
+            "stage": self.stage,
+            "status": status,
+            "wall_s": round(time.perf_counter() - self._wall, 3),
+            "cpu_s": round(time.process_time() - self._cpu, 3),
+            # Linux reports kilobytes, peak of the whole task process
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            **self.counters,
+            "http_ms_p50": percentile(0.5),
+            "http_ms_p95": percentile(0.95),
+            "http_ms_max": percentile(1.0),
+        }
+
+
+# Stages running in this process, innermost last. Process-wide rather than a
+# contextvar so worker threads (extraction, uploads) report to their stage.
+_active: list[StageMetrics] = []
+_active_lock = threading.Lock()
+
+
+def active() -> bool:
+    return bool(_active)
+
+
+def record(**counts: int) -> None:
+    with _active_lock:
+        stages = list(_active)
+    for stage in stages:
+        stage.add(**counts)
+
+
+def record_http(latency: float, cached: bool) -> None:
+    with _active_lock:
+        stages = list(_active)
+    for stage in stages:
+        stage.http(latency, cached)
+
+
+def _airflow_context() -> dict | None:
+    try:
+        from airflow.sdk import get_current_context
+        return get_current_context()
+    except Exception:
+        # Not running inside an Airflow task (CLI scripts, benchmarks)
+        return None
+
+
+def _send_statsd(summary: dict) -> None:
+    prefix = f"{STATSD_PREFIX}.{summary['stage']}"
+    lines = [f"{prefix}.wall:{summary['wall_s'] * 1000:.0f}|ms", f"{prefix}.cpu:{summary['cpu_s'] * 1000:.0f}|ms"]
+    lines += [
+        f"{prefix}.{name}:{value}|g" for name, value in summary.items()
+        if name not in ("stage", "status", "wall_s", "cpu_s") and isinstance(value, (int, float))
+    ]
+    lines.append(f"{prefix}.{summary['status']}:1|c")
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.sendto("\n".join(lines).encode(), (STATSD_HOST, STATSD_PORT))
+    except OSError as e:
+        print(f"StatsD unreachable: {e}")
+
+
+def emit(summary: dict) -> None:
+    context = _airflow_context()
+    run = {}
+    if context is not None:
+        ti = context["ti"]
+        run = {"dag_id": ti.dag_id, "task_id": ti.task_id, "run_id": ti.run_id, "map_index": ti.map_index}
+
+    record_line = json.dumps({"ts": datetime.now(timezone.utc).isoformat(), **run, **summary})
+    print(f"[metrics] {record_line}")
+    try:
+        METRICS_DIR.mkdir(parents=True, exist_ok=True)
+        with open(METRICS_DIR / "stages.jsonl", "a") as f:
+            f.write(record_line + "\n")
+    except OSError as e:
+        print(f"Could not write the metrics file: {e}")
+
+    if STATSD_HOST:
+        _send_statsd(summary)
+    if context is not None:
+        context["ti"].xcom_push(key="metrics", value=summary)
+
+
+def instrumented(stage: str):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            metrics = StageMetrics(stage)
+            with _active_lock:
+                _active.append(metrics)
+            status = "failed"
+            try:
+                result = func(*args, **kwargs)
+                status = "success"
+                return result
+            finally:
+                with _active_lock:
+                    _active.remove(metrics)
+                emit(metrics.summary(status))
+        return wrapper
+    return decorator
@@ -0,0 +1,92 @@
+import pandas as pd
+
+# Columns derived from the raw API responses. The responses are archived whole
+# in the raw landing files (compressed JSON Lines, see storage.py), so a column
+# added here is filled for the whole history by rederive.py: CPU, no API call.
+OPENWEATHERMAP = "openweathermap"
+OPEN_METEO = "open-meteo"
+
+# Every Open-Meteo daily variable worth keeping is requested and archived,
+# used by a column or not yet. The order is the order of daily.Variables(i).
+OPEN_METEO_DAILY = [
+    "temperature_2m_max", "temperature_2m_min", "precipitation_sum",
+    "weather_code", "relative_humidity_2m_mean", "temperature_2m_mean",
+    "apparent_temperature_mean", "rain_sum", "snowfall_sum", "precipitation_hours",
+    "pressure_msl_mean", "cloud_cover_mean", "wind_speed_10m_max", "wind_gusts_10m_max",
+    "wind_direction_10m_dominant", "shortwave_radiation_sum", "sunshine_duration",
+    "et0_fao_evapotranspiration",
+]
+# Same units as OpenWeatherMap with units=metric
+OPEN_METEO_PARAMS = {"wind_speed_unit": "ms"}
+
+# column -> dotted path in the response; numbers index lists ("weather.0.id")
+FIELDS = {
+    OPENWEATHERMAP: {
+        "temperature": "main.temp",
+        "humidite":    "main.humidity",
+        "pluie_mm":    "rain.1h",
+        "meteo":       "weather.0.main",
+        "temp_min":    "main.temp_min",
+        "temp_max":    "main.temp_max",
+        "pression":    "main.pressure",
+        "vent":        "wind.speed",
+        "nuages":      "clouds.all",
+        "code_meteo":  "weather.0.id",
+    },
+    OPEN_METEO: {
+        "temperature": "temperature_2m_mean",
+        "humidite":    "relative_humidity_2m_mean",
+        "pluie_mm":    "precipitation_sum",
+        "meteo":       "weather_code",
+        "temp_min":    "temperature_2m_min",
+        "temp_max":    "temperature_2m_max",
+        "pression":    "pressure_msl_mean",
+        "vent":        "wind_speed_10m_max",
+        "nuages":      "cloud_cover_mean",
+        "code_meteo":  "weather_code",
+    },
+}
+# OpenWeatherMap leaves "rain" out of dry responses
+DEFAULTS = {OPENWEATHERMAP: {"pluie_mm": 0}}
+
+
+def _column(flat: pd.DataFrame, path: str) -> pd.Series:
+    # json_normalize flattens the nested objects, lists stay whole: the longest
+    # flattened prefix is taken, and the rest is looked up value by value
+    parts = path.split(".")
+    for i in range(len(parts), 0, -1):
+        prefix = ".".join(parts[:i])
+        if prefix in flat.columns:
+            values = flat[prefix]
+            for part in parts[i:]:
+                values = values.str.get(int(part) if part.isdigit() else part)
+            return values
+    return pd.Series(float("nan"), index=flat.index)
+
+
+def derive(flat: pd.DataFrame, source: str) -> pd.DataFrame:
+    # flat: pd.json_normalize(responses), or a frame of Open-Meteo daily variables
+    columns = pd.DataFrame({col: _column(flat, path) for col, path in FIELDS[source].items()}, index=flat.index)
+    return columns.fillna(DEFAULTS.get(source, {}))
+
+
+def from_responses(cities: list[str], fetched_at: list, responses: list[dict], batch: str) -> pd.DataFrame:
+    # Landing rows of an OpenWeatherMap batch: derived columns, metadata and the response itself
+    df = derive(pd.json_normalize(responses), OPENWEATHERMAP)
+    df.insert(0, "city", cities)
+    df.insert(1, "extraction_date", fetched_at)
+    df["meta"] = [{"source": OPENWEATHERMAP, "batch": batch, "fetched_at": t.isoformat()} for t in fetched_at]
+    df["payload"] = responses
+    return df
+
+
+def from_daily(city: str, dates: pd.DatetimeIndex, variables: dict) -> pd.DataFrame:
+    # Landing rows of an Open-Meteo response: one row per day, every variable in the payload
+    # The SDK gives float32 arrays: 4 decimals drop the float64 noise, not the API precision
+    values = pd.DataFrame(variables).astype("float64").round(4)
+    df = derive(values, OPEN_METEO)
+    df.insert(0, "city", city)
+    df.insert(1, "extraction_date", dates)
+    df["meta"] = [{"source": OPEN_METEO}] * len(df)
+    df["payload"] = values.to_dict("records")
+    return df
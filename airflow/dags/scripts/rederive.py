@@ -0,0 +1,64 @@
+import os
+import pandas as pd
+from scripts import merge
+from scripts import metrics
+from scripts import payloads
+from scripts import storage
+from scripts.transform import transform_to_star_schema
+
+# Offline rebuild of meteo_global and of the star schema from the API responses
+# archived in the raw landing files. After a change of payloads.FIELDS, the new
+# columns are filled for the whole history without calling any API.
+ROOTS = {"data": payloads.OPENWEATHERMAP, "historical-data": payloads.OPEN_METEO}
+# Raw rows parsed at once; only the derived columns are kept between chunks
+CHUNK_ROWS = int(os.getenv("WEATHER_REDERIVE_CHUNK_ROWS", 200_000))
+
+def _derive_chunk(frames: list[pd.DataFrame], default_source: str) -> pd.DataFrame:
+    df = pd.concat(frames, ignore_index=True)
+    if "payload" not in df.columns:
+        df["payload"] = None
+    source = pd.Series(default_source, index=df.index)
+    if "meta" in df.columns:
+        source = df["meta"].str.get("source").fillna(default_source)
+
+    # Files landed before the payloads keep their flat columns as they are
+    archived = df["payload"].notna()
+    parts = [df[~archived]]
+    for name, rows in df[archived].groupby(source[archived]):
+        flat = pd.json_normalize(rows["payload"].tolist())
+        flat.index = rows.index
+        parts.append(rows[["city", "extraction_date"]].join(payloads.derive(flat, name)))
+
+    # Landing order is kept: within a day, the last extraction of a key still wins
+    derived = pd.concat(parts).sort_index()
+    derived["source"] = source
+    return derived.drop(columns=storage.RAW_NESTED_COLS, errors="ignore")
+
+def _chunks(root: str):
+    frames, rows = [], 0
+    for partition_dir in storage.list_partitions("raw", root=root):
+        for raw_file in storage.partition_files(partition_dir):
+            frame = storage.read_file(raw_file, nested=True)
+            frames.append(frame)
+            rows += len(frame)
+            if rows >= CHUNK_ROWS:
+                yield _derive_chunk(frames, ROOTS[root])
+                frames, rows = [], 0
+    if frames:
+        yield _derive_chunk(frames, ROOTS[root])
+
+@metrics.instrumented("rederive")
+def rederive(roots: list[str] | None = None, star_schema: bool = True) -> dict:
+    chunks = [chunk for root in roots or list(ROOTS) for chunk in _chunks(root)]
+    if not chunks:
+        raise ValueError("No raw data to derive from")
+    derived = pd.concat(chunks, ignore_index=True)
+    metrics.record(rows_in=len(derived))
+    print(f"{len(derived)} rows derived from the raw archive")
+
+    # One rewrite of meteo_global: the derived rows replace the rows with the same
+    # key, rows whose raw files are gone are kept as they are
+    report = merge.upsert_rows(derived, incremental=False)
+    if star_schema:
+        transform_to_star_schema(incremental=False)
+    return report
@@ -0,0 +1,160 @@
+import shutil
+import pandas as pd
+from scripts import deltas
+from scripts import storage
+
+# Pre-aggregated facts per city, kept next to the star schema. They hold
+# count/sum/min/max (never averages) so that two partial aggregates combine
+# exactly: avg = sum / count, for any set of rows.
+# One table per year, rollups/<name>/year_<year>: a run rewrites the years it
+# touches, and the Drive sync only sends those.
+LAYER = "star_schema"
+ROLLUP_DIR = "rollups"
+ROLLUPS = {
+    "fact_weather_monthly":  ["year", "month"],
+    "fact_weather_seasonal": ["year", "season"],
+}
+MEASURES = ["temperature", "humidite", "pluie_mm", "temp_min", "temp_max"]
+STATS = ("count", "sum", "min", "max")
+# How two partial aggregates of the same group are merged
+COMBINE = {"days": "sum", **{f"{m}_{s}": ("sum" if s in ("count", "sum") else s) for m in MEASURES for s in STATS}}
+
+
+def _calendar(date_index: dict[str, int]) -> pd.DataFrame:
+    dates = pd.to_datetime(pd.Series(list(date_index.keys())))
+    return pd.DataFrame({
+        "date_id": list(date_index.values()),
+        "year":    dates.dt.year,
+        "month":   dates.dt.month,
+        "season":  (dates.dt.month % 12 + 3) // 3,     # same as dim_date
+    })
+
+
+def aggregate(facts: pd.DataFrame, calendar: pd.DataFrame, keys: list[str]) -> pd.DataFrame:
+    measures = [m for m in MEASURES if m in facts.columns]
+    rows = facts[["city_id", "date_id", *measures]].merge(calendar[["date_id", *keys]], on="date_id", how="inner")
+    # float32 facts (compact reads) summed in float64
+    rows = storage.widen(rows)
+    aggs = {"days": ("date_id", "size")}
+    aggs.update({f"{m}_{s}": (m, s) for m in measures for s in STATS})
+    return rows.groupby(["city_id", *keys], as_index=False).agg(**aggs)
+
+
+def combine(parts: list[pd.DataFrame], keys: list[str]) -> pd.DataFrame:
+    parts = [p for p in parts if not p.empty]
+    if not parts:
+        return pd.DataFrame()
+    merged = pd.concat(parts, ignore_index=True)
+    how = {col: how for col, how in COMBINE.items() if col in merged.columns}
+    return merged.groupby(["city_id", *keys], as_index=False).agg(how)
+
+
+def _layer(name: str) -> str:
+    return f"{LAYER}/{ROLLUP_DIR}/{name}"
+
+
+def years(name: str) -> list[int]:
+    base = storage.layer_dir(_layer(name))
+    if not base.exists():
+        return []
+    # year_2025.csv or the year_2025 Parquet dataset; temporary files are dot files
+    return sorted({int(p.name.split(".")[0].removeprefix("year_")) for p in base.iterdir() if p.name.startswith("year_")})
+
+
+def read(name: str, only_years: list[int] | None = None) -> pd.DataFrame:
+    frames = [
+        storage.read_table(f"year_{year}", _layer(name))
+        for year in years(name) if only_years is None or year in only_years
+    ]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def _write_years(rollup: pd.DataFrame, name: str, keys: list[str]) -> int:
+    rollup = rollup.astype({"city_id": "int64"}).sort_values(["city_id", *keys]).reset_index(drop=True)
+    for year, rows in rollup.groupby("year"):
+        storage.write_table(rows, f"year_{int(year)}", _layer(name))
+    return len(rollup)
+
+
+def _migrate(name: str, keys: list[str]) -> None:
+    # Rollups written as one table before the year partitions: split once
+    flat = [storage.layer_dir(LAYER) / f"{name}.csv", storage.layer_dir(LAYER) / name]
+    if not any(path.exists() for path in flat):
+        return
+    if not years(name) and storage.table_exists(name, LAYER):
+        _write_years(storage.read_table(name, LAYER), name, keys)
+    for path in flat:
+        if path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            path.unlink(missing_ok=True)
+
+
+def aggregate_all(facts: pd.DataFrame, date_index: dict[str, int]) -> dict[str, pd.DataFrame]:
+    # Every rollup of a set of facts, e.g. one shard of cities of a parallel transform
+    calendar = _calendar(date_index)
+    facts = facts.dropna(subset=["city_id", "date_id"])
+    return {name: aggregate(facts, calendar, keys) for name, keys in ROLLUPS.items()}
+
+
+def rebuild(aggregates: dict[str, pd.DataFrame]) -> dict[str, int]:
+    # Rollups of every fact, replacing all the years. Aggregates of disjoint sets
+    # of cities are concatenated as they are: they never share a group.
+    sizes = {}
+    for name, keys in ROLLUPS.items():
+        _migrate(name, keys)
+        # Years no fact holds anymore go too
+        shutil.rmtree(storage.layer_dir(_layer(name)), ignore_errors=True)
+        if not aggregates[name].empty:
+            sizes[name] = _write_years(aggregates[name], name, keys)
+    return sizes
+
+
+def update_rollups(
+    new_facts: pd.DataFrame,
+    date_index: dict[str, int],
+    full: bool = False,
+    replaced_date_ids: list[int] | None = None,
+) -> dict[str, int]:
+    # new_facts: rows never seen by the rollups. Groups holding a replaced
+    # fact are recomputed from fact_weather and its deltas (a min or a max cannot be "un-added").
+    # Returns the rows written per rollup, those of the years rewritten.
+    if full:
+        return rebuild(aggregate_all(new_facts, date_index))
+    calendar = _calendar(date_index)
+    new_facts = new_facts.dropna(subset=["city_id", "date_id"])
+    sizes = {}
+
+    periods, recomputed = {}, None
+    if replaced_date_ids:
+        for name, keys in ROLLUPS.items():
+            periods[name] = calendar.loc[calendar["date_id"].isin(replaced_date_ids), keys].drop_duplicates()
+        # One read of the facts of every replaced period, shared by the rollups
+        all_ids = set().union(*(calendar.merge(periods[name], on=keys)["date_id"] for name, keys in ROLLUPS.items()))
+        recomputed = deltas.read("fact_weather", filters=[("date_id", "in", sorted(all_ids))])
+
+    for name, keys in ROLLUPS.items():
+        _migrate(name, keys)
+        parts = []
+        new_facts_part = new_facts
+        if replaced_date_ids:
+            period_ids = calendar.merge(periods[name], on=keys)["date_id"].tolist()
+            parts.append(aggregate(recomputed[recomputed["date_id"].isin(period_ids)], calendar, keys))
+            # Already counted by the recomputation
+            new_facts_part = new_facts[~new_facts["date_id"].isin(period_ids)]
+        parts.append(aggregate(new_facts_part, calendar, keys))
+
+        # Only the years holding a changed group are read and written again
+        touched = {int(year) for part in parts for year in part["year"]}
+        if replaced_date_ids:
+            touched |= set(periods[name]["year"].astype(int))
+        existing = read(name, sorted(touched))
+        if replaced_date_ids and not existing.empty:
+            stale = pd.MultiIndex.from_frame(existing[keys]).isin(pd.MultiIndex.from_frame(periods[name]))
+            existing = existing[~stale]
+        rollup = combine([existing, *parts], keys)
+
+        if rollup.empty:
+            continue
+        sizes[name] = _write_years(rollup, name, keys)
+    return sizes
@@ -0,0 +1,755 @@
+import fcntl
+import gzip
+import io
+import json
+import os
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+import pandas as pd
+from scripts import metrics
+
+# Storage layer shared by the daily and the historical scripts.
+# - "csv": one flat file per table (the historical layout)
+# - "parquet": typed Parquet datasets, partitioned on disk
+# CSV stays available as an export next to the Parquet data for the Sheets users.
+BASE_DIR = Path(os.getenv("AIRFLOW_HOME", Path(__file__).parent.parent))
+STORAGE_FORMAT = os.getenv("WEATHER_STORAGE_FORMAT", "csv").lower()
+CSV_EXPORT = os.getenv("WEATHER_CSV_EXPORT", "true").lower() in ("1", "true", "yes")
+CSV_DATE_FORMAT = "%Y-%m-%d %H:%M:%S.%f"  # Preserve microsecond precision
+# Locale of the CSV tables only, values stay typed everywhere else.
+# A decimal comma (Sheets in French) switches the separator to ";".
+CSV_DECIMAL = os.getenv("WEATHER_CSV_DECIMAL", ".")
+CSV_SEP = ";" if CSV_DECIMAL == "," else ","
+
+FORMATS = ("csv", "parquet")
+# Raw landing files: one file per extraction batch. JSON Lines keeps the API
+# response and batch metadata next to the flat columns, and can be appended to.
+# Gzipped by default: the raw tree is also the archive of every API response.
+RAW_FORMATS = ("jsonl.gz", "jsonl", "csv", "parquet")
+RAW_FORMAT = os.getenv("WEATHER_RAW_FORMAT", "jsonl.gz").lower()
+RAW_NESTED_COLS = ["meta", "payload"]
+SEQUENCES_NAME = "_sequences.json"
+# Partition column derived from extraction_date ("2025-07") when a table is
+# written, dropped again when it is read (meteo_global: month, then city).
+# Filters on extraction_date also prune the months. A CSV table stays one file,
+# its rows grouped by month with the byte offset of each month in a hidden index.
+MONTH_COL = "extraction_month"
+# Every append adds a file to each partition it touches: past this many files,
+# the partition is compacted back into a single one
+PARQUET_COMPACT_FILES = int(os.getenv("WEATHER_PARQUET_COMPACT_FILES", 4))
+
+COLUMN_TYPES = {
+    "city":            "string",
+    "extraction_date": "datetime64[ns]",
+    "date":            "datetime64[ns]",
+    "temperature":     "float64",
+    "humidite":        "float64",
+    "pluie_mm":        "float64",
+    "meteo":           "string",
+    "source":          "string",
+    "temp_min":        "float64",
+    "temp_max":        "float64",
+    "pression":        "float64",
+    "vent":            "float64",
+    "nuages":          "float64",
+    "code_meteo":      "float64",
+    "city_id":         "int64",
+    "date_id":         "int64",
+    "meteo_id":        "int64",
+    "weather_condition_id": "int64",
+}
+# In-memory types of the large reads (read_table(..., compact=True)): labels as
+# categoricals, measurements as float32, keys and date parts as small integers.
+# float32 keeps the 2 decimals the measurements are cleaned to (7 significant
+# digits); widen() gives the float64 values back before they are written.
+# The types on disk stay those of COLUMN_TYPES.
+COMPACT_DTYPES = os.getenv("WEATHER_COMPACT_DTYPES", "true").lower() in ("1", "true", "yes")
+MEASURE_DECIMALS = 2
+COMPACT_TYPES = {
+    "city":                 "category",
+    "meteo":                "category",
+    "source":               "category",
+    "temperature":          "float32",
+    "humidite":             "float32",
+    "pluie_mm":             "float32",
+    "temp_min":             "float32",
+    "temp_max":             "float32",
+    "pression":             "float32",
+    "vent":                 "float32",
+    "nuages":               "float32",
+    "code_meteo":           "float32",
+    "city_id":              "int32",
+    "date_id":              "int32",
+    "meteo_id":             "int32",
+    "weather_condition_id": "int32",
+    "year":                 "int16",
+    "month":                "int8",
+    "day":                  "int8",
+    "day_of_week":          "int8",
+    "season":               "int8",
+}
+
+
+def compact_types(df: pd.DataFrame) -> pd.DataFrame:
+    for col, dtype in COMPACT_TYPES.items():
+        if col not in df.columns or str(df[col].dtype) == dtype:
+            continue
+        if dtype.startswith("int") and df[col].isna().any():
+            # Keys left unmatched stay null
+            dtype = "float32"
+        df[col] = df[col].astype(dtype)
+    return df
+
+
+def widen(df: pd.DataFrame) -> pd.DataFrame:
+    # float32 -> float64 rounded: 18.37, not 18.3700008392334
+    for col in df.select_dtypes("float32").columns:
+        df[col] = df[col].astype("float64").round(MEASURE_DECIMALS)
+    return df
+
+
+def concat_compact(frames: list[pd.DataFrame]) -> pd.DataFrame:
+    # pd.concat turns categoricals with different categories into Python strings:
+    # the categories are unioned first, the codes of the first frame do not move
+    frames = [compact_types(df.copy(deep=False)) for df in frames if not df.empty] or frames[:1]
+    for col in frames[0].select_dtypes("category").columns:
+        categories = pd.Index(pd.unique(pd.concat(
+            [pd.Series(df[col].cat.categories) for df in frames if col in df.columns]
+        )))
+        for df in frames:
+            if col in df.columns:
+                df[col] = df[col].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
+
+
+def _check_format(fmt: str | None) -> str:
+    fmt = (fmt or STORAGE_FORMAT).lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown storage format '{fmt}', expected one of {FORMATS}")
+    if fmt == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError as e:
+            raise ImportError("The parquet storage format requires 'pyarrow'") from e
+    return fmt
+
+
+def layer_dir(layer: str, root: str = "data") -> Path:
+    return BASE_DIR / root / layer
+
+
+def table_path(name: str, layer: str, root: str = "data", fmt: str | None = None) -> Path:
+    fmt = _check_format(fmt)
+    if fmt == "csv":
+        return layer_dir(layer, root) / f"{name}.csv"
+    # Parquet tables are always dataset directories so appends are new files
+    return layer_dir(layer, root) / name
+
+
+def table_exists(name: str, layer: str, root: str = "data", fmt: str | None = None) -> bool:
+    path = table_path(name, layer, root, fmt)
+    if path.is_dir():
+        return any(path.rglob("*.parquet"))
+    return path.exists() and path.stat().st_size > 0
+
+
+def table_columns(name: str, layer: str, root: str = "data", fmt: str | None = None) -> list[str]:
+    fmt = _check_format(fmt)
+    path = table_path(name, layer, root, fmt)
+    if fmt == "csv":
+        return list(pd.read_csv(path, nrows=0, sep=CSV_SEP).columns)
+
+    import pyarrow.dataset as ds
+    names = ds.dataset(path, format="parquet", partitioning="hive").schema.names
+    return [col for col in names if col != MONTH_COL]
+
+
+def month_partitioned(name: str, layer: str, root: str = "data", fmt: str | None = None) -> bool:
+    # Tables written before the month partitions need one full rewrite first,
+    # their CSV export included
+    fmt = _check_format(fmt)
+    path = table_path(name, layer, root, fmt)
+    if fmt == "csv":
+        return _load_month_index(path) is not None
+    if CSV_EXPORT and not month_partitioned(name, layer, root, "csv"):
+        return False
+    return any(path.glob(f"{MONTH_COL}=*"))
+
+
+def months_of(dates: pd.Series) -> pd.Series:
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = pd.to_datetime(dates, format="ISO8601", utc=True).dt.tz_localize(None)
+    return dates.dt.strftime("%Y-%m")
+
+
+def _month_filters(filters: list[tuple] | None) -> list[tuple]:
+    # The extraction_date bounds of a read, as bounds on its month
+    month_filters = []
+    for col, op, value in filters or []:
+        if col != "extraction_date":
+            continue
+        if op in (">", ">="):
+            month_filters.append((MONTH_COL, ">=", pd.Timestamp(value).strftime("%Y-%m")))
+        elif op in ("<", "<="):
+            month_filters.append((MONTH_COL, "<=", pd.Timestamp(value).strftime("%Y-%m")))
+        elif op in ("=", "=="):
+            month_filters.append((MONTH_COL, "==", pd.Timestamp(value).strftime("%Y-%m")))
+        elif op == "in":
+            month_filters.append((MONTH_COL, "in", sorted({pd.Timestamp(v).strftime("%Y-%m") for v in value})))
+    return month_filters
+
+
+# ---------------- transactions: locks, atomic replace, sequences ----------------
+
+@contextmanager
+def lock(name: str, shared: bool = False):
+    # Advisory lock shared by every task and script of this AIRFLOW_HOME.
+    # Not reentrant: a holder must not take the same lock again.
+    lock_file = BASE_DIR / "locks" / f"{name}.lock"
+    lock_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_file, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _temp_path(path: Path) -> Path:
+    # Same directory as the target so the final rename never crosses filesystems
+    return path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.{uuid.uuid4().hex[:8]}.tmp")
+
+
+def _discard(path: Path) -> None:
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+
+
+@contextmanager
+def atomic_path(path: Path):
+    # Yields a temporary path, renamed over the target once the block succeeds:
+    # readers see the old or the new version, never a half-written one
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = _temp_path(path)
+    try:
+        yield tmp_path
+    except BaseException:
+        _discard(tmp_path)
+        raise
+
+    if tmp_path.is_dir() and path.exists():
+        # A directory cannot be renamed over a non-empty one: swap, then drop the old one
+        old_path = _temp_path(path)
+        path.rename(old_path)
+        tmp_path.rename(path)
+        shutil.rmtree(old_path, ignore_errors=True)
+    else:
+        os.replace(tmp_path, path)
+
+
+def next_ids(sequence: str, count: int, layer: str, root: str = "data", floor: int = 0) -> range:
+    # Single writer of the surrogate keys of a layer: two runs never get the same ids.
+    # floor seeds the sequence from the ids already in the tables.
+    sequences_file = layer_dir(layer, root) / SEQUENCES_NAME
+    with lock(f"{root}_{layer}_sequences"):
+        sequences = {}
+        if sequences_file.exists():
+            with open(sequences_file) as f:
+                sequences = json.load(f)
+        start = max(sequences.get(sequence, 0), floor) + 1
+        sequences[sequence] = start + count - 1
+        with atomic_path(sequences_file) as tmp_file:
+            with open(tmp_file, "w") as f:
+                json.dump(sequences, f, indent=2)
+    return range(start, start + count)
+
+
+def _size(path: Path) -> int:
+    if path.is_dir():
+        return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+    return path.stat().st_size if path.exists() else 0
+
+
+def _coerce_types(df: pd.DataFrame) -> pd.DataFrame:
+    df = widen(df)
+    for col, dtype in COLUMN_TYPES.items():
+        if col not in df.columns or str(df[col].dtype) == dtype:
+            continue
+        if dtype.startswith("datetime"):
+            # Historical rows are tz-aware (UTC) while daily rows are naive local times
+            df[col] = pd.to_datetime(df[col], errors="coerce", format="ISO8601", utc=True).dt.tz_localize(None)
+        elif dtype.startswith(("int", "float")):
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+            if not df[col].isna().any():
+                df[col] = df[col].astype(dtype)
+        else:
+            df[col] = df[col].astype(dtype)
+    return df
+
+
+def _apply_filters(df: pd.DataFrame, filters: list[tuple] | None) -> pd.DataFrame:
+    # Same (column, op, value) tuples as pyarrow, evaluated in pandas for CSV
+    if not filters:
+        return df
+    mask = pd.Series(True, index=df.index)
+    for col, op, value in filters:
+        series = df[col]
+        if op in ("=", "=="):
+            mask &= series == value
+        elif op == "!=":
+            mask &= series != value
+        elif op == "<":
+            mask &= series < value
+        elif op == "<=":
+            mask &= series <= value
+        elif op == ">":
+            mask &= series > value
+        elif op == ">=":
+            mask &= series >= value
+        elif op == "in":
+            mask &= series.isin(value)
+        elif op == "not in":
+            mask &= ~series.isin(value)
+        else:
+            raise ValueError(f"Unsupported filter operator '{op}'")
+    return df[mask].reset_index(drop=True)
+
+
+# ---------------- CSV month index: .{name}.csv.months.json ----------------
+
+def _month_index_file(path: Path) -> Path:
+    return path.with_name(f".{path.name}.months.json")
+
+
+def _load_month_index(path: Path) -> dict | None:
+    # Only valid for the file it was saved with: a table changed without it (an
+    # older version, a crash between the two writes) is read and rewritten in full
+    index_file = _month_index_file(path)
+    if not path.exists() or not index_file.exists():
+        return None
+    with open(index_file) as f:
+        index = json.load(f)
+    stat = path.stat()
+    if (index["size"], index["mtime_ns"]) != (stat.st_size, stat.st_mtime_ns):
+        return None
+    return index
+
+
+def _save_month_index(path: Path, offsets: dict) -> None:
+    stat = path.stat()
+    with atomic_path(_month_index_file(path)) as tmp_file:
+        with open(tmp_file, "w") as f:
+            json.dump({"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "months": dict(sorted(offsets.items()))}, f, indent=2)
+
+
+def _csv_lines(df: pd.DataFrame, columns: list[str] | None = None) -> bytes:
+    df = df if columns is None else df.reindex(columns=columns)
+    return df.to_csv(
+        index=False, header=False, date_format=CSV_DATE_FORMAT, sep=CSV_SEP, decimal=CSV_DECIMAL
+    ).encode()
+
+
+def _month_lines(df: pd.DataFrame, columns: list[str] | None = None) -> dict[str, bytes]:
+    # Rows keep their order within a month
+    months = months_of(df["extraction_date"]).to_numpy()
+    return {month: _csv_lines(rows, columns) for month, rows in df.groupby(months, sort=True)}
+
+
+def _copy_range(src, dst, lo: int, hi: int, block: int = 1 << 20) -> None:
+    src.seek(lo)
+    while lo < hi:
+        data = src.read(min(block, hi - lo))
+        if not data:
+            break
+        dst.write(data)
+        lo += len(data)
+
+
+def _splice_csv_months(path: Path, index: dict, lines: dict[str, bytes], replace: bool = False) -> None:
+    # Rows of the last month or later are appended in place (the caller holds the
+    # table lock). Backdated rows rewrite their month and the ones after it into a
+    # copy renamed over the table: a crash leaves the old file, never a cut one.
+    # replace: the months of `lines` lose their current rows.
+    offsets, size = index["months"], index["size"]
+    first = min(lines)
+    if not offsets or first > max(offsets) or (first == max(offsets) and not replace):
+        new_offsets = dict(offsets)
+        with open(path, "ab") as f:
+            for month, segment in sorted(lines.items()):
+                new_offsets.setdefault(month, f.tell())
+                f.write(segment)
+        _save_month_index(path, new_offsets)
+        metrics.record(bytes_written=sum(len(segment) for segment in lines.values()))
+        return
+
+    start = min(offset for month, offset in offsets.items() if month >= first)
+    bounds = sorted((offset, month) for month, offset in offsets.items() if offset >= start) + [(size, None)]
+    segments = {month: (lo, hi) for (lo, month), (hi, _) in zip(bounds, bounds[1:])}
+    new_offsets = {month: offset for month, offset in offsets.items() if offset < start}
+    with atomic_path(path) as tmp_path:
+        # The months before `start` do not move: a kernel copy, then cut
+        shutil.copyfile(path, tmp_path)
+        with open(path, "rb") as old, open(tmp_path, "r+b") as f:
+            f.truncate(start)
+            f.seek(start)
+            for month in sorted(set(segments) | set(lines)):
+                offset = f.tell()
+                if month in segments and not (replace and month in lines):
+                    _copy_range(old, f, *segments[month])
+                f.write(lines.get(month, b""))
+                if f.tell() > offset:
+                    new_offsets[month] = offset
+            written = f.tell() - start
+    _save_month_index(path, new_offsets)
+    metrics.record(bytes_read=size, bytes_written=size + written - start)
+
+
+def _read_csv_months(path: Path, index: dict, month_filters: list[tuple]) -> bytes:
+    # The header, then the rows of the months the filters can match
+    offsets = index["months"]
+    months = pd.DataFrame({MONTH_COL: sorted(offsets)})
+    wanted = set(_apply_filters(months, month_filters)[MONTH_COL])
+    bounds = sorted((offset, month) for month, offset in offsets.items()) + [(index["size"], None)]
+    with open(path, "rb") as f:
+        chunks = [f.readline()]
+        for (lo, month), (hi, _) in zip(bounds, bounds[1:]):
+            if month in wanted:
+                f.seek(lo)
+                chunks.append(f.read(hi - lo))
+    return b"".join(chunks)
+
+
+def _write_csv(df: pd.DataFrame, path: Path, mode: str, by_month: bool = False) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    size_before = _size(path) if mode == "append" else 0
+    appending = mode == "append" and path.exists() and path.stat().st_size > 0
+    index = _load_month_index(path) if by_month and (appending or mode == "replace") else None
+    if mode == "replace" and index is None:
+        raise ValueError(f"{path} has no month index, its months cannot be replaced")
+    if index is not None:
+        if not df.empty:
+            columns = list(pd.read_csv(path, nrows=0, sep=CSV_SEP).columns)
+            _splice_csv_months(path, index, _month_lines(df, columns), replace=mode == "replace")
+        return
+    if appending:
+        # Appended in place (the caller holds the table lock), a copy would cost the whole history
+        columns = list(pd.read_csv(path, nrows=0, sep=CSV_SEP).columns)
+        df.reindex(columns=columns).to_csv(
+            path, mode="a", header=False, index=False,
+            date_format=CSV_DATE_FORMAT, sep=CSV_SEP, decimal=CSV_DECIMAL
+        )
+    elif by_month:
+        offsets = {}
+        with atomic_path(path) as tmp_path:
+            with open(tmp_path, "wb") as f:
+                f.write(df.head(0).to_csv(index=False, sep=CSV_SEP).encode())
+                for month, lines in _month_lines(df).items():
+                    offsets[month] = f.tell()
+                    f.write(lines)
+        _save_month_index(path, offsets)
+    else:
+        with atomic_path(path) as tmp_path:
+            df.to_csv(tmp_path, index=False, date_format=CSV_DATE_FORMAT, sep=CSV_SEP, decimal=CSV_DECIMAL)
+    metrics.record(bytes_written=_size(path) - size_before)
+
+
+def _compact_partition(partition_dir: Path) -> None:
+    # The files of the partition, oldest first, rewritten as one and swapped in
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    files = sorted(partition_dir.glob("*.parquet"), key=lambda f: f.stat().st_mtime_ns)
+    if len(files) <= PARQUET_COMPACT_FILES:
+        return
+    size_before = _size(partition_dir)
+    table = pa.concat_tables([pq.read_table(f) for f in files], promote_options="default")
+    with atomic_path(partition_dir) as tmp_dir:
+        tmp_dir.mkdir()
+        pq.write_table(table, tmp_dir / f"{uuid.uuid4().hex}-0.parquet")
+    metrics.record(bytes_read=size_before, bytes_written=_size(partition_dir))
+
+
+def _write_parquet(df: pd.DataFrame, path: Path, mode: str, partition_cols: list[str] | None) -> None:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    df = _coerce_types(df.copy())
+    if partition_cols and MONTH_COL in partition_cols:
+        df[MONTH_COL] = months_of(df["extraction_date"])
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    written = []
+    if mode == "append":
+        # New files with unique names next to the existing ones
+        path.mkdir(parents=True, exist_ok=True)
+        files = []
+        pq.write_to_dataset(
+            table,
+            root_path=path,
+            partition_cols=partition_cols or None,
+            existing_data_behavior="overwrite_or_ignore",
+            file_visitor=lambda f: (written.append(f.size), files.append(f.path)),
+        )
+        if partition_cols:
+            for partition_dir in {Path(f).parent for f in files}:
+                _compact_partition(partition_dir)
+    elif mode == "replace":
+        # One month directory at a time, swapped in like a rewritten table
+        rest = [col for col in partition_cols if col != MONTH_COL]
+        for month, rows in df.groupby(MONTH_COL, sort=True):
+            month_table = pa.Table.from_pandas(rows.drop(columns=MONTH_COL), preserve_index=False)
+            with atomic_path(path / f"{MONTH_COL}={month}") as tmp_path:
+                pq.write_to_dataset(
+                    month_table, root_path=tmp_path, partition_cols=rest or None,
+                    file_visitor=lambda f: written.append(f.size),
+                )
+    else:
+        with atomic_path(path) as tmp_path:
+            pq.write_to_dataset(
+                table, root_path=tmp_path, partition_cols=partition_cols or None,
+                file_visitor=lambda f: written.append(f.size),
+            )
+    metrics.record(bytes_written=sum(size or 0 for size in written))
+
+
+def write_table(
+    df: pd.DataFrame,
+    name: str,
+    layer: str,
+    root: str = "data",
+    mode: str = "overwrite",
+    partition_cols: list[str] | None = None,
+    fmt: str | None = None,
+) -> Path:
+    # replace: df holds every row of the months it covers, they replace the rows
+    # of these months and the other months are not touched (month partitions only)
+    if mode not in ("overwrite", "append", "replace"):
+        raise ValueError(f"Unknown write mode '{mode}'")
+    # CSV tables stay single files, only the month partition applies to them
+    by_month = MONTH_COL in (partition_cols or [])
+    if mode == "replace" and not by_month:
+        raise ValueError(f"The replace mode needs the {MONTH_COL} partition")
+
+    fmt = _check_format(fmt)
+    path = table_path(name, layer, root, fmt)
+
+    metrics.record(rows_written=len(df))
+    if fmt == "csv":
+        _write_csv(df, path, mode, by_month)
+        return path
+
+    _write_parquet(df, path, mode, partition_cols)
+    if CSV_EXPORT:
+        _write_csv(df, table_path(name, layer, root, "csv"), mode, by_month)
+    return path
+
+
+def _parquet_scan_size(path: Path, filters: list[tuple] | None) -> int:
+    # Size of the files left after partition pruning, i.e. what the read opened
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    expression = pq.filters_to_expression(filters) if filters else None
+    return sum(os.path.getsize(fragment.path) for fragment in dataset.get_fragments(filter=expression))
+
+
+def read_table(
+    name: str,
+    layer: str,
+    root: str = "data",
+    columns: list[str] | None = None,
+    filters: list[tuple] | None = None,
+    fmt: str | None = None,
+    compact: bool = False,
+) -> pd.DataFrame:
+    # compact: COMPACT_TYPES applied while reading, for the reads of a whole history
+    fmt = _check_format(fmt)
+    path = table_path(name, layer, root, fmt)
+    compact = compact and COMPACT_DTYPES
+
+    if fmt == "csv":
+        usecols = None
+        if columns is not None:
+            # Filter columns must be loaded even if they are not projected
+            usecols = list(dict.fromkeys(list(columns) + [f[0] for f in filters or []]))
+        dtype = None
+        if compact:
+            # Labels never exist as Python strings per row; integers wait for the NaN check
+            dtype = {col: t for col, t in COMPACT_TYPES.items() if not t.startswith("int")}
+        source, size = path, _size(path)
+        month_filters = _month_filters(filters)
+        index = _load_month_index(path) if month_filters else None
+        if index is not None:
+            # Only the bytes of the months the filters can match
+            data = _read_csv_months(path, index, month_filters)
+            source, size = io.BytesIO(data), len(data)
+        df = pd.read_csv(source, usecols=usecols, sep=CSV_SEP, decimal=CSV_DECIMAL, dtype=dtype)
+        for col, dtype in COLUMN_TYPES.items():
+            if col in df.columns and dtype.startswith("datetime"):
+                df[col] = pd.to_datetime(df[col], format="ISO8601")
+        metrics.record(bytes_read=size, rows_read=len(df))
+        df = _apply_filters(df, filters)
+        df = df[columns] if columns is not None else df
+        return compact_types(df) if compact else df
+
+    kwargs = {}
+    if compact:
+        # Dictionary-encoded by Arrow, they arrive as categoricals
+        kwargs["read_dictionary"] = [col for col, t in COMPACT_TYPES.items() if t == "category"]
+    if filters and any(path.glob(f"{MONTH_COL}=*")):
+        filters = filters + _month_filters(filters)
+    df = pd.read_parquet(path, columns=columns, filters=filters, **kwargs)
+    if MONTH_COL in df.columns and columns is None:
+        df = df.drop(columns=MONTH_COL)
+    if metrics.active():
+        metrics.record(bytes_read=_parquet_scan_size(path, filters), rows_read=len(df))
+    if compact:
+        return compact_types(df)
+    # Hive partition keys come back as categoricals, restore their values' type
+    for col in df.select_dtypes("category").columns:
+        df[col] = df[col].astype(df[col].cat.categories.dtype)
+    return df
+
+
+# ---------------- raw landing zone: {root}/raw/{date}/meteo_{batch}.{ext} ----------------
+
+def _check_raw_format(fmt: str | None) -> str:
+    fmt = (fmt or RAW_FORMAT).lower()
+    if fmt not in RAW_FORMATS:
+        raise ValueError(f"Unknown raw format '{fmt}', expected one of {RAW_FORMATS}")
+    return fmt if fmt.startswith("jsonl") else _check_format(fmt)
+
+
+def raw_format(file: Path) -> str | None:
+    return next((fmt for fmt in RAW_FORMATS if file.name.endswith(f".{fmt}")), None)
+
+
+def _open_text(file: Path, mode: str, fmt: str):
+    # Appending to a gzip file adds a member, readers see one stream
+    if fmt == "jsonl.gz":
+        return gzip.open(file, mode + "t", compresslevel=6)
+    return open(file, mode)
+
+
+def _to_jsonl(df: pd.DataFrame) -> str:
+    # Same 2 decimals as the CSV landing files, the full values stay in "payload"
+    floats = df.select_dtypes("float").columns
+    df = df.assign(**{col: df[col].astype("float64").round(2) for col in floats})
+    # Nested columns last, see _flat_line
+    nested = [col for col in RAW_NESTED_COLS if col in df.columns]
+    df = df[[col for col in df.columns if col not in nested] + nested]
+    return df.to_json(orient="records", lines=True, date_format="iso", date_unit="us")
+
+
+def write_partition(
+    df: pd.DataFrame,
+    date: str,
+    name: str,
+    layer: str = "raw",
+    root: str = "data",
+    fmt: str | None = None,
+    mode: str = "overwrite",
+) -> Path:
+    fmt = _check_raw_format(fmt)
+    if mode not in ("overwrite", "append"):
+        raise ValueError(f"Unknown write mode '{mode}'")
+    if mode == "append" and fmt == "parquet":
+        raise ValueError("Parquet raw files cannot be appended to")
+    target_dir = layer_dir(layer, root) / date
+    target_dir.mkdir(parents=True, exist_ok=True)
+    out_file = target_dir / f"{name}.{fmt}"
+    if not fmt.startswith("jsonl"):
+        # Only JSON Lines can carry the nested API response
+        df = df.drop(columns=RAW_NESTED_COLS, errors="ignore")
+    size_before = _size(out_file) if mode == "append" else 0
+
+    if mode == "append":
+        # Several tasks may append to the same batch file
+        with lock(f"{root}-{layer}-{date}-{name}"), _open_text(out_file, "a", fmt) as f:
+            if fmt.startswith("jsonl"):
+                f.write(_to_jsonl(df))
+            else:
+                df.to_csv(f, index=False, header=f.tell() == 0, float_format="%.2f")
+    elif fmt.startswith("jsonl"):
+        with atomic_path(out_file) as tmp_file, _open_text(tmp_file, "w", fmt) as f:
+            f.write(_to_jsonl(df))
+    elif fmt == "csv":
+        with atomic_path(out_file) as tmp_file:
+            df.to_csv(tmp_file, index=False, float_format="%.2f")
+    else:
+        with atomic_path(out_file) as tmp_file:
+            _coerce_types(df.copy()).to_parquet(tmp_file, index=False)
+    metrics.record(rows_written=len(df), bytes_written=_size(out_file) - size_before)
+    return out_file
+
+
+def partition_files(partition_dir: Path, prefix: str = "meteo_") -> list[Path]:
+    return sorted(
+        f for f in partition_dir.iterdir()
+        if f.name.startswith(prefix) and raw_format(f) is not None
+    )
+
+
+def _flat_line(line: str) -> str:
+    # The nested columns close every line: the flat columns are parsed without them.
+    # An unescaped '"' cannot occur inside a JSON string, so the cut is at a real key.
+    for col in RAW_NESTED_COLS:
+        cut = line.find(f',"{col}":')
+        if cut >= 0:
+            return line[:cut] + "}"
+    return line
+
+
+def _read_jsonl(file: Path, columns: list[str] | None, nested: bool) -> pd.DataFrame:
+    wants_nested = nested or bool(columns and set(columns) & set(RAW_NESTED_COLS))
+    with _open_text(file, "r", raw_format(file)) as f:
+        lines = [line if wants_nested else _flat_line(line.rstrip()) for line in f if line.strip()]
+    # One json.loads for the whole batch: about twice as fast as one call per line
+    df = pd.DataFrame.from_records(json.loads("[" + ",".join(lines) + "]"))
+    if columns is not None:
+        df = df.reindex(columns=columns)
+    elif not nested:
+        df = df.drop(columns=RAW_NESTED_COLS, errors="ignore")
+    if "extraction_date" in df.columns:
+        df["extraction_date"] = pd.to_datetime(df["extraction_date"], format="ISO8601")
+    return df
+
+
+def read_file(file: Path, columns: list[str] | None = None, nested: bool = False) -> pd.DataFrame:
+    # Format is taken from the suffix so a tree can mix JSON Lines, CSV and Parquet
+    # partitions. "meta" and "payload" are only returned when asked for.
+    if raw_format(file).startswith("jsonl"):
+        df = _read_jsonl(file, columns, nested)
+    elif file.suffix == ".parquet":
+        df = pd.read_parquet(file, columns=columns)
+    else:
+        df = pd.read_csv(
+            file,
+            usecols=columns,
+            parse_dates=["extraction_date"] if columns is None or "extraction_date" in columns else None,
+            date_format="ISO8601"
+        )
+    metrics.record(bytes_read=_size(file), rows_read=len(df))
+    return df
+
+
+def read_partition(
+    date: str,
+    layer: str = "raw",
+    root: str = "data",
+    columns: list[str] | None = None,
+) -> list[pd.DataFrame]:
+    partition_dir = layer_dir(layer, root) / date
+    return [read_file(f, columns) for f in partition_files(partition_dir)]
+
+
+def list_partitions(layer: str = "raw", root: str = "data") -> list[Path]:
+    base = layer_dir(layer, root)
+    if not base.exists():
+        return []
+    return sorted(d for d in base.iterdir() if d.is_dir())
@@ -1,59 +1,275 @@
-import pandas as pd
-from pathlib import Path
+import json
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scripts import deltas
+from scripts import metrics
+from scripts import rollups
+from scripts import storage
+from scripts.merge import load_manifest
 
-BASE_DIR = Path(os.getenv("AIRFLOW_HOME", Path(__file__).parent.parent))
+LAYER = "star_schema"
+FACT_PARTITION_COLS = deltas.PARTITION_COLS["fact_weather"]
+FACT_KEY = deltas.KEYS["fact_weather"]
+STATE_NAME = "_transform_state.json"
+# meteo_global keeps one row per city, day and source, fact_weather one per city
+# and day: when both APIs have the day (the monthly Open-Meteo backfill covers the
+# days of the daily runs), the fact comes from the first source of this list, and
+# from its latest extraction. The archive's daily aggregates come first by
+# default, the OpenWeatherMap reading is a single moment of the day.
+SOURCE_PRIORITY = [
+    source.strip() for source in os.getenv("WEATHER_SOURCE_PRIORITY", "open-meteo,openweathermap").split(",")
+]
+# Processes building the facts and rollups of a full rebuild, one shard of
+# cities each. 1 keeps the single-process path.
+WORKERS = int(os.getenv("WEATHER_TRANSFORM_WORKERS", 1))
+ID_COLS = ["city_id", "date_id", "weather_condition_id"]
 
-def transform_to_star_schema() -> str:
-    input_file   = BASE_DIR / "data" / "processed" / "meteo_global.csv"
-    output_dir   = BASE_DIR / "data" / "star_schema"
-    city_dim_path = output_dir / "dim_city.csv"
-    fact_path     = output_dir / "fact_weather.csv"
+# ================= STATE =================
+# Persistent hash indexes of the dimensions (city -> city_id, date -> date_id,
+# code -> meteo_id) and the watermark of the last processed extraction_date.
+# "updates" is the last merge update re-derived, "changed_dates" the days before
+# the watermark re-derived since the last rebuild (day -> merge update).
 
-    output_dir.mkdir(parents=True, exist_ok=True)
-    weather_data = pd.read_csv(input_file)
-    
-    # -------- dimension: city_dim  -----------------------------------------
-    
-    if city_dim_path.exists():
-        city_dim = pd.read_csv(city_dim_path)
-    else:
-        city_dim = pd.DataFrame(columns=["city_id", "city"])
+def _state_file():
+    return storage.layer_dir(LAYER) / STATE_NAME
 
-    new_city = set(weather_data["city"]) - set(city_dim["city"])
-    if new_city:
-        next_id = (city_dim["city_id"].max() + 1) if not city_dim.empty else 1
-        city_dim = pd.concat(
-            [
-                city_dim,
-                pd.DataFrame(
-                    {"city_id": range(next_id, next_id + len(new_city)),
-                     "city": list(new_city)}
-                ),
-            ],
-            ignore_index=True,
+def load_state() -> dict | None:
+    if not _state_file().exists():
+        return None
+    with open(_state_file()) as f:
+        return json.load(f)
+
+def _save_state(state: dict) -> None:
+    with storage.atomic_path(_state_file()) as tmp_file:
+        with open(tmp_file, "w") as f:
+            json.dump(state, f)
+
+def _index_dimensions() -> dict:
+    # Built once from the dimension tables, then kept up to date in the state file
+    state = {"city": {}, "date": {}, "meteo": {}, "watermark": None, "watermark_rows": 0, "watermark_keys": [], "fact_rows": 0}
+
+    if deltas.exists("dim_city"):
+        city_dim = deltas.read("dim_city")
+        state["city"] = dict(zip(city_dim["city"], city_dim["city_id"].astype(int).tolist()))
+
+    if deltas.exists("dim_date"):
+        dim_date = deltas.read("dim_date")
+        state["date"] = dict(zip(
+            pd.to_datetime(dim_date["date"]).dt.strftime("%Y-%m-%d"),
+            dim_date["date_id"].astype(int).tolist()
+        ))
+
+    dim_meteo = storage.read_table("dim_meteo", LAYER)
+    state["meteo"] = dict(zip(dim_meteo["code_meteo"].astype(str), dim_meteo["meteo_id"].astype(int).tolist()))
+    return state
+
+def _lookup(values: pd.Series, index: dict, key=str) -> pd.Series:
+    # Hash lookup once per distinct value, broadcast with the codes (categoricals
+    # already have them). int32 ids, float32 if a value has no id.
+    codes, uniques = pd.factorize(values)
+    ids = np.array([index.get(key(value), np.nan) for value in uniques] + [np.nan])[codes]
+    return pd.Series(ids.astype("float32" if np.isnan(ids).any() else "int32"), index=values.index)
+
+def _by_priority(weather_data: pd.DataFrame) -> pd.DataFrame:
+    # Ordered so that drop_duplicates(keep="last") keeps the row of SOURCE_PRIORITY.
+    # Sources missing from the list come last, a table without source keeps its order.
+    if "source" not in weather_data.columns:
+        return weather_data
+    ranks = {source: len(SOURCE_PRIORITY) - i for i, source in enumerate(SOURCE_PRIORITY)}
+    rank = weather_data["source"].astype("string").map(ranks).fillna(0).to_numpy()
+    order = np.lexsort((weather_data["extraction_date"].to_numpy(), rank))
+    return weather_data.iloc[order].reset_index(drop=True)
+
+def _code_key(value) -> str | None:
+    # 800, 800.0 and "800" are the same code, a label ("Clouds") has none
+    try:
+        return str(int(float(value)))
+    except (TypeError, ValueError):
+        return None
+
+def _condition_ids(weather_data: pd.DataFrame, index: dict) -> pd.Series:
+    # dim_meteo.code_meteo holds OpenWeatherMap weather ids (weather.0.id) and
+    # Open-Meteo weather codes: looked up on code_meteo, then on the label for the
+    # rows merged before code_meteo existed (an Open-Meteo label is its code)
+    ids = _lookup(weather_data["meteo"], index, key=_code_key)
+    if "code_meteo" in weather_data.columns:
+        ids = _lookup(weather_data["code_meteo"], index, key=_code_key).fillna(ids)
+    return ids.astype("float32" if ids.isna().any() else "int32")
+
+def _facts(weather_data: pd.DataFrame, dates: pd.Series, indexes: dict) -> pd.DataFrame:
+    # Hash lookups on the persisted indexes instead of merges over the full dimensions.
+    # One fact per city and day: the row of the preferred source (_by_priority).
+    # The index of weather_data is kept, the caller resets it.
+    return (
+        weather_data
+        .drop(columns=["city", "extraction_date", "meteo", "source"], errors="ignore")
+        .assign(
+            city_id              = _lookup(weather_data["city"], indexes["city"]),
+            date_id              = _lookup(dates, indexes["date"], key=lambda d: d.strftime("%Y-%m-%d")),
+            weather_condition_id = _condition_ids(weather_data, indexes["meteo"]),
         )
-        city_dim.to_csv(city_dim_path, index=False)
-# ================= DIMENSION DATE =================
-    dim_date_path = output_dir / "dim_date.csv"
+        .drop_duplicates(subset=FACT_KEY, keep="last")
+    )
+
+# ================= PARALLEL FULL REBUILD =================
+# Once the keys are allocated, the facts of a city only depend on its rows: each
+# worker builds the facts and the rollups of a shard of whole cities. The parent
+# puts the facts back in row order and writes the tables once, so the output is
+# the same as with one process.
+
+def _shards(cities: pd.Series, count: int) -> list[np.ndarray]:
+    # Row positions of contiguous blocks of cities, about as many rows in each
+    codes, _ = pd.factorize(cities, sort=True)
+    sizes = np.bincount(codes[codes >= 0])
+    shard_of_city = (np.cumsum(sizes) - sizes) * count // sizes.sum()
+    # Rows without a city all go to the first shard, deduplicated together as in one process
+    shard_of_row = np.where(codes >= 0, shard_of_city[codes], 0)
+    return [rows for rows in (np.flatnonzero(shard_of_row == s) for s in range(count)) if len(rows)]
+
+def _fact_shard(
+    weather_data: pd.DataFrame, dates: pd.Series, indexes: dict
+) -> tuple[pd.DataFrame, dict[str, pd.DataFrame]]:
+    # Runs in a worker process
+    facts = _facts(weather_data, dates, indexes)
+    return facts, rollups.aggregate_all(facts, indexes["date"])
+
+def _parallel_facts(
+    weather_data: pd.DataFrame, dates: pd.Series, state: dict, workers: int
+) -> tuple[pd.DataFrame, dict[str, pd.DataFrame]]:
+    indexes = {dim: state[dim] for dim in ("city", "date", "meteo")}
+    shards = _shards(weather_data["city"], workers)
+    print(f"Building the facts in {len(shards)} shards of cities on {workers} processes")
+
+    # spawn: a fork would copy the threads and locks of the task runner along with the task
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, len(shards)), mp_context=context) as pool:
+        results = list(pool.map(
+            _fact_shard,
+            [weather_data.iloc[rows] for rows in shards],
+            [dates.iloc[rows] for rows in shards],
+            [indexes] * len(shards),
+        ))
+
+    fact_data = pd.concat([facts for facts, _ in results]).sort_index().reset_index(drop=True)
+    # An id missing in one shard only must not change the type of the others
+    fact_data = fact_data.astype({col: "float32" if fact_data[col].isna().any() else "int32" for col in ID_COLS})
+    # The shards hold different cities: their rollup groups never overlap
+    aggregates = {
+        name: pd.concat([parts[name] for _, parts in results], ignore_index=True)
+        for name in rollups.ROLLUPS
+    }
+    return fact_data, aggregates
+
+@metrics.instrumented("transform")
+def transform_to_star_schema(incremental: bool = True, ds: str | None = None, workers: int | None = None) -> str:
+    # One run at a time: dimensions, facts and state are read-modified-written together
+    with storage.lock(LAYER):
+        return _build_star_schema(incremental, ds, workers or WORKERS)
+
+def _build_star_schema(incremental: bool, ds: str | None, workers: int) -> str:
+    output_dir = storage.layer_dir(LAYER)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # ================= DIMENSION METEO =================
+    if not storage.table_exists("dim_meteo", LAYER):
+        # Mapping initial des codes météo (à adapter selon vos besoins)
+        dim_meteo = pd.DataFrame({
+            "meteo_id": [1, 2, 3, 4, 5],
+            "code_meteo": [51, 80, 800, 801, 802],
+            "description": ["bruine", "pluie légère", "ciel dégagé", "peu nuageux", "partiellement nuageux"],
+            "severity": [1, 2, 0, 0, 1]
+        })
+        storage.write_table(dim_meteo, "dim_meteo", LAYER)
+
+    # Manifest and table read together, no merge can rewrite them in between
+    with storage.lock("meteo_global", shared=True):
+        manifest = load_manifest()
+        generation = manifest.get("rewrites", 0)
+        previous = load_state()
+        state = previous if incremental else None
+        if state is not None and state.get("generation") != generation:
+            print("meteo_global has been rewritten since the last run, rebuilding the star schema")
+            state = None
+        if state is not None and state.get("deltas_written", deltas.written()) < deltas.written():
+            # A run stopped between its deltas and its state: its ids are in the
+            # dimension deltas, its facts may be in the rollups. Rebuilt from the
+            # dimensions on disk, no id is allocated twice and no fact counted twice.
+            print("The last run did not save its state, rebuilding the star schema")
+            state = None
+
+        full_rebuild = state is None or state["watermark"] is None
+        if state is None:
+            state = _index_dimensions()
+        state["generation"] = generation
+        # Counts the rewrites of fact_weather, for the sinks that load it incrementally
+        state["rebuilds"] = (previous or {}).get("rebuilds", 0) + int(full_rebuild)
+
+        # Days merged again since the last run (reruns, backdated rows)
+        changed = []
+        if full_rebuild:
+            state["changed_dates"] = {}
+        else:
+            changed = sorted(
+                day for day, update in manifest.get("changed_dates", {}).items()
+                if update > state.get("updates", 0)
+            )
+            state["changed_dates"] = {
+                **state.get("changed_dates", {}),
+                **{day: manifest["changed_dates"][day] for day in changed if day < state["watermark"]},
+            }
+        state["updates"] = manifest.get("updates", 0)
+
+        # Compact types: categorical labels, float32 measurements (storage.COMPACT_TYPES)
+        if full_rebuild:
+            weather_data = storage.read_table("meteo_global", "processed", compact=True)
+        else:
+            # Only the rows since the last watermark, and since the oldest changed
+            # day if any, are joined (whole months skipped in both formats)
+            weather_data = storage.read_table(
+                "meteo_global", "processed", compact=True,
+                filters=[("extraction_date", ">=", pd.Timestamp(min([state["watermark"], *changed])))]
+            )
 
     weather_data["extraction_date"] = pd.to_datetime(weather_data["extraction_date"])
+    if changed:
+        days = weather_data["extraction_date"].dt.strftime("%Y-%m-%d")
+        weather_data = weather_data[(days >= state["watermark"]) | days.isin(changed)].reset_index(drop=True)
+    weather_data = _by_priority(weather_data)
+    dates = weather_data["extraction_date"].dt.normalize()
+    unique_dates = pd.DatetimeIndex(dates.dropna().unique())
+    if not unique_dates.empty:
+        new_watermark = unique_dates.max()
+        # Rows of every source: a row of either one on the watermark day may change its facts
+        watermark_rows = int((dates == new_watermark).sum())
 
-    dates = weather_data["extraction_date"].dt.normalize().unique()
+    if not full_rebuild:
+        on_watermark = dates == pd.Timestamp(state["watermark"])
+        if state["watermark"] not in changed and on_watermark.sum() == state["watermark_rows"]:
+            # The history is append-only: the watermark day has not changed since the last run
+            weather_data, dates = weather_data[~on_watermark], dates[~on_watermark]
+            unique_dates = unique_dates[unique_dates != pd.Timestamp(state["watermark"])]
 
-    if dim_date_path.exists():
-        dim_date = pd.read_csv(dim_date_path, parse_dates=["date"])
-    else:
-        dim_date = pd.DataFrame(columns=[
-            "date_id", "date", "year", "month", "day",
-            "day_of_week", "is_weekend", "season"
-        ])
+    # New dimension rows and upserted facts go to this run's deltas, not to the tables
+    delta_frames = {}
 
-    existing_dates = set(pd.to_datetime(dim_date["date"])) if not dim_date.empty else set()
-    new_dates = set(dates) - existing_dates
+    # -------- dimension: city_dim  -----------------------------------------
+    new_city = sorted(set(weather_data["city"].dropna().unique()) - state["city"].keys())
+    if new_city:
+        city_ids = storage.next_ids("city_id", len(new_city), LAYER, floor=max(state["city"].values(), default=0))
+        to_append = pd.DataFrame(
+            {"city_id": city_ids,
+             "city": new_city}
+        )
+        delta_frames["dim_city"] = to_append
+        state["city"].update(zip(new_city, to_append["city_id"].tolist()))
+    # ================= DIMENSION DATE =================
+    new_dates = sorted(set(unique_dates.strftime("%Y-%m-%d")) - state["date"].keys())
 
     if new_dates:                                        # ← pas .empty
-        to_append = pd.DataFrame({"date": pd.to_datetime(sorted(new_dates))})
+        to_append = pd.DataFrame({"date": pd.to_datetime(new_dates)})
         to_append = to_append.assign(
             year        = to_append["date"].dt.year,
             month       = to_append["date"].dt.month,
@@ -63,54 +279,82 @@ def transform_to_star_schema() -> str:
             season      = ((to_append["date"].dt.month % 12 + 3) // 3)
         ).reset_index(drop=True)
 
-        start_id = int(dim_date["date_id"].max()) + 1 if not dim_date.empty else 1
-        to_append.insert(0, "date_id", range(start_id, start_id + len(to_append)))
+        date_ids = storage.next_ids("date_id", len(to_append), LAYER, floor=max(state["date"].values(), default=0))
+        to_append.insert(0, "date_id", date_ids)
+
+        delta_frames["dim_date"] = to_append
+        state["date"].update(zip(new_dates, to_append["date_id"].tolist()))
 
-        dim_date = pd.concat([dim_date, to_append], ignore_index=True)
-        dim_date.to_csv(dim_date_path, index=False)
-    # ================= DIMENSION METEO =================
-    dim_meteo_path = output_dir / "dim_meteo.csv"
-    
-    if dim_meteo_path.exists():
-        dim_meteo = pd.read_csv(dim_meteo_path)
-    else:
-        # Mapping initial des codes météo (à adapter selon vos besoins)
-        dim_meteo = pd.DataFrame({
-            "meteo_id": [1, 2, 3, 4, 5],
-            "code_meteo": [51, 80, 800, 801, 802],
-            "description": ["bruine", "pluie légère", "ciel dégagé", "peu nuageux", "partiellement nuageux"],
-            "severity": [1, 2, 0, 0, 1]
-        })
-        dim_meteo.to_csv(dim_meteo_path, index=False)
-    
     # ================= TABLE DE FAITS =================
-    fact_weather_path = output_dir / "fact_weather.csv"
-    # Normalisation type
-    weather_data["meteo"]      = weather_data["meteo"].astype(str)
-    dim_meteo["code_meteo"]    = dim_meteo["code_meteo"].astype(str)
-    
-    # Jointure avec les dimensions
-    fact_data = (
-        weather_data
-        .merge(city_dim[["city_id", "city"]], on="city", how="left")
-        .merge(
-            dim_date[["date_id", "date"]], 
-            left_on=weather_data["extraction_date"].dt.normalize(), 
-            right_on="date", 
-            how="left"
+    # Daily runs stay in this process: a day of rows does not pay for the pool
+    aggregates = None
+    if full_rebuild and workers > 1 and weather_data["city"].nunique() > 1:
+        fact_data, aggregates = _parallel_facts(weather_data, dates, state, workers)
+    else:
+        fact_data = _facts(weather_data, dates, state).reset_index(drop=True)
+
+    # Upsert on (city_id, date_id): only the watermark day and the changed days
+    # can already be in the table
+    watermark_id = state["date"].get(state["watermark"]) if state["watermark"] else None
+    is_update = (fact_data["date_id"] == watermark_id) & fact_data["city_id"].isin(state["watermark_keys"])
+    changed_ids = [state["date"][day] for day in changed if day < state["watermark"] and day in state["date"]]
+    if changed_ids:
+        existing = deltas.read("fact_weather", filters=[("date_id", "in", changed_ids)])
+        is_update |= pd.MultiIndex.from_frame(fact_data[FACT_KEY].astype("float64")).isin(
+            pd.MultiIndex.from_frame(existing[FACT_KEY].astype("float64"))
         )
-        .merge(dim_meteo[["meteo_id", "code_meteo"]], left_on="meteo", right_on="code_meteo", how="left")
-        .drop(columns=["city", "extraction_date", "date", "code_meteo", "meteo"])
-        .rename(columns={"meteo_id": "weather_condition_id"})
-    )
-    
-    # Sauvegarde
-    fact_data.to_csv(fact_weather_path, index=False)
-    
+    updated, inserted = int(is_update.sum()), int((~is_update).sum())
+
+    fact_weather_path = storage.table_path("fact_weather", LAYER)
+    if full_rebuild:
+        fact_weather_path = storage.write_table(
+            fact_data, "fact_weather", LAYER, partition_cols=FACT_PARTITION_COLS
+        )
+        state["fact_rows"] = len(fact_data)
+    else:
+        # Updated rows replace the older ones when the deltas are read or folded
+        delta_frames["fact_weather"] = fact_data
+        state["fact_rows"] += inserted
+    if ds is None and not unique_dates.empty:
+        ds = new_watermark.strftime("%Y-%m-%d")
+    delta_paths = deltas.write(delta_frames, ds or pd.Timestamp.now().strftime("%Y-%m-%d"))
+    state["deltas_written"] = deltas.written()
+    fact_weather_path = delta_paths.get("fact_weather", fact_weather_path)
+
+    # ================= ROLLUPS =================
+    # Only the new facts are aggregated into the monthly / seasonal tables
+    # (already aggregated by the workers of a parallel rebuild)
+    if aggregates is not None:
+        rollup_sizes = rollups.rebuild(aggregates)
+    else:
+        rollup_sizes = rollups.update_rollups(
+            fact_data[~is_update], state["date"], full=full_rebuild,
+            replaced_date_ids=fact_data.loc[is_update, "date_id"].unique().tolist(),
+        )
+
+    if not unique_dates.empty:
+        new_watermark = new_watermark.strftime("%Y-%m-%d")
+        keys = fact_data.loc[fact_data["date_id"] == state["date"][new_watermark], "city_id"]
+        if new_watermark == state["watermark"]:
+            keys = pd.concat([keys, pd.Series(state["watermark_keys"])])
+        state["watermark"] = new_watermark
+        state["watermark_rows"] = watermark_rows
+        state["watermark_keys"] = sorted(int(k) for k in keys.dropna().unique())
+    _save_state(state)
+
+    # The snapshots are rewritten every COMPACT_EVERY runs, or now if fact_weather was
+    if full_rebuild:
+        deltas.compact(rebuilt=("fact_weather",), locked=True)
+    elif len(deltas.load_manifest()["runs"]) >= deltas.COMPACT_EVERY:
+        deltas.compact(locked=True)
+
+    metrics.record(rows_in=len(weather_data), rows_out=len(fact_data))
     print(f"Star schema generated in {output_dir}")
-    print(f"- Dimension City: {len(city_dim)} entries")
-    print(f"- Dimension Date: {len(dim_date)} entries")
-    print(f"- Dimension Meteo: {len(dim_meteo)} entries")
-    print(f"- Fact Table: {len(fact_data)} weather records")
-    
-    return str(fact_weather_path)
\ No newline at end of file
+    print(f"- Dimension City: {len(state['city'])} entries")
+    print(f"- Dimension Date: {len(state['date'])} entries")
+    print(f"- Dimension Meteo: {len(state['meteo'])} entries")
+    print(f"- Fact Table: {state['fact_rows']} weather records ({inserted} inserted, {updated} updated)")
+    for name, size in rollup_sizes.items():
+        print(f"- Rollup {name}: {size} rows rewritten")
+
+    return str(fact_weather_path)
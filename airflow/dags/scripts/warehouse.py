@@ -0,0 +1,173 @@
+import os
+import sqlite3
+from pathlib import Path
+import pandas as pd
+from scripts import deltas
+from scripts import metrics
+from scripts import storage
+from scripts.transform import LAYER, load_state
+
+# Optional sink: the star schema copied into a local sqlite file, with keys and
+# indexes, so aggregates run in SQL instead of re-parsing fact_weather.csv.
+# Outside of data/ so the Drive sync does not re-send the whole file every day.
+WAREHOUSE_ENABLED = os.getenv("WEATHER_WAREHOUSE", "false").lower() in ("1", "true", "yes")
+WAREHOUSE_PATH = Path(os.getenv("WEATHER_WAREHOUSE_PATH", storage.BASE_DIR / "warehouse" / "weather.sqlite"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dim_city (
+    city_id     INTEGER PRIMARY KEY,
+    city        TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS dim_date (
+    date_id     INTEGER PRIMARY KEY,
+    date        TEXT NOT NULL UNIQUE,
+    year        INTEGER NOT NULL,
+    month       INTEGER NOT NULL,
+    day         INTEGER NOT NULL,
+    day_of_week INTEGER NOT NULL,
+    is_weekend  INTEGER NOT NULL,
+    season      INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS dim_date_year_month ON dim_date (year, month);
+CREATE TABLE IF NOT EXISTS dim_meteo (
+    meteo_id    INTEGER PRIMARY KEY,
+    code_meteo  TEXT,
+    description TEXT,
+    severity    INTEGER
+);
+CREATE TABLE IF NOT EXISTS fact_weather (
+    city_id              INTEGER NOT NULL REFERENCES dim_city (city_id),
+    date_id              INTEGER NOT NULL REFERENCES dim_date (date_id),
+    temperature          REAL,
+    humidite             REAL,
+    pluie_mm             REAL,
+    temp_min             REAL,
+    temp_max             REAL,
+    pression             REAL,
+    vent                 REAL,
+    nuages               REAL,
+    code_meteo           INTEGER,
+    weather_condition_id INTEGER REFERENCES dim_meteo (meteo_id),
+    PRIMARY KEY (city_id, date_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS fact_weather_date ON fact_weather (date_id, city_id);
+CREATE TABLE IF NOT EXISTS load_state (
+    key         TEXT PRIMARY KEY,
+    value       TEXT
+);
+"""
+
+TABLE_COLUMNS = {
+    "dim_city":     ["city_id", "city"],
+    "dim_date":     ["date_id", "date", "year", "month", "day", "day_of_week", "is_weekend", "season"],
+    "dim_meteo":    ["meteo_id", "code_meteo", "description", "severity"],
+    "fact_weather": [
+        "city_id", "date_id", "temperature", "humidite", "pluie_mm", "temp_min", "temp_max",
+        "pression", "vent", "nuages", "code_meteo", "weather_condition_id",
+    ],
+}
+# Columns added after the first files were created: ALTER TABLE, then a full reload
+ADDED_COLUMNS = {"fact_weather": {"pression": "REAL", "vent": "REAL", "nuages": "REAL", "code_meteo": "INTEGER"}}
+
+
+def connect(path: Path = WAREHOUSE_PATH, read_only: bool = False) -> sqlite3.Connection:
+    if read_only:
+        return sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=60)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    for table, columns in ADDED_COLUMNS.items():
+        present = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        missing = {col: sql_type for col, sql_type in columns.items() if col not in present}
+        with conn:
+            for col, sql_type in missing.items():
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {col} {sql_type}")
+            if missing:
+                # The rows already loaded have them null
+                conn.execute("DELETE FROM load_state WHERE key = 'rebuilds'")
+    return conn
+
+
+def query(sql: str, params: tuple = (), path: Path = WAREHOUSE_PATH) -> pd.DataFrame:
+    conn = connect(path, read_only=True)
+    try:
+        return pd.read_sql_query(sql, conn, params=params)
+    finally:
+        conn.close()
+
+
+def _rows(df: pd.DataFrame, table: str):
+    dropped = [col for col in df.columns if col not in TABLE_COLUMNS[table]]
+    if dropped:
+        print(f"Warning: {table} columns not in the warehouse schema, not loaded: {dropped}")
+    df = storage.widen(df.reindex(columns=TABLE_COLUMNS[table]))
+    if "date" in df.columns:
+        df["date"] = pd.to_datetime(df["date"]).dt.strftime("%Y-%m-%d")
+    for col in df.select_dtypes("bool").columns:
+        df[col] = df[col].astype(int)
+    # NaN -> NULL, numpy scalars -> Python values sqlite3 can bind
+    return df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+
+
+def _bulk_upsert(conn: sqlite3.Connection, table: str, df: pd.DataFrame) -> None:
+    columns = TABLE_COLUMNS[table]
+    conn.executemany(
+        f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+        _rows(df, table),
+    )
+
+
+def _get(conn: sqlite3.Connection, key: str) -> str | None:
+    row = conn.execute("SELECT value FROM load_state WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+@metrics.instrumented("warehouse")
+def load_to_warehouse(incremental: bool = True, path: Path = WAREHOUSE_PATH) -> str | None:
+    if not WAREHOUSE_ENABLED and path == WAREHOUSE_PATH:
+        print("WEATHER_WAREHOUSE is not enabled, skipped")
+        return None
+
+    conn = connect(path)
+    try:
+        # The star schema stays still while it is copied (the transform holds it exclusively)
+        with storage.lock(LAYER, shared=True):
+            state = load_state()
+            if state is None or not deltas.exists("fact_weather"):
+                print("No star schema to load yet")
+                return None
+
+            rebuilds = str(state.get("rebuilds", 0))
+            watermark = _get(conn, "watermark")
+            full = not incremental or watermark is None or _get(conn, "rebuilds") != rebuilds
+
+            dims = {table: deltas.read(table) for table in ("dim_city", "dim_date", "dim_meteo")}
+            if full:
+                facts = deltas.read("fact_weather")
+            else:
+                # Same watermark as the transform: only the days from the last load on,
+                # and the older days it has re-derived since (merge reruns, backdated rows)
+                loaded_updates = int(_get(conn, "updates") or 0)
+                changed = [day for day, update in state.get("changed_dates", {}).items() if update > loaded_updates]
+                dates = pd.to_datetime(dims["dim_date"]["date"])
+                days = (dates >= pd.Timestamp(watermark)) | dates.dt.strftime("%Y-%m-%d").isin(changed)
+                date_ids = dims["dim_date"].loc[days, "date_id"].astype(int).tolist()
+                facts = deltas.read("fact_weather", filters=[("date_id", "in", date_ids)])
+
+        with conn:
+            # One transaction per run, bulk executemany per table
+            if full:
+                conn.execute("DELETE FROM fact_weather")
+            for table, df in dims.items():
+                _bulk_upsert(conn, table, df)
+            _bulk_upsert(conn, "fact_weather", facts)
+            conn.executemany(
+                "INSERT OR REPLACE INTO load_state VALUES (?, ?)",
+                [("watermark", state["watermark"]), ("rebuilds", rebuilds), ("updates", str(state.get("updates", 0)))],
+            )
+        metrics.record(rows_in=len(facts), rows_out=len(facts))
+        print(f"Warehouse {path}: {len(facts)} fact rows {'reloaded' if full else 'upserted'}")
+    finally:
+        conn.close()
+    return str(path)
@@ -1,10 +1,8 @@
 from airflow import DAG
 from airflow.operators.python import PythonOperator # type: ignore
 from datetime import datetime
-from scripts.extract import extract_forecast_data
-from scripts.merge import merge_data
-from scripts.transform import transform_to_star_schema
-from scripts.load import main
+# Only names here: pandas, pyarrow and googleapiclient are imported by the tasks, not at parse time
+from scripts.lazy import task
 
 default_args = {
     'owner': 'airflow',
@@ -12,26 +10,10 @@ default_args = {
     'start_date': datetime(2025, 6, 1)
 }
 
-CITIES = [
-    "Antananarivo",  
-    "London",        
-    "Paris",         
-    "Tokyo",         
-    "Sydney",        
-    "Reykjavik",     
-    "Moscow",        
-    "Cairo",         
-    "Cape Town",     
-    "Nairobi",       
-    "Mumbai",         
-    "Singapore",     
-    "Dubai",         
-    "New York",       
-    "Mexico City",   
-    "São Paulo",     
-    "Buenos Aires",  
-    "Auckland"
-]
+# Extract tasks running at the same time across all the runs of the DAG, they
+# share the OpenWeatherMap quota
+EXTRACT_SLOTS = 4
+CHUNK_SIZE = 200
 
 with DAG(
     'weather_forecast_etl_pipeline',
@@ -41,30 +23,47 @@ with DAG(
     max_active_runs=2
 ) as dag:
     
-    extract_task = [
-        PythonOperator(
-            task_id=f'{city.lower().replace(" ", "_")}',
-            python_callable=extract_forecast_data,
-            op_args=[city, "{{var.value.API_KEY}}", "{{ds}}"],
-        )
-        for city in CITIES
-    ]
+    # The city registry is only read at run time, DAG parsing does not depend on its size
+    plan_task = PythonOperator(
+        task_id='plan_city_chunks',
+        python_callable=task("scripts.extract:plan_city_chunks"),
+        op_args=[CHUNK_SIZE],
+    )
+
+    extract_task = PythonOperator.partial(
+        task_id='extract_city_chunk',
+        python_callable=task("scripts.extract:extract_city_chunk"),
+        op_kwargs={
+            "api_key": "{{var.value.API_KEY}}",
+            "date": "{{ds}}",
+            "chunk_size": CHUNK_SIZE,
+            "slots": EXTRACT_SLOTS,
+        },
+        max_active_tis_per_dag=EXTRACT_SLOTS,
+    ).expand(op_args=plan_task.output)
     
     merge_task = PythonOperator(
         task_id='merge_files',
-        python_callable=merge_data,
+        python_callable=task("scripts.merge:merge_data"),
         op_args=["{{ds}}"]
     )
     
     transform_task = PythonOperator(
         task_id="transform_to_star_schema",
-        python_callable=transform_to_star_schema,
+        python_callable=task("scripts.transform:transform_to_star_schema"),
+        op_kwargs={"ds": "{{ds}}"},
+    )
+    
+    # No-op unless WEATHER_WAREHOUSE is enabled
+    warehouse_task = PythonOperator(
+        task_id="load_to_warehouse",
+        python_callable=task("scripts.warehouse:load_to_warehouse"),
     )
     
     load_task = PythonOperator(
         task_id='load_to_drive',
-        python_callable=main,
+        python_callable=task("scripts.load:main"),
         op_args=["{{ var.value.GOOGLE_SERVICE_ACCOUNT_JSON }}", "{{ var.value.DRIVE_FOLDER_ID }}"],
     )
     
-    extract_task >> merge_task >> transform_task >> load_task  # type: ignore
\ No newline at end of file
+    plan_task >> extract_task >> merge_task >> transform_task >> [warehouse_task, load_task]  # type: ignore
\ No newline at end of file
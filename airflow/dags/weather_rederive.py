@@ -0,0 +1,33 @@
+from airflow import DAG
+from airflow.operators.python import PythonOperator # type: ignore
+from datetime import datetime
+from scripts.lazy import task
+
+default_args = {
+    'owner': 'airflow',
+    'depends_on_past': False,
+    'start_date': datetime(2025, 6, 1)
+}
+
+# Manual runs only: rebuilds meteo_global and the star schema from the archived
+# API responses, e.g. after a new column was added to scripts/payloads.py
+with DAG(
+    'weather_rederive',
+    default_args=default_args,
+    schedule=None,
+    catchup=False,
+    max_active_runs=1,
+) as dag:
+
+    rederive_task = PythonOperator(
+        task_id='rederive_from_archive',
+        python_callable=task("scripts.rederive:rederive"),
+    )
+
+    # The warehouse sees the star schema rebuild and reloads it in full
+    warehouse_task = PythonOperator(
+        task_id='load_to_warehouse',
+        python_callable=task("scripts.warehouse:load_to_warehouse"),
+    )
+
+    rederive_task >> warehouse_task  # type: ignore
@@ -0,0 +1,105 @@
+"""Rows/sec of cleaning.clean_df against the former merge._clean_df on a synthetic history.
+
+    python benchmarks/bench_clean.py --rows 10000000 --text-rows 1000000
+
+"typed" frames are what read_parquet / read_table return, "text" frames are
+every column as strings, like a CSV exported from Sheets.
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+DAGS_DIR = Path(__file__).resolve().parent.parent / "airflow" / "dags"
+CODES = np.array([0, 1, 2, 3, 51, 53, 61, 63, 80, 95])
+
+
+def synthetic_history(rows: int, seed: int = 0) -> pd.DataFrame:
+    # Ten years of daily rows per city, as many cities as the size needs
+    rng = np.random.default_rng(seed)
+    days = pd.date_range("2015-01-01", periods=min(rows, 3653), freq="D", tz="UTC")
+    cities = [f"City {i}" for i in range(-(-rows // len(days)))]
+    temperature = rng.normal(15, 8, rows).astype("float32")
+    return pd.DataFrame({
+        "city": np.repeat(cities, len(days))[:rows],
+        "extraction_date": np.tile(days, len(cities))[:rows],
+        "temperature": temperature,
+        "humidite": rng.uniform(20, 100, rows).astype("float32"),
+        "pluie_mm": rng.exponential(2, rows).astype("float32"),
+        "meteo": rng.choice(CODES, rows).astype("float32"),
+        "temp_min": temperature - rng.uniform(0, 5, rows).astype("float32"),
+        "temp_max": temperature + rng.uniform(0, 5, rows).astype("float32"),
+    })
+
+
+def as_text(df: pd.DataFrame) -> pd.DataFrame:
+    return df.astype(str)
+
+
+def legacy_clean_df(df: pd.DataFrame) -> pd.DataFrame:
+    # merge._clean_df before the cleaning module, kept verbatim as the baseline
+    df.columns = df.columns.str.strip().str.lower().str.replace(" ", "_")
+    if "meteo" in df.columns:
+        df["meteo"] = df["meteo"].astype(str).str.lower().str.strip().str.replace(" ", "_")
+    patterns = ["temperature", "humidite", "pluie_mm", "meteo", "temp_min", "temp_max"]
+    numeric_cols = [
+        col for col in df.columns
+        if any(pattern in col.lower() for pattern in patterns) and df[col].dtype == object
+    ]
+    if "extraction_date" in df.columns:
+        df["extraction_date"] = pd.to_datetime(df["extraction_date"], errors="coerce", dayfirst=True, format="mixed")
+        na_mask = df["extraction_date"].isna()
+        if na_mask.any():
+            df.loc[na_mask, "extraction_date"] = pd.to_datetime(
+                df.loc[na_mask, "extraction_date"], errors="coerce", format="ISO8601"
+            )
+        df["extraction_date"] = df["extraction_date"].dt.tz_localize(None).dt.normalize()
+    for col in numeric_cols:
+        df[col] = df[col].astype(str).str.replace(r"[^\d.-]", "", regex=True)
+        df[col] = df[col].str.replace(".", ",", regex=False)
+        df[col] = pd.to_numeric(df[col], errors="coerce")
+        if pd.api.types.is_float_dtype(df[col]):
+            df[col] = df[col].round(2)
+    return df
+
+
+def timed(clean, df: pd.DataFrame) -> dict:
+    start = time.perf_counter()
+    out = clean(df.copy())
+    seconds = time.perf_counter() - start
+    out = out[0] if isinstance(out, tuple) else out
+    return {
+        "seconds": round(seconds, 3),
+        "rows_per_sec": int(len(df) / seconds),
+        "null_temperature": int(out["temperature"].isna().sum()),
+    }
+
+
+def run(rows: int, text_rows: int, legacy: bool = True) -> dict:
+    sys.path.insert(0, str(DAGS_DIR))
+    from scripts.cleaning import clean_df
+
+    results = {}
+    for name, n, prepare in (("typed", rows, None), ("text", text_rows, as_text)):
+        if not n:
+            continue
+        df = synthetic_history(n)
+        if prepare is not None:
+            df = prepare(df)
+        results[name] = {"rows": n, "clean_df": timed(clean_df, df)}
+        if legacy:
+            results[name]["legacy_clean_df"] = timed(legacy_clean_df, df)
+        del df
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--text-rows", type=int, default=1_000_000)
+    parser.add_argument("--no-legacy", action="store_true", help="skip the former _clean_df")
+    args = parser.parse_args()
+    print(json.dumps(run(args.rows, args.text_rows, not args.no_legacy), indent=2))
@@ -0,0 +1,95 @@
+"""Parse time of the DAG files, and the heavy modules parsing loads.
+
+    python benchmarks/bench_dag_parse.py
+    python benchmarks/bench_dag_parse.py --check --max-seconds 0.5   # CI
+
+The scheduler re-parses every DAG file on each loop, so a DAG file only
+builds operators: pandas, pyarrow, requests or the Google client are
+imported by the tasks (scripts/lazy.py), never at parse time.
+
+Each file is parsed `--runs` times, each run in a fresh interpreter where
+airflow is already imported: the time is the DAG file alone. --check exits
+non-zero if a heavy module is loaded or the median goes over --max-seconds.
+Needs the airflow package, nothing else.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+DAGS_DIR = BENCH_DIR.parent / "airflow" / "dags"
+DAG_FILES = ("weather_etl.py", "historical_backfill.py", "weather_rederive.py")
+HEAVY_MODULES = (
+    "pandas", "numpy", "pyarrow", "requests", "googleapiclient", "google.oauth2",
+    "openmeteo_requests", "requests_cache", "sqlalchemy",
+)
+
+# Run in the child: airflow first, then the DAG file alone is timed
+PARSE = """
+import json, runpy, sys, time
+import airflow
+from airflow.operators.python import PythonOperator  # noqa: F401
+before = set(sys.modules)
+start = time.perf_counter()
+runpy.run_path(sys.argv[1], run_name="bench_dag")
+seconds = time.perf_counter() - start
+heavy = sorted(m for m in json.loads(sys.argv[2]) if m in sys.modules and m not in before)
+print(json.dumps({"seconds": seconds, "heavy": heavy, "modules": len(set(sys.modules) - before)}))
+"""
+
+
+def parse_once(dag_file: Path) -> dict:
+    out = subprocess.run(
+        [sys.executable, "-c", PARSE, str(dag_file), json.dumps(HEAVY_MODULES)],
+        cwd=DAGS_DIR, capture_output=True, text=True,
+    )
+    if out.returncode:
+        raise RuntimeError(f"{dag_file.name} failed to parse:\n{out.stderr}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def bench(runs: int) -> dict:
+    results = {}
+    for name in DAG_FILES:
+        samples = [parse_once(DAGS_DIR / name) for _ in range(runs)]
+        results[name] = {
+            "median_s": round(statistics.median(s["seconds"] for s in samples), 4),
+            "modules": samples[0]["modules"],
+            "heavy": samples[0]["heavy"],
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--check", action="store_true", help="exit 1 on a heavy import or a slow parse")
+    parser.add_argument("--max-seconds", type=float, default=0.5, help="median parse time allowed by --check")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    results = bench(args.runs)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'dag file':<24} {'median':>9} {'modules':>8}  heavy imports")
+        for name, r in results.items():
+            print(f"{name:<24} {r['median_s']:>8.4f}s {r['modules']:>8}  {', '.join(r['heavy']) or '-'}")
+
+    if args.check:
+        failures = [
+            f"{name}: imports {', '.join(r['heavy'])}" for name, r in results.items() if r["heavy"]
+        ] + [
+            f"{name}: {r['median_s']}s > {args.max_seconds}s" for name, r in results.items()
+            if r["median_s"] > args.max_seconds
+        ]
+        for failure in failures:
+            print(f"FAIL {failure}", file=sys.stderr)
+        sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
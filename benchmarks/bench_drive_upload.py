@@ -0,0 +1,98 @@
+"""Drive requests per synced MB, per upload strategy, on the in-memory fake Drive.
+
+    python benchmarks/bench_drive_upload.py
+    python benchmarks/bench_drive_upload.py --days 365 --large-mb 80 250 --chunk-mb 8 32 100
+
+The synced tree has the shape of $AIRFLOW_HOME/data: one folder per day of
+small raw files, plus a few large tables (meteo_global, fact_weather). Two
+syncs are measured: the first one, then a daily one (one more day of raw files,
+the large tables rewritten). Strategies:
+
+  resumable   every file as a resumable upload with the googleapiclient default
+              chunk (100 MB): the upload path before the size-aware one
+  size-aware  scripts/load.py as configured: multipart under
+              SIMPLE_UPLOAD_MAX_BYTES, resumable in UPLOAD_CHUNK_BYTES chunks
+  chunk-<N>   size-aware with N MB chunks, one strategy per --chunk-mb value
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+DAGS_DIR = BENCH_DIR.parent / "airflow" / "dags"
+
+
+def write_tree(base: Path, days: int, files_per_day: int, small_kb: int, large_mb: list[int], first_day: int = 0):
+    for day in range(first_day, first_day + days):
+        partition = base / "raw" / f"2025-{1 + day // 28 % 12:02d}-{1 + day % 28:02d}-{day // 336}"
+        partition.mkdir(parents=True, exist_ok=True)
+        for i in range(files_per_day):
+            (partition / f"meteo_chunk_{i:05d}.jsonl.gz").write_bytes(os.urandom(small_kb * 1024))
+    processed = base / "processed"
+    processed.mkdir(parents=True, exist_ok=True)
+    for i, mb in enumerate(large_mb):
+        (processed / f"table_{i}.parquet").write_bytes(os.urandom(mb * 2**20))
+
+
+def run(strategy: str, simple_max: int, chunk: int, args) -> dict:
+    from fake_drive import FakeDrive
+    from scripts import load
+
+    load.SIMPLE_UPLOAD_MAX_BYTES, load.UPLOAD_CHUNK_BYTES = simple_max, chunk
+    home = Path(tempfile.mkdtemp(prefix="bench-drive-"))
+    try:
+        data_dir = home / "data"
+        write_tree(data_dir, args.days, args.files_per_day, args.small_kb, args.large_mb)
+        drive = FakeDrive()
+        state = load.SyncState(data_dir, drive.root_id, path=home / "sync.sqlite")
+        result = {}
+        try:
+            for name in ("first", "daily"):
+                if name == "daily":
+                    write_tree(data_dir, 1, args.files_per_day, args.small_kb, args.large_mb, first_day=args.days)
+                trips, uploaded = drive.round_trips, drive.uploaded_bytes
+                load.sync_directory(drive, data_dir, drive.root_id, "update", state=state)
+                trips, mb = drive.round_trips - trips, (drive.uploaded_bytes - uploaded) / 2**20
+                result[name] = {"requests": trips, "uploaded_mb": round(mb, 1), "requests_per_mb": round(trips / mb, 2)}
+        finally:
+            state.close()
+        return result
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--files-per-day", type=int, default=4)
+    parser.add_argument("--small-kb", type=int, default=16)
+    parser.add_argument("--large-mb", type=int, nargs="+", default=[60, 150])
+    parser.add_argument("--chunk-mb", type=int, nargs="*", default=[])
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(DAGS_DIR))
+    sys.path.insert(0, str(BENCH_DIR))
+    os.environ.setdefault("AIRFLOW_HOME", tempfile.mkdtemp(prefix="bench-drive-home-"))
+    from googleapiclient.http import DEFAULT_CHUNK_SIZE
+    from scripts import load
+
+    strategies = {
+        "resumable": (-1, DEFAULT_CHUNK_SIZE),
+        "size-aware": (load.SIMPLE_UPLOAD_MAX_BYTES, load.UPLOAD_CHUNK_BYTES),
+        **{f"chunk-{mb}": (load.SIMPLE_UPLOAD_MAX_BYTES, mb * 2**20) for mb in args.chunk_mb},
+    }
+    results = {}
+    for strategy, (simple_max, chunk) in strategies.items():
+        results[strategy] = run(strategy, simple_max, chunk, args)
+
+    print(f"\n{'strategy':<12} {'sync':<6} {'requests':>9} {'MB':>8} {'req/MB':>7}")
+    for strategy, result in results.items():
+        for name, r in result.items():
+            print(f"{strategy:<12} {name:<6} {r['requests']:>9} {r['uploaded_mb']:>8} {r['requests_per_mb']:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Per-city extraction vs batched extract_all_cities against a local OpenWeatherMap stub.
+
+    python benchmarks/bench_extract.py --cities 18 --latency 0.05
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+DAGS_DIR = Path(__file__).resolve().parent.parent / "airflow" / "dags"
+
+
+class WeatherStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"       # keep-alive, like api.openweathermap.org
+    latency = 0.0
+    connections = 0
+    requests = 0
+
+    def setup(self):
+        super().setup()
+        type(self).connections += 1
+
+    def do_GET(self):
+        type(self).requests += 1
+        time.sleep(self.latency)
+        body = json.dumps({
+            "main": {"temp": 21.3, "humidity": 64, "temp_min": 19.8, "temp_max": 23.1},
+            "weather": [{"id": 801, "main": "Clouds"}],
+            "rain": {"1h": 0.2},
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub(latency: float) -> tuple[ThreadingHTTPServer, str]:
+    WeatherStubHandler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), WeatherStubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/data/2.5/weather"
+
+
+def run(cities: int, latency: float, workers: int) -> dict:
+    os.environ["AIRFLOW_HOME"] = tempfile.mkdtemp(prefix="bench_extract_")
+    sys.path.insert(0, str(DAGS_DIR))
+    from scripts.extract import extract_all_cities, extract_forecast_data
+
+    server, url = start_stub(latency)
+    names = [f"City {i}" for i in range(cities)]
+    results = {}
+
+    # One call per city, new connection each time (what the 18 PythonOperators do)
+    WeatherStubHandler.connections = WeatherStubHandler.requests = 0
+    start = time.perf_counter()
+    for city in names:
+        extract_forecast_data(city, "stub-key", "2025-07-01", url=url)
+    results["per_city"] = {
+        "seconds": round(time.perf_counter() - start, 3),
+        "connections": WeatherStubHandler.connections,
+        "requests": WeatherStubHandler.requests,
+    }
+
+    WeatherStubHandler.connections = WeatherStubHandler.requests = 0
+    start = time.perf_counter()
+    extract_all_cities(names, "stub-key", "2025-07-02", url=url, max_workers=workers, calls_per_minute=10**6)
+    results["batched"] = {
+        "seconds": round(time.perf_counter() - start, 3),
+        "connections": WeatherStubHandler.connections,
+        "requests": WeatherStubHandler.requests,
+    }
+
+    server.shutdown()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cities", type=int, default=18)
+    parser.add_argument("--latency", type=float, default=0.05, help="stub response time in seconds")
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+    print(json.dumps(run(args.cities, args.latency, args.workers), indent=2))
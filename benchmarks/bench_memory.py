@@ -0,0 +1,113 @@
+"""Memory of the compact dtypes (storage.COMPACT_TYPES) against inferred ones.
+
+    python benchmarks/bench_memory.py --scale 10 --format parquet
+
+On a synthetic history (same shape as bench_pipeline.py: 18 cities x scale,
+2021-01-01 -> 2025-07-16), reports:
+- bytes per row of meteo_global in memory, per column, read as before
+  (inferred types, Python strings) and with read_table(..., compact=True);
+- peak RSS of a full transform_to_star_schema, one fresh process per mode,
+  with WEATHER_COMPACT_DTYPES=false then true.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+DAGS_DIR = BENCH_DIR.parent / "airflow" / "dags"
+sys.path.insert(0, str(BENCH_DIR))
+from bench_pipeline import BASE_CITIES, HISTORY_DAYS, HISTORY_START, _load_historical_merge  # noqa: E402
+
+
+def _rss_mb() -> float:
+    # VmHWM starts over at exec, ru_maxrss keeps the parent's peak on Linux
+    try:
+        for line in Path("/proc/self/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def transform_worker() -> dict:
+    # Child process: imports first, so the RSS growth is the transform's
+    sys.path.insert(0, str(DAGS_DIR))
+    from scripts.transform import transform_to_star_schema
+    before = _rss_mb()
+    start = time.perf_counter()
+    transform_to_star_schema(incremental=False)
+    return {"wall_s": round(time.perf_counter() - start, 2), "rss_before_mb": before, "peak_rss_mb": _rss_mb()}
+
+
+def bytes_per_row() -> dict:
+    from scripts import storage
+    report = {}
+    for mode, compact in (("inferred", False), ("compact", True)):
+        df = storage.read_table("meteo_global", "processed", compact=compact)
+        usage = df.memory_usage(index=False, deep=True)
+        report[mode] = {
+            "rows": len(df),
+            "bytes_per_row": round(usage.sum() / len(df), 1),
+            "columns": {col: [str(df[col].dtype), round(size / len(df), 1)] for col, size in usage.items()},
+        }
+        del df
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=int, default=10)
+    parser.add_argument("--history-days", type=int, default=HISTORY_DAYS)
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(transform_worker()))
+        return
+
+    home = Path(tempfile.mkdtemp(prefix="bench-memory-"))
+    env = {**os.environ, "AIRFLOW_HOME": str(home), "WEATHER_STORAGE_FORMAT": args.format, "WEATHER_CSV_EXPORT": "false"}
+    os.environ.update(env)
+    sys.path.insert(0, str(DAGS_DIR))
+    try:
+        import synthetic
+        cities = synthetic.city_names(BASE_CITIES * args.scale)
+        print(f"Generating {len(cities)} cities x {args.history_days} days...", file=sys.stderr)
+        synthetic.write_historical(cities, HISTORY_START, args.history_days)
+        _load_historical_merge().merge_data()
+
+        rows = bytes_per_row()
+        rss = {}
+        for compact in ("false", "true"):
+            out = subprocess.run(
+                [sys.executable, __file__, "--worker"], env={**env, "WEATHER_COMPACT_DTYPES": compact},
+                capture_output=True, text=True, check=True,
+            )
+            rss["compact" if compact == "true" else "inferred"] = json.loads(out.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+    inferred, compact = rows["inferred"], rows["compact"]
+    print(f"\nmeteo_global in memory, {inferred['rows']} rows ({args.format})")
+    print(f"{'column':<16} {'inferred':>22} {'compact':>22}")
+    for col, (dtype, size) in inferred["columns"].items():
+        c_dtype, c_size = compact["columns"][col]
+        print(f"{col:<16} {dtype:>14} {size:>6.1f} B {c_dtype:>14} {c_size:>6.1f} B")
+    print(f"{'bytes/row':<16} {inferred['bytes_per_row']:>22} {compact['bytes_per_row']:>22}")
+
+    print("\nfull transform_to_star_schema")
+    for mode, r in rss.items():
+        print(f"{mode:<10} peak RSS {r['peak_rss_mb']:>8} MB (+{r['peak_rss_mb'] - r['rss_before_mb']:.1f} MB over imports), {r['wall_s']}s")
+
+
+if __name__ == "__main__":
+    main()
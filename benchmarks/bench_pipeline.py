@@ -0,0 +1,232 @@
+"""Every pipeline stage on synthetic data, with HTTP and Drive stubbed.
+
+    python benchmarks/bench_pipeline.py --scales 1 10 100
+    python benchmarks/bench_pipeline.py --compare benchmarks/results/<old>.json benchmarks/results/<new>.json
+
+1x is today's volume: the 18 cities of config/cities.csv over the
+2021-01-01 -> 2025-07-16 history (1658 days). A scale multiplies the cities.
+Each scale runs in its own process under a fresh AIRFLOW_HOME, so peak RSS
+and module-level settings do not leak from one scale to the next.
+Results go to benchmarks/results/<commit>-<format>.json.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+DAGS_DIR = REPO_DIR / "airflow" / "dags"
+RESULTS_DIR = BENCH_DIR / "results"
+
+BASE_CITIES = 18
+HISTORY_START = "2021-01-01"
+HISTORY_DAYS = 1658
+
+
+def _git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True)
+        dirty = subprocess.run(["git", "status", "--porcelain", "--", "airflow"], cwd=REPO_DIR, capture_output=True, text=True)
+        return out.stdout.strip() + ("-dirty" if dirty.stdout.strip() else "")
+    except OSError:
+        return "unknown"
+
+
+# ---------------- worker: one scale, one process ----------------
+
+def _last_metrics(stage: str) -> dict:
+    # Counters of the outermost instrumented call, from the metrics file of this home
+    from scripts import metrics
+    stages_file = metrics.METRICS_DIR / "stages.jsonl"
+    if not stages_file.exists():
+        return {}
+    records = [json.loads(line) for line in stages_file.read_text().splitlines()]
+    records = [r for r in records if r["stage"] == stage]
+    if not records:
+        return {}
+    keep = ("rows_in", "rows_out", "rows_read", "rows_written", "bytes_read", "bytes_written",
+            "http_calls", "cache_hits", "drive_requests", "bytes_uploaded", "files_in", "files_out")
+    return {k: v for k, v in records[-1].items() if k in keep}
+
+
+def _timed(results: dict, name: str, func, *args, metrics_stage: str | None = None, **kwargs):
+    wall, cpu = time.perf_counter(), time.process_time()
+    out = func(*args, **kwargs)
+    results[name] = {
+        "wall_s": round(time.perf_counter() - wall, 3),
+        "cpu_s": round(time.process_time() - cpu, 3),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        **(_last_metrics(metrics_stage) if metrics_stage else {}),
+    }
+    print(f"  {name}: {results[name]['wall_s']}s", file=sys.stderr)
+    return out
+
+
+def _load_historical_merge():
+    # historical-scripts is not a package (dash in the name)
+    spec = importlib.util.spec_from_file_location("historical_merge", DAGS_DIR / "historical-scripts" / "merge.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_scale(scale: int, history_days: int, daily_runs: int) -> dict:
+    sys.path.insert(0, str(DAGS_DIR))
+    sys.path.insert(0, str(BENCH_DIR))
+    import pandas as pd
+    import synthetic
+    from bench_extract import start_stub
+    from fake_drive import FakeDrive
+    from scripts import storage
+    from scripts.cleaning import clean_df
+    from scripts.extract import extract_all_cities
+    from scripts.load import SyncState, sync_directory
+    from scripts.merge import merge_data
+    from scripts.transform import transform_to_star_schema
+
+    cities = synthetic.city_names(BASE_CITIES * scale)
+    first_day = pd.Timestamp(HISTORY_START) + pd.Timedelta(days=history_days)
+    days = [(first_day + pd.Timedelta(days=i)).strftime("%Y-%m-%d") for i in range(daily_runs + 2)]
+    results = {"cities": len(cities), "history_days": history_days}
+
+    history_rows = _timed(results, "generate_history", synthetic.write_historical, cities, HISTORY_START, history_days)
+    results["history_rows"] = history_rows
+
+    historical_merge = _load_historical_merge()
+    _timed(results, "merge_historical", historical_merge.merge_data, metrics_stage="merge")
+
+    history = storage.read_table("meteo_global", "processed")
+    _timed(results, "clean_df", clean_df, history)
+    del history
+
+    _timed(results, "transform_full", transform_to_star_schema, incremental=False, metrics_stage="transform")
+
+    # The daily DAG: one raw partition, merged, then the incremental transform
+    daily = {}
+    for i, day in enumerate(days[:daily_runs]):
+        synthetic.write_daily(cities, day, seed=i)
+        _timed(daily, f"merge_daily_{i}", merge_data, day, metrics_stage="merge")
+        _timed(daily, f"transform_incremental_{i}", transform_to_star_schema, metrics_stage="transform")
+    for stage in ("merge_daily", "transform_incremental"):
+        runs = sorted(v["wall_s"] for k, v in daily.items() if k.startswith(stage))
+        results[stage] = {**daily[f"{stage}_0"], "wall_s": runs[len(runs) // 2], "runs": runs}
+    # Same ds again: every row is skipped
+    _timed(results, "merge_rerun", merge_data, days[daily_runs - 1], metrics_stage="merge")
+
+    server, url = start_stub(0.0)
+    try:
+        _timed(
+            results, "extract", extract_all_cities, cities, "stub-key", days[daily_runs],
+            url=url, calls_per_minute=10**9, batch_name="meteo_bench_extract", metrics_stage="extract",
+        )
+    finally:
+        server.shutdown()
+    # Not merged: the extract output is only there to be synced
+    data_dir = storage.BASE_DIR / "data"
+
+    drive = FakeDrive()
+    state = SyncState(data_dir, drive.root_id, path=storage.BASE_DIR / "sync" / "bench.sqlite")
+    try:
+        _timed(results, "sync_first", sync_directory, drive, data_dir, drive.root_id, "update", state=state, metrics_stage="sync")
+        results["sync_first"].update(round_trips=drive.round_trips, uploaded_mb=round(drive.uploaded_bytes / 2**20, 2))
+
+        synthetic.write_daily(cities, days[daily_runs + 1], seed=daily_runs + 1)
+        merge_data(days[daily_runs + 1])
+        transform_to_star_schema()
+        trips, uploaded = drive.round_trips, drive.uploaded_bytes
+        _timed(results, "sync_daily", sync_directory, drive, data_dir, drive.root_id, "update", state=state, metrics_stage="sync")
+        results["sync_daily"].update(
+            round_trips=drive.round_trips - trips,
+            uploaded_mb=round((drive.uploaded_bytes - uploaded) / 2**20, 2),
+        )
+    finally:
+        state.close()
+
+    results["data_mb"] = round(sum(f.stat().st_size for f in data_dir.rglob("*") if f.is_file()) / 2**20, 2)
+    return results
+
+
+# ---------------- driver ----------------
+
+def compare(old_file: Path, new_file: Path) -> None:
+    old, new = json.loads(old_file.read_text()), json.loads(new_file.read_text())
+    print(f"{old['commit']} -> {new['commit']} (wall seconds)")
+    for scale, stages in new["scales"].items():
+        before = old["scales"].get(scale, {})
+        for stage, result in stages.items():
+            if not isinstance(result, dict) or stage not in before:
+                continue
+            a, b = before[stage]["wall_s"], result["wall_s"]
+            ratio = f"{b / a:.2f}x" if a else "-"
+            print(f"{scale:>5} {stage:<24} {a:>10.3f} {b:>10.3f} {ratio:>8}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--history-days", type=int, default=HISTORY_DAYS)
+    parser.add_argument("--daily-runs", type=int, default=3)
+    parser.add_argument("--format", choices=("csv", "parquet"), default=os.getenv("WEATHER_STORAGE_FORMAT", "csv"))
+    parser.add_argument("--output", type=Path)
+    parser.add_argument("--keep", action="store_true", help="keep the temporary AIRFLOW_HOME of each scale")
+    parser.add_argument("--compare", type=Path, nargs=2, metavar=("OLD", "NEW"))
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    if args.worker:
+        print(json.dumps(run_scale(args.worker, args.history_days, args.daily_runs)))
+        return
+
+    report = {
+        "commit": _git_commit(),
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "format": args.format,
+        "python": platform.python_version(),
+        "machine": {"cpus": os.cpu_count(), "platform": platform.platform()},
+        "scales": {},
+    }
+    for scale in args.scales:
+        home = Path(tempfile.mkdtemp(prefix=f"bench_pipeline_{scale}x_"))
+        env = {**os.environ, "AIRFLOW_HOME": str(home), "WEATHER_STORAGE_FORMAT": args.format}
+        env.pop("WEATHER_METRICS_DIR", None)
+        env.pop("STATSD_HOST", None)
+        print(f"{scale}x in {home}", file=sys.stderr)
+        try:
+            # Task logs go to the worker's stdout: the result is its last line
+            out = subprocess.run(
+                [sys.executable, __file__, "--worker", str(scale),
+                 "--history-days", str(args.history_days), "--daily-runs", str(args.daily_runs)],
+                env=env, capture_output=True, text=True,
+            )
+            if out.returncode != 0:
+                sys.stderr.write(out.stderr)
+                raise SystemExit(f"{scale}x failed")
+            sys.stderr.write(out.stderr)
+            report["scales"][f"{scale}x"] = json.loads(out.stdout.strip().splitlines()[-1])
+        finally:
+            if not args.keep:
+                shutil.rmtree(home, ignore_errors=True)
+
+    output = args.output or RESULTS_DIR / f"{report['commit']}-{args.format}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(json.dumps(report, indent=2))
+    print(f"Results written to {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
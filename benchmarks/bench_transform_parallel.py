@@ -0,0 +1,110 @@
+"""Full transform_to_star_schema, single process against WEATHER_TRANSFORM_WORKERS.
+
+    python benchmarks/bench_transform_parallel.py --scale 10 --workers 1 2 4
+    python benchmarks/bench_transform_parallel.py --scale 50 --format parquet --runs 3
+
+On a synthetic history (same shape as bench_pipeline.py: 18 cities x scale,
+2021-01-01 -> 2025-07-16), times a full rebuild of the star schema per worker
+count, each run in a fresh process on a copy of the same meteo_global. 1 worker
+is the single-process path. The speedup is bounded by the cores the process
+may use, printed with the results: on a single core the pool only adds the
+cost of the spawned workers and of shipping the shards to them.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+DAGS_DIR = BENCH_DIR.parent / "airflow" / "dags"
+sys.path.insert(0, str(BENCH_DIR))
+from bench_pipeline import BASE_CITIES, HISTORY_DAYS, HISTORY_START, _load_historical_merge  # noqa: E402
+
+
+def _cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def transform_worker(workers: int) -> dict:
+    # Child process: imports first, the time is the transform's
+    sys.path.insert(0, str(DAGS_DIR))
+    from scripts import transform
+    start = time.perf_counter()
+    transform.transform_to_star_schema(incremental=False, workers=workers)
+    return {"wall_s": time.perf_counter() - start, "fact_rows": transform.load_state()["fact_rows"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=int, default=10)
+    parser.add_argument("--history-days", type=int, default=HISTORY_DAYS)
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(transform_worker(args.worker)))
+        return
+
+    home = Path(tempfile.mkdtemp(prefix="bench-transform-"))
+    env = {**os.environ, "AIRFLOW_HOME": str(home), "WEATHER_STORAGE_FORMAT": args.format, "WEATHER_CSV_EXPORT": "false"}
+    os.environ.update(env)
+    sys.path.insert(0, str(DAGS_DIR))
+    results = {}
+    try:
+        import synthetic
+        cities = synthetic.city_names(BASE_CITIES * args.scale)
+        print(f"Generating {len(cities)} cities x {args.history_days} days...", file=sys.stderr)
+        synthetic.write_historical(cities, HISTORY_START, args.history_days)
+        _load_historical_merge().merge_data()
+        processed = home / "data" / "processed"
+
+        for workers in [1, *(w for w in args.workers if w != 1)]:
+            samples = []
+            for _ in range(args.runs):
+                # Same input every run, no star schema left by the previous one
+                shutil.rmtree(home / "data" / "star_schema", ignore_errors=True)
+                out = subprocess.run(
+                    [sys.executable, __file__, "--worker", str(workers)], env=env,
+                    capture_output=True, text=True, check=True,
+                )
+                samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+            results[workers] = {
+                "wall_s": round(statistics.median(s["wall_s"] for s in samples), 2),
+                "fact_rows": samples[0]["fact_rows"],
+            }
+        history_mb = sum(f.stat().st_size for f in processed.rglob("*") if f.is_file()) / 2**20
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+    single = results[1]["wall_s"]
+    report = {
+        "cores": _cores(), "format": args.format, "cities": len(cities),
+        "history_mb": round(history_mb, 1), "workers": {
+            w: {**r, "speedup": round(single / r["wall_s"], 2)} for w, r in results.items()
+        },
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"\nfull transform, {report['cities']} cities, meteo_global {report['history_mb']} MB "
+          f"({args.format}), {report['cores']} core(s) available")
+    print(f"{'workers':>7} {'wall':>9} {'speedup':>8} {'fact rows':>10}")
+    for workers, r in report["workers"].items():
+        print(f"{workers:>7} {r['wall_s']:>8.2f}s {r['speedup']:>7.2f}x {r['fact_rows']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""In-memory stand-in for the Drive v3 `service` object used by scripts/load.py.
+
+Implements the subset of files().list/create/update and batch requests the
+sync engine calls, and counts every HTTP round trip a real service would make:
+a multipart upload is one request, a resumable one a session request plus one
+request per chunk (MediaFileUpload chunksize), as googleapiclient sends them.
+"""
+import hashlib
+import itertools
+import re
+import threading
+from collections import Counter
+
+FOLDER = "application/vnd.google-apps.folder"
+
+
+class _Status:
+    def __init__(self, sent, total):
+        self.resumable_progress = sent
+        self.total_size = total
+
+    def progress(self):
+        return self.resumable_progress / self.total_size if self.total_size else 1.0
+
+
+class _Request:
+    def __init__(self, drive, kind, run, media=None):
+        self.drive = drive
+        self.kind = kind
+        self._run = run
+        # Same attribute as googleapiclient.http.HttpRequest: the media when resumable
+        self.resumable = media if media is not None and media.resumable() else None
+        self._sent = None
+
+    def execute(self, num_retries=0):
+        if self.resumable:
+            response = None
+            while response is None:
+                _, response = self.next_chunk(num_retries=num_retries)
+            return response
+        self.drive.count(self.kind)
+        return self._run()
+
+    def next_chunk(self, num_retries=0):
+        # The first call opens the upload session, every call sends one chunk
+        size, chunk = self.resumable.size(), self.resumable.chunksize()
+        if self._sent is None:
+            self.drive.count(self.kind)
+            self._sent = 0
+        self.drive.count("upload_chunk")
+        self._sent = min(size, self._sent + chunk)
+        if self._sent < size:
+            return _Status(self._sent, size), None
+        return None, self._run()
+
+
+class _Batch:
+    def __init__(self, drive, callback):
+        self.drive = drive
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        self.drive.count("batch")
+        for request_id, request in self.requests:
+            try:
+                response, exception = request._run(), None
+            except Exception as e:
+                response, exception = None, e
+            self.drive.count(f"batched_{request.kind}")
+            self.callback(request_id, response, exception)
+
+
+def _media_bytes(media):
+    if media is None:
+        return b""
+    with open(media._filename, "rb") as f:
+        return f.read()
+
+
+class _Files:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def list(self, q, fields=None, pageSize=100, pageToken=None, **kwargs):
+        parent = re.search(r"'([^']+)' in parents", q).group(1)
+
+        def run():
+            children = [f for f in self.drive.store.values() if f["parent"] == parent]
+            start = int(pageToken or 0)
+            page = children[start:start + pageSize]
+            response = {"files": [self.drive.public(f) for f in page]}
+            if start + pageSize < len(children):
+                response["nextPageToken"] = str(start + pageSize)
+            return response
+        return _Request(self.drive, "list", run)
+
+    def create(self, body, media_body=None, fields=None, **kwargs):
+        def run():
+            file_id = self.drive.new_file(body["name"], body["parents"][0], body.get("mimeType"), _media_bytes(media_body))
+            self.drive.uploaded_bytes += self.drive.store[file_id]["size"]
+            return {"id": file_id}
+        return _Request(self.drive, "create", run, media_body)
+
+    def update(self, fileId, media_body=None, **kwargs):
+        def run():
+            content = _media_bytes(media_body)
+            self.drive.store[fileId].update(md5=hashlib.md5(content).hexdigest(), size=len(content))
+            self.drive.uploaded_bytes += len(content)
+            return {"id": fileId}
+        return _Request(self.drive, "update", run, media_body)
+
+
+class FakeDrive:
+    def __init__(self, root_id="root"):
+        self.root_id = root_id
+        self.store = {}
+        self.calls = Counter()
+        self.uploaded_bytes = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def count(self, kind):
+        with self._lock:
+            self.calls[kind] += 1
+
+    def new_file(self, name, parent, mime_type=None, content=b""):
+        with self._lock:
+            file_id = f"id{next(self._ids)}"
+        self.store[file_id] = {
+            "id": file_id, "name": name, "parent": parent,
+            "mimeType": mime_type or "text/csv",
+            "md5": hashlib.md5(content).hexdigest(), "size": len(content),
+        }
+        return file_id
+
+    def public(self, f):
+        out = {"id": f["id"], "name": f["name"], "mimeType": f["mimeType"]}
+        if f["mimeType"] != FOLDER:
+            out.update(md5Checksum=f["md5"], size=str(f["size"]))
+        return out
+
+    def files(self):
+        return _Files(self)
+
+    def new_batch_http_request(self, callback=None):
+        return _Batch(self, callback)
+
+    @property
+    def round_trips(self):
+        # A batch is one HTTP call, whatever it contains
+        return sum(n for kind, n in self.calls.items() if not kind.startswith("batched_"))
+
@@ -0,0 +1,88 @@
+"""Synthetic raw partitions in the shapes the two extract scripts land.
+
+daily_frame: one row per city for one day, like extract_all_cities
+(naive timestamp of the run, OpenWeatherMap-shaped responses as payload).
+historical_frame: cities x days, like historical-scripts/extract.py
+(UTC midnights, every Open-Meteo daily variable as payload).
+
+Both import scripts.payloads, and the write_* helpers go through
+scripts.storage: airflow/dags must be on sys.path, and AIRFLOW_HOME,
+WEATHER_STORAGE_FORMAT and WEATHER_RAW_FORMAT set before they are called.
+"""
+import numpy as np
+import pandas as pd
+
+CONDITIONS = np.array(["Clear", "Clouds", "Rain", "Drizzle", "Thunderstorm", "Mist"])
+CODES = np.array([0, 1, 2, 3, 51, 53, 61, 63, 80, 95], dtype="float32")
+
+
+def city_names(count: int) -> list[str]:
+    return [f"City {i:05d}" for i in range(count)]
+
+
+def daily_frame(cities: list[str], day: str, seed: int = 0) -> pd.DataFrame:
+    from scripts import payloads
+    rng = np.random.default_rng(seed)
+    cities = sorted(cities)
+    n = len(cities)
+    fetched_at = [pd.Timestamp(day) + pd.Timedelta(hours=6, microseconds=int(us)) for us in rng.integers(0, 10**6, n)]
+    temperature = rng.normal(18, 8, n).round(2)
+    responses = [
+        {
+            "weather": [{"id": 800 + int(code), "main": str(main)}],
+            "main": {"temp": t, "humidity": int(h), "pressure": int(p), "temp_min": round(t - 2, 2), "temp_max": round(t + 2, 2)},
+            "wind": {"speed": round(w, 2), "deg": int(d)},
+            "clouds": {"all": int(c)},
+            **({"rain": {"1h": round(r, 2)}} if r > 0.5 else {}),
+        }
+        for t, h, p, w, d, c, r, code, main in zip(
+            temperature, rng.integers(20, 100, n), rng.integers(990, 1030, n), rng.exponential(4, n),
+            rng.integers(0, 360, n), rng.integers(0, 100, n), rng.exponential(0.5, n),
+            rng.integers(0, 4, n), rng.choice(CONDITIONS, n),
+        )
+    ]
+    return payloads.from_responses(cities, fetched_at, responses, "meteo_all_cities")
+
+
+def historical_frame(cities: list[str], start: str, days: int, seed: int = 0) -> pd.DataFrame:
+    from scripts import payloads
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(start, periods=days, freq="D", tz="UTC")
+    rows = len(cities) * days
+    # Every archived daily variable, float32 like the SDK arrays
+    values = pd.DataFrame({
+        variable: rng.uniform(0, 30, rows).astype("float32")
+        for variable in payloads.OPEN_METEO_DAILY
+    })
+    temperature = rng.normal(15, 8, rows).astype("float32")
+    values["temperature_2m_mean"] = temperature
+    values["temperature_2m_min"] = temperature - rng.uniform(0, 5, rows).astype("float32")
+    values["temperature_2m_max"] = temperature + rng.uniform(0, 5, rows).astype("float32")
+    values["relative_humidity_2m_mean"] = rng.uniform(20, 100, rows).astype("float32")
+    values["precipitation_sum"] = rng.exponential(2, rows).astype("float32")
+    values["pressure_msl_mean"] = rng.uniform(990, 1030, rows).astype("float32")
+    values["weather_code"] = rng.choice(CODES, rows)
+    values = values.astype("float64").round(4)
+
+    # Same rows as payloads.from_daily, for every city at once (city-major)
+    df = payloads.derive(values, payloads.OPEN_METEO)
+    df.insert(0, "city", np.repeat(cities, days))
+    df.insert(1, "extraction_date", np.tile(dates, len(cities)))
+    df["meta"] = [{"source": payloads.OPEN_METEO}] * rows
+    df["payload"] = values.to_dict("records")
+    return df
+
+
+def write_daily(cities: list[str], day: str, seed: int = 0):
+    from scripts import storage
+    return storage.write_partition(daily_frame(cities, day, seed), day, "meteo_all_cities")
+
+
+def write_historical(cities: list[str], start: str, days: int, seed: int = 0) -> int:
+    # One file per day with every city, the default HISTORICAL_PARTITION_BY
+    from scripts import storage
+    df = historical_frame(cities, start, days, seed)
+    keys = df["extraction_date"].dt.strftime("%Y-%m-%d")
+    for day, group in df.groupby(keys, sort=False):
+        storage.write_partition(group, day, "meteo_all_cities", root="historical-data")
+    return len(df)
@@ -0,0 +1,47 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+DAGS_DIR = Path(__file__).resolve().parent.parent / "airflow" / "dags"
+BENCH_DIR = Path(__file__).resolve().parent.parent / "benchmarks"
+sys.path.insert(0, str(DAGS_DIR))
+sys.path.insert(0, str(BENCH_DIR))
+
+from scripts import metrics, storage  # noqa: E402
+
+
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    # A fresh AIRFLOW_HOME: every path of the scripts derives from storage.BASE_DIR
+    monkeypatch.setattr(storage, "BASE_DIR", tmp_path)
+    monkeypatch.setattr(metrics, "METRICS_DIR", tmp_path / "metrics")
+    return tmp_path
+
+
+@pytest.fixture(params=["csv", "parquet"])
+def fmt(request, home, monkeypatch):
+    if request.param == "parquet":
+        pytest.importorskip("pyarrow")
+    monkeypatch.setattr(storage, "STORAGE_FORMAT", request.param)
+    return request.param
+
+
+@pytest.fixture
+def cache_dir(home, monkeypatch):
+    # The response cache of the extractors, empty and under the temporary home
+    from scripts import http_cache
+    monkeypatch.setattr(http_cache, "CACHE_DIR", home / "cache")
+    monkeypatch.setattr(http_cache, "_caches", {})
+    return home / "cache"
+
+
+@pytest.fixture
+def stub():
+    # Local OpenWeatherMap stub of the extract benchmark, counters reset
+    from bench_extract import WeatherStubHandler, start_stub
+    server, url = start_stub(0.0)
+    WeatherStubHandler.connections = WeatherStubHandler.requests = 0
+    yield url
+    server.shutdown()
+    server.server_close()
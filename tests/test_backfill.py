@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("openmeteo_requests")
+
+from scripts import backfill, payloads  # noqa: E402
+
+CITIES = ["London", "Paris"]
+
+
+@pytest.fixture
+def api(cache_dir, monkeypatch):
+    # fetch_chunk without the network: records the calls, fails the chunks listed in `down`
+    calls, down = [], set()
+
+    def fetch_chunk(client, city, start, end, refresh=False):
+        calls.append((city, start, end, refresh))
+        if (city, start) in down:
+            raise ConnectionError("archive unavailable")
+        dates = pd.date_range(start, end, freq="D", tz="UTC")
+        variables = {name: np.full(len(dates), 12.5, dtype="float32") for name in payloads.OPEN_METEO_DAILY}
+        return payloads.from_daily(city, dates, variables)
+
+    monkeypatch.setattr(backfill, "fetch_chunk", fetch_chunk)
+    monkeypatch.setattr(backfill, "get_client", lambda: None)
+    return calls, down
+
+
+def test_a_partial_run_resumes_from_the_checkpoint(api):
+    calls, down = api
+    down.add(("Paris", "2024-02-01"))
+    with pytest.raises(RuntimeError, match="1 chunks failed"):
+        backfill.backfill("2024-01-01", "2024-03-31", CITIES, max_workers=2)
+    assert len(calls) == 6
+    assert set(backfill._load_checkpoint()) == {
+        backfill._chunk_key(city, start, end)
+        for city, start, end in backfill.month_chunks("2024-01-01", "2024-03-31", CITIES)
+        if (city, start) != ("Paris", "2024-02-01")
+    }
+
+    # The rerun only fetches what the first run did not finish
+    calls.clear()
+    down.clear()
+    assert backfill.backfill("2024-01-01", "2024-03-31", CITIES, max_workers=2) == 1
+    assert calls == [("Paris", "2024-02-01", "2024-02-29", False)]
+    assert all(backfill._load_checkpoint().values())
+
+    raw = backfill.storage.layer_dir("raw", backfill.ROOT)
+    assert sorted(f.name for f in (raw / "2024-02").iterdir()) == [
+        f"meteo_{city}_2024-02-01_2024-02-29.{backfill.storage.RAW_FORMAT}" for city in CITIES
+    ]
+
+    calls.clear()
+    assert backfill.backfill("2024-01-01", "2024-03-31", CITIES, max_workers=2) == 0
+    assert calls == []
+
+
+def test_incomplete_chunks_are_fetched_again_bypassing_the_cache(api):
+    calls, _ = api
+    backfill._mark_done("London", "2024-01-01", "2024-01-31", 31, complete=False)
+
+    # A later month: the incomplete chunk of the earlier run comes along, refreshed
+    assert backfill.backfill("2024-02-01", "2024-02-29", ["London"]) == 2
+    assert sorted(calls) == [
+        ("London", "2024-01-01", "2024-01-31", True),
+        ("London", "2024-02-01", "2024-02-29", False),
+    ]
+    assert backfill._load_checkpoint() == {
+        backfill._chunk_key("London", "2024-01-01", "2024-01-31"): True,
+        backfill._chunk_key("London", "2024-02-01", "2024-02-29"): True,
+    }
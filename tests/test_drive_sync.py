@@ -0,0 +1,86 @@
+import os
+import pytest
+
+pytest.importorskip("googleapiclient")
+
+from fake_drive import FakeDrive  # noqa: E402
+from scripts import load  # noqa: E402
+
+
+@pytest.fixture
+def drive():
+    return FakeDrive()
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    data_dir = tmp_path / "data"
+    (data_dir / "raw" / "2025-07-01").mkdir(parents=True)
+    (data_dir / "raw" / "2025-07-01" / "meteo_chunk_00000.jsonl.gz").write_bytes(b"a" * 100)
+    (data_dir / "processed").mkdir()
+    (data_dir / "processed" / "meteo_global.csv").write_bytes(b"b" * 100)
+    return data_dir
+
+
+@pytest.fixture
+def state(tmp_path, data_dir, drive):
+    state = load.SyncState(data_dir, drive.root_id, path=tmp_path / "sync" / "state.sqlite")
+    yield state
+    state.close()
+
+
+def _sync(drive, data_dir, state) -> dict:
+    return load.sync_directory(drive, data_dir, drive.root_id, "update", max_workers=2, state=state)
+
+
+def _touch(path, content: bytes | None = None) -> None:
+    # A later mtime, whatever the resolution of the file system
+    if content is not None:
+        path.write_bytes(content)
+    mtime_ns = path.stat().st_mtime_ns + 10**9
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_unchanged_files_are_skipped_without_a_request(drive, data_dir, state):
+    assert _sync(drive, data_dir, state) == {"uploaded": 2, "updated": 0, "skipped": 0}
+    trips = drive.round_trips
+
+    assert _sync(drive, data_dir, state) == {"uploaded": 0, "updated": 0, "skipped": 2}
+    assert drive.round_trips == trips
+    assert set(state.files()) == {
+        os.path.join("raw", "2025-07-01", "meteo_chunk_00000.jsonl.gz"),
+        os.path.join("processed", "meteo_global.csv"),
+    }
+
+
+def test_upload_path_follows_the_size_threshold(drive, data_dir, state, monkeypatch):
+    monkeypatch.setattr(load, "SIMPLE_UPLOAD_MAX_BYTES", 1024)
+    monkeypatch.setattr(load, "UPLOAD_CHUNK_BYTES", load.CHUNK_ALIGN)
+    (data_dir / "processed" / "fact_weather.parquet").write_bytes(b"c" * (2 * load.CHUNK_ALIGN + 1))
+
+    assert _sync(drive, data_dir, state)["uploaded"] == 3
+    # Two small files in one multipart request each, the large one in a session plus 3 chunks
+    assert drive.calls["create"] == 3
+    assert drive.calls["upload_chunk"] == 3
+    sizes = sorted(f["size"] for f in drive.store.values() if f["mimeType"] != load.MIMETYPE_FOLDER)
+    assert sizes == [100, 100, 2 * load.CHUNK_ALIGN + 1]
+
+
+def test_a_changed_mtime_sends_the_file_again(drive, data_dir, state):
+    _sync(drive, data_dir, state)
+    table = data_dir / "processed" / "meteo_global.csv"
+    key = os.path.join("processed", "meteo_global.csv")
+
+    # Rewritten with the same size: only the mtime tells it changed
+    _touch(table, b"B" * 100)
+    assert _sync(drive, data_dir, state) == {"uploaded": 0, "updated": 1, "skipped": 1}
+    assert drive.calls["update"] == 1
+    remote = drive.store[state.files()[key]["file_id"]]
+    assert remote["md5"] == load.md5_checksum(table)
+    assert state.files()[key]["mtime_ns"] == table.stat().st_mtime_ns
+
+    # Same bytes under a new mtime: hashed again, not sent again
+    _touch(table)
+    assert _sync(drive, data_dir, state) == {"uploaded": 0, "updated": 0, "skipped": 2}
+    assert drive.calls["update"] == 1
+    assert state.files()[key]["mtime_ns"] == table.stat().st_mtime_ns
@@ -0,0 +1,62 @@
+import pytest
+
+from scripts import extract
+
+
+class FakeClock:
+    # time.monotonic and time.sleep of the limiter, without the waiting
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+def test_rate_limiter_spaces_calls_over_the_period(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(extract.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(extract.time, "sleep", clock.sleep)
+    limiter = extract.RateLimiter(3, period=60.0)
+
+    starts = []
+    for _ in range(7):
+        limiter.wait()
+        starts.append(clock.now)
+
+    # 3 calls right away, the next ones once the oldest call of the window is 60s old
+    assert starts == [0.0, 0.0, 0.0, 60.0, 60.0, 60.0, 120.0]
+    for first, later in zip(starts, starts[3:]):
+        assert later - first >= 60.0
+
+
+@pytest.mark.parametrize("chunk_size, expected", [(200, 60), (10, 30), (5, 15)])
+def test_chunks_split_the_quota_between_the_chunks_that_can_run(monkeypatch, chunk_size, expected):
+    # 18 cities in the registry: 1, 2 and 4 chunks for 4 slots
+    calls = {}
+    monkeypatch.setattr(extract, "extract_all_cities", lambda cities, *args, **kwargs: calls.update(kwargs))
+    extract.extract_city_chunk(0, "key", "2025-07-01", chunk_size=chunk_size, calls_per_minute=60, slots=4)
+    assert calls["calls_per_minute"] == expected
+
+
+def test_a_batch_lands_as_one_file_sorted_by_city(cache_dir, stub):
+    from bench_extract import WeatherStubHandler
+    from scripts import cities, storage
+
+    names = cities.city_names()[::-1] + ["Nowhere"]         # "Nowhere" is queried by name
+    out_file = extract.extract_all_cities(
+        names, "stub-key", "2025-07-01", url=stub, max_workers=4, calls_per_minute=10**6, batch_name="batch"
+    )
+
+    assert [f.name for f in (storage.layer_dir("raw") / "2025-07-01").iterdir()] == [f"batch.{storage.RAW_FORMAT}"]
+    df = storage.read_file(storage.layer_dir("raw") / "2025-07-01" / f"batch.{storage.RAW_FORMAT}", nested=True)
+    assert str(out_file).endswith(f"batch.{storage.RAW_FORMAT}")
+    assert df["city"].tolist() == sorted(names)
+    assert df["temperature"].eq(21.3).all() and df["pluie_mm"].eq(0.2).all()
+    assert all(meta["batch"] == "batch" for meta in df["meta"])
+    # One request per city over at most one keep-alive connection per worker
+    assert WeatherStubHandler.requests == len(names)
+    assert WeatherStubHandler.connections <= 4
+
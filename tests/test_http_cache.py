@@ -0,0 +1,113 @@
+import sqlite3
+import time
+import pytest
+import requests
+
+from bench_extract import WeatherStubHandler
+from scripts import http_cache
+
+OWM_URL = "https://api.openweathermap.org/data/2.5/weather"
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = http_cache.ResponseCache(tmp_path / "http_cache.sqlite")
+    yield cache
+    cache._conn.close()
+
+
+def _session(cache: http_cache.ResponseCache) -> requests.Session:
+    session = requests.Session()
+    session.mount("http://", http_cache.CachingAdapter(cache))
+    return session
+
+
+def _size_total(cache: http_cache.ResponseCache) -> tuple[int, int]:
+    # (running total, actual sum of the rows)
+    return cache._conn.execute(
+        "SELECT total, (SELECT COALESCE(SUM(size), 0) FROM responses) FROM cache_size"
+    ).fetchone()
+
+
+def test_entries_expire_after_their_ttl(cache, monkeypatch):
+    now = time.time()
+    monkeypatch.setattr(http_cache.time, "time", lambda: now)
+    cache.set("k", OWM_URL, 200, {}, b"{}", ttl=600)
+    assert cache.get("k") is not None
+
+    monkeypatch.setattr(http_cache.time, "time", lambda: now + 601)
+    assert not cache.contains("k")
+    assert cache.get("k") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entries_are_evicted_first(cache, monkeypatch):
+    cache.max_bytes = 250
+    clock = iter(range(1_000_000, 2_000_000))
+    monkeypatch.setattr(http_cache.time, "time", lambda: next(clock))
+    for key in "abc":
+        cache.set(key, OWM_URL, 200, {}, b"x" * 100, ttl=None)
+        if key == "a":
+            continue
+        # "a" read after "b" was stored: "b" is the least recently used one
+        cache.get("a")
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.evictions == 1
+    assert cache.stats()["bytes"] == 200
+    assert _size_total(cache) == (200, 200)
+
+
+def test_size_total_follows_replaced_and_deleted_rows(cache):
+    cache.set("k", OWM_URL, 200, {}, b"x" * 10, ttl=None)
+    cache.set("k", OWM_URL, 200, {}, b"x" * 30, ttl=None)
+    cache.set("j", OWM_URL, 200, {}, b"x" * 5, ttl=0)
+    assert _size_total(cache) == (35, 35)
+
+    cache.get("j")                              # expired: deleted on read
+    assert _size_total(cache) == (30, 30)
+
+
+def test_the_api_key_is_never_stored(cache, stub, monkeypatch):
+    monkeypatch.setitem(http_cache.ENDPOINT_TTLS, "127.0.0.1", 600)
+    with _session(cache) as session:
+        session.get(stub, params={"appid": "old-key", "q": "Paris"}).raise_for_status()
+        # A rotated key is served from the cache: the key is not part of the cache key
+        session.get(stub, params={"appid": "new-key", "q": "Paris"}).raise_for_status()
+
+    assert WeatherStubHandler.requests == 1
+    assert cache.hits == 1
+    urls = [url for (url,) in cache._conn.execute("SELECT url FROM responses")]
+    assert urls and all("appid" not in url and "key" not in url for url in urls)
+
+
+def test_an_old_cache_file_is_migrated_once(tmp_path):
+    path = tmp_path / "http_cache.sqlite"
+    conn = sqlite3.connect(path)
+    conn.execute(
+        """CREATE TABLE responses (
+            key TEXT PRIMARY KEY, url TEXT NOT NULL, status INTEGER NOT NULL, headers TEXT NOT NULL,
+            body BLOB NOT NULL, size INTEGER NOT NULL, expires_at REAL, last_access REAL NOT NULL
+        )"""
+    )
+    conn.execute(
+        "INSERT INTO responses VALUES ('k', ?, 200, '{}', x'00', 1, NULL, 0)",
+        (f"{OWM_URL}?appid=secret&q=Paris",),
+    )
+    conn.commit()
+
+    cache = http_cache.ResponseCache(path)
+    assert cache._conn.execute("PRAGMA user_version").fetchone()[0] == http_cache.SCHEMA_VERSION
+    assert cache._conn.execute("SELECT url FROM responses").fetchone()[0] == f"{OWM_URL}?q=Paris"
+    assert _size_total(cache) == (1, 1)
+    cache._conn.close()
+
+    # Already migrated: a second open neither rewrites the rows nor reseeds the total
+    conn.execute("UPDATE responses SET url = ?", (f"{OWM_URL}?appid=other",))
+    conn.commit()
+    conn.close()
+    cache = http_cache.ResponseCache(path)
+    assert cache._conn.execute("SELECT url FROM responses").fetchone()[0] == f"{OWM_URL}?appid=other"
+    assert _size_total(cache) == (1, 1)
+    cache._conn.close()
@@ -0,0 +1,75 @@
+import pandas as pd
+import pytest
+
+from scripts import merge, storage
+
+
+def _rows(days: list[str], temperature: float, cities=("Paris", "Lyon")) -> pd.DataFrame:
+    return pd.DataFrame([
+        {"city": city, "extraction_date": pd.Timestamp(day), "temperature": temperature,
+         "humidite": 50.0, "pluie_mm": 0.0, "meteo": "clear", "temp_min": 1.0, "temp_max": 2.0}
+        for day in days for city in cities
+    ])
+
+
+def _keys() -> pd.DataFrame:
+    return storage.read_table("meteo_global", "processed")[merge.KEY_COLS]
+
+
+def _fail_once(monkeypatch, name: str):
+    original = getattr(merge, name)
+    calls = []
+
+    def failing(*args, **kwargs):
+        if not calls:
+            calls.append(1)
+            raise RuntimeError(f"killed in {name}")
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(merge, name, failing)
+
+
+def test_retry_after_append_inserts_nothing(fmt, monkeypatch):
+    merge.upsert_rows(_rows(["2025-01-01", "2025-01-02"], 10.0))
+    new_rows = _rows(["2025-01-03", "2025-02-01"], 11.0)
+
+    # The rows are in the table, the index and the manifest never heard of them
+    _fail_once(monkeypatch, "_index_rows")
+    with pytest.raises(RuntimeError):
+        merge.upsert_rows(new_rows)
+
+    report = merge.upsert_rows(new_rows)
+    assert report == {"inserted": 0, "updated": 0, "skipped": 4}
+    keys = _keys()
+    assert len(keys) == 8
+    assert not keys.duplicated().any()
+    assert merge.load_manifest()["pending_months"] == []
+    # And a plain rerun still does nothing
+    assert merge.upsert_rows(new_rows)["skipped"] == 4
+
+
+def test_retry_after_replacing_months_keeps_one_row_per_key(fmt, monkeypatch):
+    merge.upsert_rows(_rows(["2025-01-01", "2025-02-01"], 10.0))
+    changed = pd.concat([_rows(["2025-01-01"], 12.0), _rows(["2025-02-02"], 12.0)])
+
+    _fail_once(monkeypatch, "_index_rows")
+    with pytest.raises(RuntimeError):
+        merge.upsert_rows(changed)
+
+    merge.upsert_rows(changed)
+    table = storage.read_table("meteo_global", "processed")
+    assert not table[merge.KEY_COLS].duplicated().any()
+    assert len(table) == 6
+    assert set(table.loc[table["extraction_date"] == "2025-01-01", "temperature"]) == {12.0}
+
+
+def test_retry_after_full_rewrite(fmt, monkeypatch):
+    _fail_once(monkeypatch, "_index_rows")
+    with pytest.raises(RuntimeError):
+        merge.upsert_rows(_rows(["2025-01-01"], 10.0))
+
+    report = merge.upsert_rows(_rows(["2025-01-01"], 10.0))
+    assert report["inserted"] == 0
+    assert len(_keys()) == 2
+    # The transform is told to rebuild
+    assert merge.load_manifest()["rewrites"] >= 2
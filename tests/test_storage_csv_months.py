@@ -0,0 +1,90 @@
+import os
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from scripts import storage
+
+PARTITION_COLS = [storage.MONTH_COL, "city"]
+
+
+@pytest.fixture(autouse=True)
+def _home(home):
+    return home
+
+
+def _rows(dates: list[str], temperature: float, city: str = "Paris") -> pd.DataFrame:
+    return pd.DataFrame({
+        "city": city,
+        "extraction_date": pd.to_datetime(dates),
+        "temperature": temperature,
+    })
+
+
+def _write(df: pd.DataFrame, mode: str = "overwrite") -> Path:
+    return storage.write_table(df, "meteo_global", "processed", mode=mode, partition_cols=PARTITION_COLS, fmt="csv")
+
+
+def _read(month: str | None = None) -> pd.DataFrame:
+    filters = None
+    if month is not None:
+        start = pd.Period(month, "M").to_timestamp()
+        filters = [("extraction_date", ">=", start), ("extraction_date", "<", start + pd.offsets.MonthBegin())]
+    return storage.read_table("meteo_global", "processed", filters=filters, fmt="csv")
+
+
+def _temperatures(df: pd.DataFrame) -> dict[str, float]:
+    return dict(zip(df["extraction_date"].dt.strftime("%Y-%m-%d"), df["temperature"]))
+
+
+def test_tail_appends_stay_in_place():
+    path = _write(_rows(["2025-01-30", "2025-01-31"], 10.0))
+    inode = os.stat(path).st_ino
+    _write(_rows(["2025-02-01"], 11.0), mode="append")
+    # A rerun of the last month appends to it again
+    _write(_rows(["2025-02-02"], 12.0), mode="append")
+
+    assert os.stat(path).st_ino == inode
+    assert storage.month_partitioned("meteo_global", "processed", fmt="csv")
+    assert _temperatures(_read("2025-02")) == {"2025-02-01": 11.0, "2025-02-02": 12.0}
+    assert len(_read()) == 4
+
+
+def test_backdated_rows_rewrite_a_copy():
+    path = _write(_rows(["2025-02-01", "2025-03-01"], 10.0))
+    inode = os.stat(path).st_ino
+    _write(_rows(["2025-01-15", "2025-02-15"], 5.0), mode="append")
+
+    assert os.stat(path).st_ino != inode
+    assert _read()["extraction_date"].dt.strftime("%Y-%m").tolist() == ["2025-01", "2025-02", "2025-02", "2025-03"]
+    assert _temperatures(_read("2025-01")) == {"2025-01-15": 5.0}
+    assert _temperatures(_read("2025-02")) == {"2025-02-01": 10.0, "2025-02-15": 5.0}
+    assert _temperatures(_read("2025-03")) == {"2025-03-01": 10.0}
+
+
+def test_replace_only_rewrites_its_months():
+    _write(_rows(["2025-01-01", "2025-02-01", "2025-02-02", "2025-03-01"], 10.0))
+    _write(_rows(["2025-02-01"], 20.0), mode="replace")
+
+    assert _temperatures(_read("2025-01")) == {"2025-01-01": 10.0}
+    assert _temperatures(_read("2025-02")) == {"2025-02-01": 20.0}
+    assert _temperatures(_read("2025-03")) == {"2025-03-01": 10.0}
+    assert storage.month_partitioned("meteo_global", "processed", fmt="csv")
+
+
+def test_interrupted_rewrite_keeps_the_table(monkeypatch):
+    path = _write(_rows(["2025-01-01", "2025-02-01", "2025-03-01"], 10.0))
+    before = path.read_bytes()
+
+    def killed(*args, **kwargs):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(storage, "_copy_range", killed)
+    with pytest.raises(KeyboardInterrupt):
+        _write(_rows(["2025-01-02"], 5.0), mode="append")
+
+    assert path.read_bytes() == before
+    assert [f.name for f in path.parent.iterdir() if f.name.endswith(".tmp")] == []
+    assert storage.month_partitioned("meteo_global", "processed", fmt="csv")
+    assert len(_read()) == 3
@@ -0,0 +1,140 @@
+import pandas as pd
+import pytest
+
+from scripts import deltas, merge, rollups
+from scripts.transform import load_state, transform_to_star_schema
+
+CITIES = ["Paris", "Lyon", "Nice"]
+MEASURES = ["temperature", "humidite", "pluie_mm", "temp_min", "temp_max"]
+
+
+def _merge(days: list[str], cities: list[str], offset: float = 0.0, source: str = "openweathermap") -> None:
+    rows = pd.DataFrame([
+        {"city": city, "extraction_date": pd.Timestamp(day),
+         "temperature": 10.0 + i + j + offset, "humidite": 50.0 + i, "pluie_mm": float(j % 3),
+         "meteo": "clear", "temp_min": 5.0 + i, "temp_max": 15.0 + j + offset, "code_meteo": 800.0}
+        for i, city in enumerate(cities) for j, day in enumerate(days)
+    ])
+    merge.upsert_rows(rows, source=source)
+
+
+def _days(start: str, count: int) -> list[str]:
+    return pd.date_range(start, periods=count, freq="D").strftime("%Y-%m-%d").tolist()
+
+
+def _star_schema() -> dict[str, pd.DataFrame]:
+    # Facts and rollups on natural keys, the way a consumer reads them: snapshot + deltas
+    dim_city = deltas.read("dim_city")
+    dim_date = deltas.read("dim_date").assign(date=lambda d: pd.to_datetime(d["date"]).dt.strftime("%Y-%m-%d"))
+    facts = (
+        deltas.read("fact_weather")
+        .merge(dim_city, on="city_id").merge(dim_date[["date_id", "date"]], on="date_id")
+        [["city", "date", *MEASURES, "weather_condition_id"]]
+        .sort_values(["city", "date"]).reset_index(drop=True)
+    )
+    out = {
+        "facts": facts,
+        "dim_city": dim_city.sort_values("city_id").reset_index(drop=True),
+        "dim_date": dim_date.sort_values("date_id").reset_index(drop=True),
+    }
+    for name, keys in rollups.ROLLUPS.items():
+        out[name] = (
+            rollups.read(name).merge(dim_city, on="city_id").drop(columns="city_id")
+            .sort_values(["city", *keys]).reset_index(drop=True)
+        )
+    return out
+
+
+def _assert_same(left: dict, right: dict) -> None:
+    assert left.keys() == right.keys()
+    for name in left:
+        pd.testing.assert_frame_equal(
+            left[name], right[name][left[name].columns], check_dtype=False, check_exact=False, obj=name
+        )
+
+
+def _daily_runs() -> None:
+    _merge(_days("2025-01-01", 40), CITIES)
+    transform_to_star_schema(incremental=False)
+    # New day, new city, rerun with other values, backdated and updated rows,
+    # the other API on a day already merged
+    _merge(["2025-02-10"], CITIES)
+    transform_to_star_schema()
+    _merge(["2025-02-11"], [*CITIES, "Brand New"])
+    transform_to_star_schema()
+    _merge(["2025-02-11"], [*CITIES, "Brand New"], offset=3.0)
+    transform_to_star_schema()
+    _merge(["2024-12-31"], CITIES)
+    _merge(["2025-01-05"], CITIES[:1], offset=7.0)
+    transform_to_star_schema()
+    _merge(["2025-02-10"], CITIES, offset=1.5, source="open-meteo")
+    transform_to_star_schema()
+
+
+def test_incremental_runs_match_a_full_rebuild(fmt):
+    _daily_runs()
+    incremental = _star_schema()
+
+    assert len(incremental["facts"]) == 3 * 43 + 1
+    assert not incremental["facts"].duplicated(["city", "date"]).any()
+    assert incremental["dim_city"]["city"].is_unique
+    assert incremental["dim_date"]["date"].is_unique
+
+    transform_to_star_schema(incremental=False)
+    _assert_same(incremental, _star_schema())
+    # Folding the deltas into the snapshots changes nothing either
+    deltas.compact()
+    _assert_same(incremental, _star_schema())
+
+
+def test_retry_after_the_delta_write(fmt, monkeypatch):
+    _merge(_days("2025-01-01", 10), CITIES)
+    transform_to_star_schema(incremental=False)
+    _merge(["2025-01-11"], [*CITIES, "Brand New"])
+
+    # Killed after its deltas (new ids, facts) and before its state
+    update_rollups, calls = rollups.update_rollups, []
+
+    def killed(*args, **kwargs):
+        if not calls:
+            calls.append(1)
+            raise RuntimeError("killed")
+        return update_rollups(*args, **kwargs)
+
+    monkeypatch.setattr(rollups, "update_rollups", killed)
+    with pytest.raises(RuntimeError):
+        transform_to_star_schema()
+    transform_to_star_schema()
+    retried = _star_schema()
+
+    assert retried["dim_city"]["city"].tolist().count("Brand New") == 1
+    assert retried["dim_city"]["city_id"].is_unique
+    assert retried["dim_date"]["date"].is_unique and retried["dim_date"]["date_id"].is_unique
+    assert len(retried["facts"]) == 3 * 11 + 1
+
+    transform_to_star_schema(incremental=False)
+    _assert_same(retried, _star_schema())
+
+
+def test_process_pool_matches_one_process(fmt):
+    _merge(_days("2025-01-01", 30), [*CITIES, "Brand New"])
+    _merge(_days("2025-01-20", 5), CITIES[:2], offset=1.5, source="open-meteo")
+    # A weather code without a meteo_id in one shard only
+    merge.upsert_rows(pd.DataFrame([{"city": "Nice", "extraction_date": pd.Timestamp("2025-01-31"), "code_meteo": 999.0}]))
+    transform_to_star_schema(incremental=False, workers=1)
+    single = {name: deltas.read(name) for name in ("fact_weather", "dim_city", "dim_date")}
+    single.update({name: rollups.read(name) for name in rollups.ROLLUPS})
+    state = load_state()
+
+    # A one-core host runs the pool too, only slower
+    transform_to_star_schema(incremental=False, workers=2)
+    for name in ("fact_weather", "dim_city", "dim_date"):
+        pd.testing.assert_frame_equal(deltas.read(name), single[name], obj=name)
+    for name in rollups.ROLLUPS:
+        pd.testing.assert_frame_equal(rollups.read(name), single[name], obj=name)
+    assert {**load_state(), "rebuilds": 0} == {**state, "rebuilds": 0}
+
+    # The daily runs that follow see the same state
+    _merge(["2025-02-01"], CITIES)
+    transform_to_star_schema()
+    assert len(deltas.read("fact_weather")) == 4 * 30 + 1 + 3